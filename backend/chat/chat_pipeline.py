@@ -0,0 +1,587 @@
+"""
+Пайплайн ответа чата без HTTP-обёртки: контекст тенанта, RAG и quality gate, вызов LLM через
+llm_router, сохранение истории и форматирование под канал. Его вызывают handler чата (виджет)
+и webhook мессенджеров напрямую в своём процессе, без лишнего сетевого хопа.
+"""
+import json
+import os
+import sys
+import hashlib
+from datetime import timedelta
+import re
+
+from typing import Callable, Optional
+
+sys.path.append('/function/code')
+from timezone_helper import now_moscow
+from token_logger import log_token_usage
+from system_prompt import DEFAULT_SYSTEM_PROMPT
+from formatting_helper import format_with_settings
+from tenant_context import load_tenant_context, resolve_tenant_slug
+from provider_clients import get_http_client, provider_timings, reset_provider_timings
+from llm_stream import StreamWriter
+from llm_router import ChatRouter, build_hops, get_provider_and_api_model
+from vector_search import get_retrieval_mode, search_pgvector
+from chunk_index_cache import get_tenant_index, get_chunks_version
+from query_embedding_cache import get_cached_query_embedding, store_query_embedding
+from answer_cache import is_answer_cache_enabled, make_prompt_hash, find_cached_answer, store_answer
+from tariff_search import is_tariff_rows_enabled, search_tariff_rows, build_tariff_context
+from db_pool import get_connection, release_connection, request_stats
+
+from quality_gate import (
+    build_context_with_scores, 
+    quality_gate, 
+    classify_query_type,
+    compose_system,
+    rag_debug_log,
+    low_overlap_rate,
+    update_low_overlap_stats,
+    get_tenant_topk,
+    RAG_DEBUG,
+    RAG_TOPK_FALLBACK,
+    RAG_LOW_OVERLAP_THRESHOLD,
+    RAG_LOW_OVERLAP_START_TOPK5
+)
+
+
+class ChatPipelineError(Exception):
+    """Запрос не может быть обработан; response — готовый HTTP-ответ handler"""
+
+    def __init__(self, response: dict):
+        try:
+            message = json.loads(response.get('body') or '{}').get('error')
+        except ValueError:
+            message = None
+        super().__init__(message or f"chat error {response.get('statusCode')}")
+        self.response = response
+
+
+def _chain(*callbacks):
+    def call(text: str):
+        for callback in callbacks:
+            callback(text)
+    return call
+
+
+def run_chat(tenant_id: Optional[int], session_id: str, user_message: str, channel: str = 'widget',
+             tenant_slug: Optional[str] = None, stream_id: Optional[str] = None,
+             on_partial: Optional[Callable[[str], None]] = None, request_id: Optional[str] = None) -> dict:
+    """
+    Ответ ассистента на сообщение пользователя.
+    request_id — идентификатор вызова функции или задачи очереди для rag_debug_log;
+    stream_id — писать накопленный ответ в chat_streams (виджет опрашивает stream_poll);
+    on_partial(text) — получать накопленный неотформатированный ответ по мере генерации.
+    Возвращает {'message': ответ, отформатированный под channel, 'sessionId', 'debug'};
+    при ошибке запроса (нет ключей, неизвестная модель, провайдеры недоступны) — ChatPipelineError.
+    """
+    if not user_message:
+        raise ChatPipelineError({
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'message required'}),
+            'isBase64Encoded': False
+        })
+
+    conn = None
+    stream_writer = None
+    reset_provider_timings()
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        
+        # Если передан slug, получаем tenant_id
+        if tenant_slug and not tenant_id:
+            tenant_id = resolve_tenant_slug(cur, tenant_slug)
+            if tenant_id:
+                print(f"✅ DEBUG: Resolved tenant_slug '{tenant_slug}' to tenant_id={tenant_id}")
+            else:
+                tenant_id = 1
+                print(f"⚠️ DEBUG: tenant_slug '{tenant_slug}' not found, using tenant_id=1")
+        elif not tenant_id:
+            tenant_id = 1
+            print("⚠️ DEBUG: No tenant_slug or tenant_id provided, defaulting to tenant_id=1")
+        
+        # Обеспечиваем, что tenant_id - это integer
+        tenant_id = int(tenant_id)
+
+        # Настройки тенанта, прокси, ключи, форматирование и история сессии — одним запросом
+        tenant_ctx, history_rows = load_tenant_context(cur, tenant_id, session_id)
+        default_prompt_from_db = tenant_ctx.default_prompt or DEFAULT_SYSTEM_PROMPT
+        settings_row = (
+            tenant_ctx.ai_settings, tenant_ctx.embedding_provider,
+            tenant_ctx.embedding_query_model, tenant_ctx.quality_gate_settings
+        ) if tenant_ctx.has_settings else None
+        
+        embedding_provider = 'yandex'
+        quality_gate_settings = {}
+        
+        if settings_row:
+            if settings_row[1]:
+                embedding_provider = settings_row[1]
+            if settings_row[3]:
+                quality_gate_settings = settings_row[3]
+        
+        # Получаем tenant-specific RAG top_k из ai_settings, используя get_tenant_topk
+        tenant_overrides = settings_row[0] if (settings_row and settings_row[0]) else {}
+        tenant_rag_topk_default, tenant_rag_topk_fallback = get_tenant_topk(tenant_overrides)
+        # Принудительная конвертация в int (на случай если где-то осталась строка)
+        tenant_rag_topk_default = int(tenant_rag_topk_default)
+        tenant_rag_topk_fallback = int(tenant_rag_topk_fallback)
+        
+        # Режим работы без RAG (только на system_prompt с историей)
+        enable_pure_prompt_mode = tenant_overrides.get('enable_pure_prompt_mode', False)
+        print(f"DEBUG: Tenant {tenant_id} RAG settings: top_k_default={tenant_rag_topk_default}, top_k_fallback={tenant_rag_topk_fallback}, pure_prompt_mode={enable_pure_prompt_mode}")
+        
+        if settings_row and settings_row[0]:
+            settings = settings_row[0]
+            ai_model = settings.get('model', 'yandexgpt')
+            ai_provider = settings.get('provider', 'yandex')
+            
+            print(f"DEBUG: Loaded from DB - model={ai_model}, provider={ai_provider}")
+            
+            # Получаем реальные значения для API
+            try:
+                chat_api_model, ai_provider = get_provider_and_api_model(ai_model, ai_provider)
+                print(f"DEBUG: Mapped to API - model={chat_api_model}, provider={ai_provider}")
+            except ValueError as e:
+                raise ChatPipelineError({
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)}),
+                    'isBase64Encoded': False
+                })
+            # Безопасное преобразование типов (значения могут быть строками из JSON)
+            def safe_float(value, default):
+                if isinstance(value, (int, float)):
+                    return float(value)
+                try:
+                    return float(value) if value else default
+                except (ValueError, TypeError):
+                    return default
+            
+            def safe_int(value, default):
+                if isinstance(value, int):
+                    return value
+                try:
+                    return int(float(value)) if value else default
+                except (ValueError, TypeError):
+                    return default
+            
+            ai_temperature = safe_float(settings.get('temperature'), 0.7)
+            ai_top_p = safe_float(settings.get('top_p'), 0.95)
+            ai_frequency_penalty = safe_float(settings.get('frequency_penalty'), 0.0)
+            ai_presence_penalty = safe_float(settings.get('presence_penalty'), 0.0)
+            ai_max_tokens = safe_int(settings.get('max_tokens'), 2000)
+            system_prompt_template = settings.get('system_prompt') or default_prompt_from_db
+
+        # История загружена вместе с контекстом тенанта ДО эмбеддингов для обогащения запроса
+        history_messages_preview = [{"role": row[0], "content": row[1]} for row in reversed(history_rows)]
+        
+        # Конвертация относительных дат в абсолютные
+        def convert_relative_dates(text):
+            """Конвертирует относительные даты (завтра, послезавтра и т.д.) в абсолютные"""
+            today = now_moscow().date()
+            
+            relative_patterns = {
+                r'(?:на\s+)?завтра': today + timedelta(days=1),
+                r'(?:на\s+)?послезавтра': today + timedelta(days=2),
+                r'через\s+(\d+)\s+(?:день|дня|дней)': lambda m: today + timedelta(days=int(m.group(1))),
+                r'через\s+неделю': today + timedelta(weeks=1),
+                r'через\s+(\d+)\s+(?:неделю|недели|недель)': lambda m: today + timedelta(weeks=int(m.group(1))),
+                r'через\s+месяц': today + timedelta(days=30),
+                r'на\s+следующей\s+неделе': today + timedelta(weeks=1),
+            }
+            
+            months_ru = [
+                'января', 'февраля', 'марта', 'апреля', 'мая', 'июня',
+                'июля', 'августа', 'сентября', 'октября', 'ноября', 'декабря'
+            ]
+            
+            converted_text = text
+            for pattern, replacement in relative_patterns.items():
+                match = re.search(pattern, text, re.IGNORECASE)
+                if match:
+                    if callable(replacement):
+                        date_obj = replacement(match)
+                    else:
+                        date_obj = replacement
+                    
+                    day = date_obj.day
+                    month = months_ru[date_obj.month - 1]
+                    date_str = f"{day} {month}"
+                    converted_text = re.sub(pattern, date_str, converted_text, flags=re.IGNORECASE)
+                    print(f"DEBUG: Converted relative date '{match.group()}' to '{date_str}'")
+            
+            return converted_text
+        
+        # Извлекаем даты из истории для обогащения запроса эмбеддинга
+        def extract_date_from_history(history_msgs):
+            """Извлекает упоминания дат из истории для контекста"""
+            date_patterns = [
+                r'\d{1,2}\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)',
+                r'\d{1,2}\.\d{1,2}\.\d{2,4}',
+                r'(январ|феврал|март|апрел|ма|июн|июл|август|сентябр|октябр|ноябр|декабр)[а-я]{0,2}\s+\d{4}',
+                r'Период:\s*\d{2}\.\d{2}\.\d{4}-\d{2}\.\d{2}\.\d{4}'
+            ]
+            for msg in reversed(history_msgs):  # Проверяем от старых к новым
+                if msg['role'] == 'user':
+                    text = msg['content'].lower()
+                    for pattern in date_patterns:
+                        match = re.search(pattern, text, re.IGNORECASE)
+                        if match:
+                            return match.group()
+            return None
+        
+        # Конвертируем относительные даты в абсолютные в запросе пользователя
+        user_message_converted = convert_relative_dates(user_message)
+        if RAG_DEBUG:
+            print(f"DEBUG: User message BEFORE conversion: '{user_message}'")
+            print(f"DEBUG: User message AFTER conversion: '{user_message_converted}' (changed: {user_message_converted != user_message})")
+        
+        context_date = extract_date_from_history(history_messages_preview)
+        enriched_query = user_message_converted
+        if context_date and len(user_message_converted.split()) <= 3:  # Обогащаем только короткие запросы
+            enriched_query = f"{user_message_converted} {context_date}"
+            if RAG_DEBUG:
+                print(f"DEBUG: Enriched query for embedding: '{enriched_query}' (original: '{user_message_converted}')")
+
+        query_embedding = None
+
+        # Вопрос о ценах — сначала строки тарифов из таблиц прайс-листа: точная выборка по датам
+        # вместо чанков, без эмбеддинга запроса и эвристик quality gate
+        tariff_rows, tariff_period = [], None
+        if (not enable_pure_prompt_mode and is_tariff_rows_enabled(tenant_overrides)
+                and classify_query_type(user_message_converted) == 'tariffs'):
+            try:
+                tariff_rows, tariff_period = search_tariff_rows(cur, tenant_id, enriched_query, now_moscow().date())
+            except Exception as tariff_error:
+                print(f"⚠️ tariff rows search failed, falling back to RAG: {tariff_error}")
+                conn.rollback()
+                tariff_rows = []
+
+        # Если включен режим Pure Prompt Mode - ПОЛНОСТЬЮ пропускаем RAG
+        if enable_pure_prompt_mode:
+            print(f"✅ Pure Prompt Mode enabled for tenant {tenant_id}, skipping RAG entirely")
+            context_str = ""
+            context_ok = True
+            gate_reason = "pure_prompt_mode_enabled"
+            sims = []
+            gate_debug = {'mode': 'pure_prompt'}
+        elif tariff_rows:
+            context_str = build_tariff_context(tariff_rows, tariff_period)
+            context_ok = True
+            gate_reason = "ok:tariffs:rows"
+            sims = []
+            gate_debug = {
+                'mode': 'tariff_rows',
+                'query_type': 'tariffs',
+                'context_len': len(context_str),
+                'tariff_rows': len(tariff_rows)
+            }
+            print(f"💰 Tariff rows for tenant {tenant_id}: {len(tariff_rows)} rows, period={tariff_period}")
+        else:
+            # Обычный режим: поиск по эмбеддингам и RAG
+            try:
+                if embedding_provider == 'yandex':
+                    # ВСЕГДА используем PROJECT секреты для эмбеддингов (не tenant ключи!)
+                    yandex_api_key = os.environ.get('YANDEXGPT_API_KEY')
+                    yandex_folder_id = os.environ.get('YANDEXGPT_FOLDER_ID')
+                    
+                    if not yandex_api_key or not yandex_folder_id:
+                        raise ChatPipelineError({
+                            'statusCode': 500,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'PROJECT Yandex API keys not configured'}),
+                            'isBase64Encoded': False
+                        })
+                    
+                    embedding_model_uri = f'emb://{yandex_folder_id}/text-search-query/latest'
+                    query_embedding = get_cached_query_embedding(cur, embedding_model_uri, enriched_query)
+                    
+                    if query_embedding is None:
+                        print(f"🚀 SENDING TO YANDEX (PROJECT keys): api_key={yandex_api_key[:10]}..., folder_id={yandex_folder_id}")
+                        
+                        emb_response = get_http_client('yandex').post(
+                            'https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding',
+                            headers={
+                                'Authorization': f'Api-Key {yandex_api_key}',
+                                'Content-Type': 'application/json'
+                            },
+                            json={
+                                'modelUri': embedding_model_uri,
+                                'text': enriched_query  # Используем обогащённый запрос вместо user_message
+                            }
+                        )
+                        
+                        if emb_response.status_code != 200:
+                            print(f"Yandex Embedding API error: {emb_response.status_code}, {emb_response.text}")
+                            raise Exception(f"Yandex API returned {emb_response.status_code}: {emb_response.text}")
+                        
+                        emb_data = emb_response.json()
+                        print(f"DEBUG: Yandex embedding response keys: {emb_data.keys()}")
+                        
+                        if 'embedding' not in emb_data:
+                            print(f"ERROR: No 'embedding' in response: {emb_data}")
+                            raise Exception(f"Yandex API response missing 'embedding': {emb_data}")
+                        
+                        query_embedding = emb_data['embedding']
+                        store_query_embedding(cur, embedding_model_uri, enriched_query, query_embedding)
+                        
+                        # Логируем использование токенов для запроса (примерно по количеству символов)
+                        tokens_estimate = min(len(user_message) // 4, 256)
+                        log_token_usage(
+                            tenant_id=tenant_id,
+                            operation_type='embedding_query',
+                            model='text-search-query',
+                            tokens_used=tokens_estimate,
+                            request_id=session_id
+                        )
+                else:
+                    raise ChatPipelineError({
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f'Неизвестный провайдер эмбеддингов: {embedding_provider}'}),
+                        'isBase64Encoded': False
+                    })
+                
+                search_top_k = max(tenant_rag_topk_default, tenant_rag_topk_fallback)
+                scored_chunks = None
+
+                if get_retrieval_mode(tenant_overrides) == 'pgvector':
+                    try:
+                        scored_chunks = search_pgvector(cur, tenant_id, query_embedding, search_top_k)
+                    except Exception as pgvector_error:
+                        print(f"⚠️ pgvector search failed, falling back to python scan: {pgvector_error}")
+                        conn.rollback()
+                        scored_chunks = None
+                    if scored_chunks is not None:
+                        print(f"DEBUG: pgvector search returned {len(scored_chunks)} chunks")
+
+                if not scored_chunks:
+                    # Индекс тенанта из тёплого кэша (сверка по chunks_version), при промахе — полная выгрузка
+                    chunk_index = get_tenant_index(cur, tenant_id)
+                    # Берём с запасом под fallback top_k, дальше build_context_with_scores режет сам
+                    scored_chunks = chunk_index.search(query_embedding, search_top_k)
+
+                if scored_chunks:
+                    print(f"DEBUG: Top {tenant_rag_topk_default} chunks for query '{user_message}':")
+                    for i, (chunk, sim) in enumerate(scored_chunks[:tenant_rag_topk_default]):
+                        print(f"  {i+1}. Similarity: {sim:.4f}, Text: {chunk[:200]}...")
+
+                    query_hash = hashlib.sha256(user_message.encode()).hexdigest()[:12]
+                    
+                    overlap_rate = low_overlap_rate()
+                    start_top_k = tenant_rag_topk_fallback if (RAG_LOW_OVERLAP_START_TOPK5 and overlap_rate >= RAG_LOW_OVERLAP_THRESHOLD) else tenant_rag_topk_default
+                    
+                    context_str, sims = build_context_with_scores(scored_chunks, top_k=start_top_k)
+                    context_ok, gate_reason, gate_debug = quality_gate(user_message, context_str, sims, quality_gate_settings)
+                    
+                    gate_debug['top_k_used'] = start_top_k
+                    gate_debug['overlap_rate'] = overlap_rate
+                    
+                    rag_debug_log({
+                        'event': 'rag_gate',
+                        'request_id': request_id or 'unknown',
+                        'query_hash': query_hash,
+                        'timestamp': now_moscow().isoformat(),
+                        'attempt': 1,
+                        'top_k': start_top_k,
+                        'ok': context_ok,
+                        'reason': gate_reason,
+                        'metrics': gate_debug
+                    })
+                    
+                    if 'low_overlap' in gate_reason and start_top_k < tenant_rag_topk_fallback:
+                        context2, sims2 = build_context_with_scores(scored_chunks, top_k=tenant_rag_topk_fallback)
+                        context_ok2, gate_reason2, gate_debug2 = quality_gate(user_message, context2, sims2, quality_gate_settings)
+                        
+                        gate_debug2['top_k_used'] = tenant_rag_topk_fallback
+                        gate_debug2['overlap_rate'] = overlap_rate
+                        
+                        rag_debug_log({
+                            'event': 'rag_gate_fallback',
+                            'request_id': request_id or 'unknown',
+                            'query_hash': query_hash,
+                            'timestamp': now_moscow().isoformat(),
+                            'attempt': 2,
+                            'top_k': RAG_TOPK_FALLBACK,
+                            'ok': context_ok2,
+                            'reason': gate_reason2,
+                            'metrics': gate_debug2
+                        })
+                        
+                        context_str = context2
+                        sims = sims2
+                        context_ok = context_ok2
+                        gate_reason = gate_reason2
+                        gate_debug = gate_debug2
+                    
+                    update_low_overlap_stats('low_overlap' in gate_reason)
+                else:
+                    # Если нет chunks - проверяем режим pure_prompt
+                    context_str = ""
+                    if enable_pure_prompt_mode:
+                        # Режим работы без RAG: разрешаем использовать историю и system_prompt
+                        context_ok = True
+                        gate_reason = "no_chunks_pure_prompt_enabled"
+                        print(f"✅ Pure prompt mode enabled for tenant {tenant_id} (no chunks)")
+                    else:
+                        # Обычный режим: без документов бот не может отвечать
+                        context_ok = False
+                        gate_reason = "no_chunks"
+                        print(f"⚠️ No chunks found for tenant {tenant_id}, pure_prompt_mode disabled")
+                    sims = []
+                    gate_debug = {}
+            except ChatPipelineError:
+                raise
+            except Exception as emb_error:
+                print(f"Embedding search error: {emb_error}")
+                cur.execute("""
+                    SELECT chunk_text FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks 
+                    WHERE tenant_id = %s
+                    ORDER BY id DESC 
+                    LIMIT 3
+                """, (tenant_id,))
+                chunks = cur.fetchall()
+                context_str = "\n\n".join([chunk[0] for chunk in chunks]) if chunks else ""
+                context_ok = False
+                gate_reason = "embedding_error"
+                sims = []
+                gate_debug = {"error": str(emb_error)}
+
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.chat_messages (session_id, role, content, tenant_id)
+            VALUES (%s, %s, %s, %s)
+        """, (session_id, 'user', user_message_converted, tenant_id))
+        
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_quality_gate_logs 
+            (tenant_id, user_message, context_ok, gate_reason, query_type, lang, 
+             best_similarity, context_len, overlap, key_tokens, top_k_used)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (
+            tenant_id,
+            user_message,
+            context_ok,
+            gate_reason,
+            gate_debug.get('query_type'),
+            gate_debug.get('lang'),
+            gate_debug.get('best_similarity'),
+            gate_debug.get('context_len'),
+            gate_debug.get('overlap'),
+            gate_debug.get('key_tokens'),
+            gate_debug.get('top_k_used')
+        ))
+        conn.commit()
+        
+        # Используем ранее загруженную историю (history_messages_preview)
+        system_prompt = compose_system(system_prompt_template, context_str, context_ok)
+        
+        # Если quality gate не прошёл - НЕ используем историю чата
+        # Это предотвращает использование информации из удалённых документов
+        history_to_use = history_messages_preview if context_ok else []
+        
+        if not context_ok:
+            print(f"⚠️ Quality gate failed ({gate_reason}), history disabled for this request")
+
+        # Семантический кэш ответов: только без истории, чтобы ответ не зависел от диалога
+        use_answer_cache = (
+            query_embedding is not None
+            and not history_to_use
+            and is_answer_cache_enabled(tenant_overrides)
+        )
+        cached_answer = None
+        provider_used = None
+        if use_answer_cache:
+            answer_prompt_hash = make_prompt_hash(system_prompt, f'{ai_provider}:{chat_api_model}')
+            answer_chunks_version = get_chunks_version(cur, tenant_id)
+            cached_answer = find_cached_answer(
+                cur, tenant_id, answer_prompt_hash, answer_chunks_version, gate_reason,
+                user_message_converted, query_embedding
+            )
+            conn.commit()
+
+        on_delta = None
+        if stream_id:
+            stream_writer = StreamWriter(
+                conn, stream_id, tenant_id, session_id,
+                format_partial=lambda text: format_with_settings(text, tenant_ctx.get_formatting_settings(channel), channel)
+            )
+            on_delta = stream_writer.update
+        if on_partial:
+            # Вызов из webhook в том же процессе: частичный ответ сразу в мессенджер
+            on_delta = on_partial if on_delta is None else _chain(on_delta, on_partial)
+
+        if cached_answer is not None:
+            assistant_message = cached_answer
+            print("✅ [chat] Answer served from cache, LLM call skipped")
+        else:
+            # Основной провайдер + ai_settings.failover; с hedge_enabled — параллельный запасной шаг по p95
+            router = ChatRouter(
+                tenant_ctx, tenant_id, session_id, system_prompt, history_to_use, user_message_converted,
+                generation={
+                    'temperature': ai_temperature,
+                    'top_p': ai_top_p,
+                    'frequency_penalty': ai_frequency_penalty,
+                    'presence_penalty': ai_presence_penalty,
+                    'max_tokens': ai_max_tokens
+                }
+            )
+            hops = build_hops(tenant_ctx.ai_settings, ai_provider, chat_api_model)
+            assistant_message, provider_used, error = router.complete(
+                hops, on_delta, hedge=bool((tenant_ctx.ai_settings or {}).get('hedge_enabled'))
+            )
+            if error:
+                if stream_writer:
+                    stream_writer.fail()
+                    stream_writer = None
+                raise ChatPipelineError(error)
+
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.chat_messages (session_id, role, content, tenant_id)
+            VALUES (%s, %s, %s, %s)
+        """, (session_id, 'assistant', assistant_message, tenant_id))
+        conn.commit()
+
+        # Ответ запасного провайдера не кладём в кэш основного (ключ — провайдер и модель)
+        if use_answer_cache and cached_answer is None and provider_used is hops[0]:
+            store_answer(
+                cur, tenant_id, answer_prompt_hash, answer_chunks_version, gate_reason,
+                user_message_converted, query_embedding, assistant_message
+            )
+            conn.commit()
+
+        # Форматируем ответ под конкретный канал
+        print(f'[chat] Formatting for channel={channel}, tenant_id={tenant_id}')
+        settings = tenant_ctx.get_formatting_settings(channel)
+        formatted_message = format_with_settings(assistant_message, settings, channel)
+        print(f'[chat] Original: {assistant_message[:100]}...')
+        print(f'[chat] Formatted: {formatted_message[:100]}...')
+        
+        if stream_writer:
+            stream_writer.finish(formatted_message)
+            stream_writer = None
+
+        cur.close()
+
+        return {
+            'message': formatted_message,
+            'sessionId': session_id,
+            'debug': {
+                'context_ok': context_ok,
+                'gate_reason': gate_reason,
+                'gate_info': gate_debug,
+                'answer_cache': ('hit' if cached_answer is not None else 'miss') if use_answer_cache else None,
+                'provider_used': repr(provider_used) if provider_used else None,
+                'db_connections_opened': request_stats()['opened'],
+                'provider_timings': provider_timings()
+            }
+        }
+
+    except Exception:
+        if stream_writer:
+            stream_writer.fail()
+        raise
+    finally:
+        if conn is not None:
+            release_connection(conn)
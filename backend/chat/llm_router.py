@@ -0,0 +1,413 @@
+"""
+Маршрутизация запроса к LLM с failover и хеджированием.
+ai_settings.failover — упорядоченный список запасных пар провайдер/модель с таймаутом на шаг:
+    [{"provider": "deepseek", "model": "deepseek-chat", "timeout": 30}, ...]
+Основной провайдер (provider/model из ai_settings) всегда идёт первым, его таймаут — provider_timeout.
+Если шаг вернул ошибку или не уложился в таймаут, запрос уходит следующему. С hedge_enabled
+следующий шаг стартует параллельно, если текущий не ответил за p95 своей задержки, и берётся
+первый успешный ответ. Токены логируются по каждому провайдеру, который реально ответил,
+в том числе по проигравшему хеджу: он дописывает запись уже после финального сброса буфера
+в handler, поэтому сбрасывает буфер сам.
+"""
+import os
+import json
+import time
+import queue
+import threading
+import contextvars
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from openrouter_models import get_working_free_model
+from token_logger import log_token_usage, flush_token_usage
+from provider_clients import get_openai_client, PROVIDER_READ_TIMEOUTS
+from llm_stream import complete_openai_compatible, complete_yandex, YandexCompletionError
+
+HEDGE_DEFAULT_DELAY_SEC = float(os.environ.get('HEDGE_DEFAULT_DELAY_SEC', '6'))
+HEDGE_MIN_DELAY_SEC = float(os.environ.get('HEDGE_MIN_DELAY_SEC', '1'))
+HEDGE_MIN_SAMPLES = 5
+HEDGE_MAX_PARALLEL = 2
+FAILOVER_MAX_HOPS = 4
+LATENCY_WINDOW = 50
+
+# (provider, model) -> последние задержки успешных ответов, сек
+_latencies: Dict[Tuple[str, str], deque] = {}
+_latencies_lock = threading.Lock()
+
+
+def get_provider_and_api_model(frontend_model: str, frontend_provider: str) -> tuple:
+    """
+    Возвращает (api_model, реальный_провайдер) на основе модели и провайдера с фронта.
+    Учитывает, что одна и та же модель (например deepseek-chat) может быть в разных провайдерах.
+    Исправлено: убрано дублирование моделей между провайдерами. v2
+    """
+    mappings = {
+        'yandex': {
+            'yandexgpt': 'yandexgpt',
+            'yandexgpt-lite': 'yandexgpt-lite'
+        },
+        'deepseek': {
+            'deepseek-chat': 'deepseek-chat',
+            'deepseek-reasoner': 'deepseek-reasoner'
+        },
+        'openrouter': {
+            # Бесплатные
+            'llama-3.3-70b': 'meta-llama/llama-3.3-70b-instruct:free',
+            'gemini-2.0-flash': 'google/gemini-2.0-flash-exp:free',
+            'deepseek-v3': 'deepseek/deepseek-chat:free',
+            'deepseek-r1': 'deepseek/deepseek-r1:free',
+            'llama-3.1-405b': 'meta-llama/llama-3.1-405b-instruct:free',
+            'qwen-2.5-72b': 'qwen/qwen-2.5-72b-instruct:free',
+            'mistral-small': 'mistralai/mistral-small-3.1-24b-instruct:free',
+            'phi-3-medium': 'microsoft/phi-3-medium-128k-instruct:free',
+            'llama-3.1-8b': 'meta-llama/llama-3.1-8b-instruct:free',
+            'gemma-2-9b': 'google/gemma-2-9b-it:free',
+            'qwen-2.5-7b': 'qwen/qwen-2.5-7b-instruct:free',
+            # Дешевые платные
+            'gemini-flash-1.5': 'google/gemini-flash-1.5',
+            'deepseek-chat': 'deepseek/deepseek-chat',
+            'mixtral-8x7b': 'mistralai/mixtral-8x7b-instruct',
+            'claude-3-haiku': 'anthropic/claude-3-haiku',
+            'gpt-3.5-turbo': 'openai/gpt-3.5-turbo',
+            'llama-3.1-70b': 'meta-llama/llama-3.1-70b-instruct',
+            # Топовые платные
+            'gemini-pro-1.5': 'google/gemini-pro-1.5',
+            'gpt-4o': 'openai/gpt-4o',
+            'claude-3.5-sonnet': 'anthropic/claude-3.5-sonnet'
+        },
+        'proxyapi': {
+            'gpt-4o-mini': 'gpt-4o-mini',
+            'gpt-3.5-turbo': 'gpt-3.5-turbo',
+            'claude-3-haiku': 'claude-3-haiku-20240307',
+            'gpt-4o': 'gpt-4o',
+            'o1-mini': 'o1-mini',
+            'claude-3.5-sonnet': 'claude-3-5-sonnet-20241022',
+            'gpt-4-turbo': 'gpt-4-turbo'
+        }
+    }
+
+    if frontend_provider in mappings:
+        provider_models = mappings[frontend_provider]
+        if frontend_model in provider_models:
+            return provider_models[frontend_model], frontend_provider
+
+    raise ValueError(f"Model '{frontend_model}' not supported for provider '{frontend_provider}'")
+
+
+class ProviderError(Exception):
+    """Шаг failover не дал ответа; response — готовый ответ handler для случая, когда шагов больше нет"""
+
+    def __init__(self, message: str, response: Optional[dict] = None):
+        super().__init__(message)
+        self.response = response
+
+
+class HopCancelled(Exception):
+    """Потоковый шаг проиграл хедж или вышел за таймаут — дочитывать ответ незачем"""
+
+
+class Hop:
+    def __init__(self, provider: str, model: str, timeout: float):
+        self.provider = provider
+        self.model = model
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f'{self.provider}:{self.model}'
+
+
+def _hop_timeout(value, provider: str) -> float:
+    try:
+        timeout = float(value)
+        if timeout > 0:
+            return timeout
+    except (TypeError, ValueError):
+        pass
+    return PROVIDER_READ_TIMEOUTS.get(provider, 60.0)
+
+
+def build_hops(ai_settings: Optional[dict], provider: str, model: str) -> List[Hop]:
+    """Основной провайдер + ai_settings.failover (модели с фронта маппятся как основная)"""
+    ai_settings = ai_settings or {}
+    hops = [Hop(provider, model, _hop_timeout(ai_settings.get('provider_timeout'), provider))]
+
+    for entry in ai_settings.get('failover') or []:
+        if len(hops) >= FAILOVER_MAX_HOPS:
+            break
+        if not isinstance(entry, dict):
+            continue
+        try:
+            hop_model, hop_provider = get_provider_and_api_model(entry.get('model'), entry.get('provider'))
+        except ValueError as e:
+            print(f"⚠️ [llm_router] Skipping failover entry: {e}")
+            continue
+        if any(h.provider == hop_provider and h.model == hop_model for h in hops):
+            continue
+        hops.append(Hop(hop_provider, hop_model, _hop_timeout(entry.get('timeout'), hop_provider)))
+    return hops
+
+
+def record_latency(provider: str, model: str, seconds: float):
+    with _latencies_lock:
+        _latencies.setdefault((provider, model), deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+
+def hedge_delay(provider: str, model: str) -> float:
+    """p95 задержки шага по последним ответам тёплого инстанса (пока выборка мала — дефолт)"""
+    with _latencies_lock:
+        samples = sorted(_latencies.get((provider, model), ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY_SEC
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return max(HEDGE_MIN_DELAY_SEC, p95)
+
+
+def _error_response(status: int, message: str) -> dict:
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': message}),
+        'isBase64Encoded': False
+    }
+
+
+class StreamGate:
+    """В StreamWriter пишет только один шаг; если владелец упал, поток достаётся следующему"""
+
+    def __init__(self, on_delta: Optional[Callable[[str], None]]):
+        self.on_delta = on_delta
+        self.owner = None
+        self.cancelled = set()
+        self.lock = threading.Lock()
+
+    def for_hop(self, index: int) -> Optional[Callable[[str], None]]:
+        if self.on_delta is None:
+            return None
+
+        def on_delta(text: str):
+            with self.lock:
+                if index in self.cancelled:
+                    raise HopCancelled()
+                if self.owner is None:
+                    self.owner = index
+                if self.owner != index:
+                    return
+                self.on_delta(text)
+        return on_delta
+
+    def cancel(self, index: int):
+        with self.lock:
+            self.cancelled.add(index)
+            if self.owner == index:
+                self.owner = None
+
+
+class ChatRouter:
+    """Один запрос пользователя: параметры генерации + ключи тенанта"""
+
+    def __init__(self, tenant_ctx, tenant_id: int, session_id: str, system_prompt: str,
+                 history: List[dict], user_message: str, generation: dict):
+        self.tenant_ctx = tenant_ctx
+        self.tenant_id = tenant_id
+        self.session_id = session_id
+        self.system_prompt = system_prompt
+        self.history = history
+        self.user_message = user_message
+        self.generation = generation
+
+    def _api_key(self, provider: str, key_name: str) -> str:
+        value, error = self.tenant_ctx.get_api_key(provider, key_name)
+        if error:
+            raise ProviderError(f'{provider}.{key_name} not configured', error)
+        return value
+
+    def _proxy(self, provider: str) -> Optional[dict]:
+        proxy_settings = self.tenant_ctx.proxy_settings.get(provider, {})
+        if proxy_settings.get('enabled') and proxy_settings.get('proxy'):
+            proxy = proxy_settings['proxy']
+            print(f"[chat] Using proxy for {provider}: {list(proxy.values())[0][:50]}...")
+            return proxy
+        return None
+
+    def _call_yandex(self, hop: Hop, on_delta) -> Tuple[str, Optional[int], str]:
+        yandex_api_key = self._api_key('yandex', 'api_key')
+        yandex_folder_id = self._api_key('yandex', 'folder_id')
+
+        yandex_messages = [{"role": "system", "text": self.system_prompt}]
+        for msg in self.history:
+            yandex_messages.append({
+                "role": "user" if msg["role"] == "user" else "assistant",
+                "text": msg["content"]
+            })
+        yandex_messages.append({"role": "user", "text": self.user_message})
+
+        payload = {
+            "modelUri": f"gpt://{yandex_folder_id}/{hop.model}",
+            "completionOptions": {
+                "temperature": self.generation['temperature'],
+                "maxTokens": str(self.generation['max_tokens'])
+            },
+            "messages": yandex_messages
+        }
+        try:
+            text, total_tokens = complete_yandex(yandex_api_key, payload, on_delta, timeout=hop.timeout)
+        except YandexCompletionError as yandex_error:
+            raise ProviderError(str(yandex_error), _error_response(500, f'Yandex API error: {yandex_error}'))
+        return text, total_tokens, hop.model
+
+    def _call_openai_compatible(self, hop: Hop, on_delta) -> Tuple[str, Optional[int], str]:
+        api_key = self._api_key(hop.provider, 'api_key')
+
+        working_model = hop.model
+        if hop.provider == 'openrouter':
+            if hop.model.endswith(':free'):
+                try:
+                    working_model = get_working_free_model(hop.model)
+                    print(f"✅ OpenRouter бесплатная модель доступна: {working_model}")
+                except Exception as model_error:
+                    raise ProviderError(str(model_error), _error_response(400, f'Модель недоступна: {str(model_error)}'))
+            else:
+                print(f"💰 OpenRouter платная модель: {hop.model}")
+
+        # Клиент из реестра: keep-alive соединение переживает тёплые вызовы
+        client = get_openai_client(hop.provider, api_key, self._proxy(hop.provider))
+        messages = [{"role": "system", "content": self.system_prompt}]
+        for msg in self.history:
+            messages.append({"role": msg["role"], "content": msg["content"]})
+        messages.append({"role": "user", "content": self.user_message})
+
+        text, total_tokens = complete_openai_compatible(
+            client,
+            on_delta,
+            model=working_model,
+            messages=messages,
+            temperature=self.generation['temperature'],
+            top_p=self.generation['top_p'],
+            frequency_penalty=self.generation['frequency_penalty'],
+            presence_penalty=self.generation['presence_penalty'],
+            max_tokens=self.generation['max_tokens'],
+            timeout=hop.timeout
+        )
+        return text, total_tokens, working_model
+
+    def call_hop(self, hop: Hop, on_delta=None) -> Tuple[str, Optional[int], str]:
+        """(текст, total_tokens, фактическая модель) или ProviderError"""
+        if hop.provider == 'yandex':
+            return self._call_yandex(hop, on_delta)
+        if hop.provider in ('openrouter', 'deepseek', 'proxyapi'):
+            return self._call_openai_compatible(hop, on_delta)
+        raise ProviderError(f'unknown provider {hop.provider}',
+                            _error_response(400, f'Неизвестный провайдер: {hop.provider}'))
+
+    def _run_hop(self, index: int, hop: Hop, gate: StreamGate, hedged: bool, results: queue.Queue,
+                 settled: threading.Event):
+        started = time.monotonic()
+        try:
+            text, total_tokens, used_model = self.call_hop(hop, gate.for_hop(index))
+            if not text:
+                raise ProviderError('empty answer')
+        except HopCancelled:
+            results.put((index, None, ProviderError('cancelled')))
+            return
+        except ProviderError as e:
+            results.put((index, None, e))
+            return
+        except Exception as e:
+            results.put((index, None, ProviderError(f'{type(e).__name__}: {e}')))
+            return
+
+        record_latency(hop.provider, hop.model, time.monotonic() - started)
+        # Логируем токены даже если ответ уже не нужен: провайдер их списал
+        if total_tokens:
+            log_token_usage(
+                tenant_id=self.tenant_id,
+                operation_type='gpt_response',
+                model=used_model,
+                tokens_used=total_tokens,
+                request_id=self.session_id,
+                metadata={'provider': hop.provider, 'hop': index, 'hedged': hedged}
+            )
+            # Гонка уже решена: handler мог сбросить буфер до этой записи, не оставляем её в памяти
+            if settled.is_set():
+                flush_token_usage()
+        results.put((index, text, None))
+
+    def complete(self, hops: List[Hop], on_delta=None, hedge: bool = False) -> Tuple[Optional[str], Optional[Hop], Optional[dict]]:
+        """
+        Прогоняет шаги failover. Возвращает (ответ, шаг-победитель, None)
+        или (None, None, ответ handler с ошибкой последнего шага).
+        """
+        gate = StreamGate(on_delta)
+        results: queue.Queue = queue.Queue()
+        settled = threading.Event()
+        deadlines: Dict[int, float] = {}
+        finished = set()
+        next_index = 0
+        hedge_at = None
+        last_error: Optional[ProviderError] = None
+
+        def start_next():
+            nonlocal next_index, hedge_at
+            index, hop = next_index, hops[next_index]
+            next_index += 1
+            now = time.monotonic()
+            deadlines[index] = now + hop.timeout
+            hedge_at = now + hedge_delay(hop.provider, hop.model) if hedge else None
+            print(f"🔀 [llm_router] Hop {index}: {hop} (timeout {hop.timeout:.1f}s)")
+            # Копия контекста: тайминги провайдеров шага попадают в debug этого же запроса
+            threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(self._run_hop, index, hop, gate, hedge and index > 0, results, settled), daemon=True
+            ).start()
+
+        try:
+            start_next()
+            while True:
+                running = [i for i in deadlines if i not in finished]
+                if not running:
+                    if next_index < len(hops):
+                        start_next()
+                        continue
+                    break
+
+                wake_at = min(deadlines[i] for i in running)
+                can_hedge = hedge_at is not None and next_index < len(hops) and len(running) < HEDGE_MAX_PARALLEL
+                if can_hedge:
+                    wake_at = min(wake_at, hedge_at)
+
+                try:
+                    index, text, error = results.get(timeout=max(0.0, wake_at - time.monotonic()))
+                except queue.Empty:
+                    now = time.monotonic()
+                    for i in running:
+                        if now >= deadlines[i]:
+                            print(f"⏱️ [llm_router] Hop {i} ({hops[i]}) timed out")
+                            gate.cancel(i)
+                            finished.add(i)
+                            last_error = ProviderError('timeout', _error_response(504, f'{hops[i].provider}: превышено время ожидания ответа'))
+                    if can_hedge and now >= hedge_at:
+                        print(f"🪢 [llm_router] Hop {running[-1]} slower than p95, hedging with {hops[next_index]}")
+                        start_next()
+                    continue
+
+                if index in finished:
+                    # Ответ шага, который уже списан по таймауту
+                    continue
+                finished.add(index)
+                if error is None:
+                    for i in running:
+                        if i != index:
+                            gate.cancel(i)
+                    print(f"✅ [llm_router] Answer from hop {index} ({hops[index]})")
+                    return text, hops[index], None
+
+                print(f"⚠️ [llm_router] Hop {index} ({hops[index]}) failed: {error}")
+                gate.cancel(index)
+                if error.response is not None or last_error is None:
+                    last_error = error
+
+            if last_error is not None and last_error.response is not None:
+                return None, None, last_error.response
+            return None, None, _error_response(500, f'Все провайдеры недоступны: {last_error}')
+        finally:
+            settled.set()
@@ -1,150 +1,89 @@
 """
-Автоматическое обновление списка бесплатных моделей OpenRouter
+Выбор бесплатной модели OpenRouter по данным фоновой проверки.
+Каталог и пробные запросы делает функция openrouter-model-health по таймеру и пишет
+результат в openrouter_model_health; здесь только читается эта таблица (с кэшем в памяти),
+поэтому запрос пользователя не ждёт каталог OpenRouter.
 """
-import requests
-import json
-from datetime import datetime, timedelta
-
-# Кэш моделей (обновляется раз в час)
-_models_cache = {
-    'models': [],
-    'updated_at': None
+import os
+import time
+from typing import Dict, List, Optional
+
+from db_pool import connection
+
+MODEL_HEALTH_CACHE_SEC = float(os.environ.get('MODEL_HEALTH_CACHE_SEC', '60'))
+# Замер старше этого считается устаревшим — модель не выбираем, пока проверка не повторится
+MODEL_HEALTH_MAX_AGE_MIN = int(os.environ.get('MODEL_HEALTH_MAX_AGE_MIN', '120'))
+MODEL_HEALTH_MAX_ERROR_RATE = float(os.environ.get('MODEL_HEALTH_MAX_ERROR_RATE', '0.5'))
+
+# model_id -> {'friendly_name', 'healthy', 'latency_ms'}
+_health_cache = {
+    'models': {},
+    'loaded_at': None
 }
 
-def fetch_openrouter_models():
-    """Получить актуальный список бесплатных моделей OpenRouter"""
-    global _models_cache
-    
-    # Проверяем кэш (обновляем раз в час)
-    if _models_cache['updated_at'] and (datetime.now() - _models_cache['updated_at']) < timedelta(hours=1):
-        return _models_cache['models']
-    
+
+def _load_model_health() -> Dict[str, dict]:
+    if _health_cache['loaded_at'] and time.monotonic() - _health_cache['loaded_at'] < MODEL_HEALTH_CACHE_SEC:
+        return _health_cache['models']
+
     try:
-        response = requests.get(
-            'https://openrouter.ai/api/v1/models',
-            timeout=5
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            all_models = data.get('data', [])
-            
-            # Фильтруем только БЕСПЛАТНЫЕ модели
-            free_models = []
-            for model in all_models:
-                pricing = model.get('pricing', {})
-                prompt_price = float(pricing.get('prompt', '0'))
-                completion_price = float(pricing.get('completion', '0'))
-                
-                # Если цена == 0, то модель бесплатная
-                if prompt_price == 0 and completion_price == 0:
-                    free_models.append({
-                        'id': model.get('id', ''),
-                        'name': model.get('name', ''),
-                        'context_length': model.get('context_length', 0),
-                        'description': model.get('description', '')
-                    })
-            
-            _models_cache['models'] = free_models
-            _models_cache['updated_at'] = datetime.now()
-            
-            print(f"✅ Обновлён список бесплатных моделей OpenRouter: {len(free_models)} моделей")
-            return free_models
-        else:
-            print(f"⚠️ Ошибка получения моделей OpenRouter: {response.status_code}")
-            return _models_cache['models']  # Возвращаем старый кэш
-            
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT model_id, friendly_name, ewma_latency_ms,
+                       is_listed
+                       AND error_rate < %s
+                       AND ewma_latency_ms IS NOT NULL
+                       AND last_probe_at > NOW() - INTERVAL '{MODEL_HEALTH_MAX_AGE_MIN} minutes'
+                FROM t_p56134400_telegram_ai_bot_pdf.openrouter_model_health
+            """, (MODEL_HEALTH_MAX_ERROR_RATE,))
+            rows = cur.fetchall()
+            cur.close()
+        _health_cache['models'] = {
+            row[0]: {'friendly_name': row[1], 'latency_ms': row[2], 'healthy': bool(row[3])}
+            for row in rows
+        }
     except Exception as e:
-        print(f"⚠️ Ошибка при обновлении моделей OpenRouter: {e}")
-        return _models_cache['models']  # Возвращаем старый кэш
+        # Остаёмся на прошлых данных; повторим не раньше чем через MODEL_HEALTH_CACHE_SEC
+        print(f"⚠️ Ошибка чтения здоровья моделей OpenRouter: {e}")
 
+    _health_cache['loaded_at'] = time.monotonic()
+    return _health_cache['models']
 
-def get_free_model_mapping():
-    """
-    Получить маппинг дружественных имён на актуальные ID бесплатных моделей
-    """
-    free_models = fetch_openrouter_models()
-    
-    # Приоритетные бесплатные модели (в порядке предпочтения)
-    preferred_models = {
-        # DeepSeek (приоритет #1 - мощные модели)
-        'deepseek-r1': ['deepseek/deepseek-r1', 'deepseek/deepseek-r1-distill-llama-70b'],
-        'deepseek-chat': ['deepseek/deepseek-chat'],
-        
-        # Llama 3.3/3.2 (приоритет #2 - стабильные модели)
-        'llama-3.3-70b': ['meta-llama/llama-3.3-70b-instruct:free'],
-        'llama-3.2-90b-vision': ['meta-llama/llama-3.2-90b-vision-instruct:free'],
-        'llama-3.2-11b-vision': ['meta-llama/llama-3.2-11b-vision-instruct:free'],
-        'llama-3.2-3b': ['meta-llama/llama-3.2-3b-instruct:free'],
-        'llama-3.2-1b': ['meta-llama/llama-3.2-1b-instruct:free'],
-        
-        # Llama 3.1 (fallback)
-        'llama-3.1-405b': ['meta-llama/llama-3.1-405b-instruct:free'],
-        'llama-3.1-70b': ['meta-llama/llama-3.1-70b-instruct:free'],
-        'llama-3.1-8b': ['meta-llama/llama-3.1-8b-instruct:free'],
-        
-        # Qwen (приоритет #3 - альтернатива)
-        'qwen-2.5-72b': ['qwen/qwen-2.5-72b-instruct:free'],
-        'qwen-2.5-7b': ['qwen/qwen-2.5-7b-instruct:free'],
-        'qwen-qwq-32b': ['qwen/qwq-32b-preview:free'],
-        
-        # Gemma (приоритет #4 - Google модели)
-        'gemma-2-27b': ['google/gemma-2-27b-it:free'],
-        'gemma-2-9b': ['google/gemma-2-9b-it:free'],
-        
-        # Mistral/Phi (fallback варианты)
-        'mistral-7b': ['mistralai/mistral-7b-instruct:free'],
-        'phi-3-medium': ['microsoft/phi-3-medium-128k-instruct:free'],
-        'mythomist-7b': ['gryphe/mythomist-7b:free'],
-    }
-    
-    # Получаем список ID доступных бесплатных моделей
-    available_ids = {model['id'] for model in free_models}
-    
-    # Строим финальный маппинг
-    mapping = {}
-    for friendly_name, candidates in preferred_models.items():
-        for candidate_id in candidates:
-            if candidate_id in available_ids:
-                mapping[friendly_name] = candidate_id
-                break
-        
-        # Если ни один кандидат не найден, берём первую доступную бесплатную модель
-        if friendly_name not in mapping and free_models:
-            mapping[friendly_name] = free_models[0]['id']
-            print(f"⚠️ Модель {friendly_name} не найдена, используется fallback: {free_models[0]['id']}")
-    
-    return mapping
+
+def get_healthy_models(friendly_name: str) -> List[str]:
+    """Здоровые модели группы, самые быстрые первыми"""
+    models = _load_model_health()
+    group = [
+        (info['latency_ms'], model_id) for model_id, info in models.items()
+        if info['friendly_name'] == friendly_name and info['healthy']
+    ]
+    return [model_id for _, model_id in sorted(group)]
 
 
 def get_working_free_model(requested_model: str) -> str:
     """
     Получить рабочую бесплатную модель на основе запрошенной
-    
+
     Args:
         requested_model: Запрошенная модель (friendly name или полный ID)
-    
+
     Returns:
-        Рабочий ID модели OpenRouter
+        Самую быструю здоровую модель той же группы; запрошенную модель, если о ней
+        ещё нет данных проверки
     """
-    mapping = get_free_model_mapping()
-    
-    # Если это friendly name - находим маппинг
-    if requested_model in mapping:
-        return mapping[requested_model]
-    
-    # Если это полный ID - проверяем доступность
-    free_models = fetch_openrouter_models()
-    available_ids = {model['id'] for model in free_models}
-    
-    if requested_model in available_ids:
-        return requested_model
-    
-    # Fallback: возвращаем первую доступную бесплатную модель
-    if free_models:
-        fallback = free_models[0]['id']
-        print(f"⚠️ Модель {requested_model} недоступна, используется: {fallback}")
-        return fallback
-    
-    # Критическая ошибка: нет бесплатных моделей
-    raise ValueError(f"Модель {requested_model} недоступна и нет бесплатных альтернатив")
+    models = _load_model_health()
+    known = models.get(requested_model)
+    friendly_name: Optional[str] = known['friendly_name'] if known else requested_model
+
+    healthy = get_healthy_models(friendly_name)
+    if healthy:
+        if healthy[0] != requested_model:
+            print(f"🔁 OpenRouter: {requested_model} → {healthy[0]} (самая быстрая здоровая модель группы {friendly_name})")
+        return healthy[0]
+
+    if known or any(info['friendly_name'] == friendly_name for info in models.values()):
+        # Группа проверялась, и ни одна модель не отвечает — пусть сработает failover
+        raise ValueError(f"Модель {requested_model} недоступна и нет бесплатных альтернатив")
+
+    return requested_model
@@ -0,0 +1,106 @@
+"""
+Кэш эмбеддингов запросов: in-process LRU (тёплый инстанс) + таблица query_embedding_cache.
+Ключ — (modelUri, нормализованный enriched_query), поэтому повторные вопросы и quick-questions
+виджета не ходят в Yandex textEmbedding и не тратят токены.
+"""
+import os
+import re
+import time
+import hashlib
+from collections import OrderedDict
+from datetime import timedelta
+from typing import List, Optional
+
+from embedding_codec import encode_embedding, decode_embedding
+from timezone_helper import moscow_naive
+
+QUERY_EMB_CACHE_SIZE = int(os.environ.get('QUERY_EMB_CACHE_SIZE', '2000'))
+QUERY_EMB_CACHE_TTL_HOURS = int(os.environ.get('QUERY_EMB_CACHE_TTL_HOURS', '72'))
+
+# cache_key -> (stored_at_monotonic, embedding)
+_memory_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+
+def normalize_query(text: str) -> str:
+    """Регистр, ё/е, пробелы и пунктуация по краям не влияют на эмбеддинг запроса для кэша"""
+    text = text.lower().replace('ё', 'е')
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.strip(' ?!.,;:')
+
+
+def make_cache_key(model_uri: str, query: str) -> str:
+    return hashlib.sha256(f"{model_uri}\n{normalize_query(query)}".encode()).hexdigest()
+
+
+def _memory_get(cache_key: str) -> Optional[List[float]]:
+    entry = _memory_cache.get(cache_key)
+    if not entry:
+        return None
+    stored_at, embedding = entry
+    if time.monotonic() - stored_at > QUERY_EMB_CACHE_TTL_HOURS * 3600:
+        del _memory_cache[cache_key]
+        return None
+    _memory_cache.move_to_end(cache_key)
+    return embedding
+
+
+def _memory_put(cache_key: str, embedding: List[float]):
+    _memory_cache[cache_key] = (time.monotonic(), embedding)
+    _memory_cache.move_to_end(cache_key)
+    while len(_memory_cache) > QUERY_EMB_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+
+def get_cached_query_embedding(cur, model_uri: str, query: str) -> Optional[List[float]]:
+    """Эмбеддинг из памяти или из БД; None при промахе"""
+    cache_key = make_cache_key(model_uri, query)
+
+    embedding = _memory_get(cache_key)
+    if embedding is not None:
+        print(f"[query_emb_cache] MEMORY HIT {cache_key[:12]}")
+        return embedding
+
+    try:
+        cur.execute("""
+            UPDATE t_p56134400_telegram_ai_bot_pdf.query_embedding_cache
+            SET hits = hits + 1
+            WHERE cache_key = %s AND created_at > %s
+            RETURNING embedding_bin
+        """, (cache_key, moscow_naive() - timedelta(hours=QUERY_EMB_CACHE_TTL_HOURS)))
+        row = cur.fetchone()
+    except Exception as e:
+        print(f"⚠️ [query_emb_cache] DB lookup failed: {e}")
+        cur.connection.rollback()
+        return None
+
+    if not row:
+        return None
+
+    embedding = decode_embedding(row[0])
+    _memory_put(cache_key, embedding)
+    print(f"[query_emb_cache] DB HIT {cache_key[:12]}")
+    return embedding
+
+
+def store_query_embedding(cur, model_uri: str, query: str, embedding: List[float]):
+    """Кладёт эмбеддинг в оба уровня кэша (запись в БД коммитится вместе с запросом чата)"""
+    cache_key = make_cache_key(model_uri, query)
+    _memory_put(cache_key, embedding)
+
+    try:
+        # Просроченные строки уже не читаются: удаляем их, как StreamWriter чистит chat_streams
+        cur.execute("""
+            DELETE FROM t_p56134400_telegram_ai_bot_pdf.query_embedding_cache
+            WHERE created_at < %s
+        """, (moscow_naive() - timedelta(hours=QUERY_EMB_CACHE_TTL_HOURS),))
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.query_embedding_cache
+            (cache_key, model_uri, query_text, embedding_bin, created_at)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (cache_key) DO UPDATE SET
+                embedding_bin = EXCLUDED.embedding_bin,
+                created_at = EXCLUDED.created_at
+        """, (cache_key, model_uri, normalize_query(query), encode_embedding(embedding), moscow_naive()))
+    except Exception as e:
+        print(f"⚠️ [query_emb_cache] DB store failed: {e}")
+        cur.connection.rollback()
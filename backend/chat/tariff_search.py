@@ -0,0 +1,197 @@
+"""
+Ответы на вопросы о ценах по строкам тарифов (tenant_tariff_rows), которые process-pdf
+достаёт из таблиц прайс-листов. Вместо десятка чанков по 1000 символов в контекст идут
+только строки, чей период пересекается с датами из вопроса (GiST по daterange), и, если
+в вопросе названа категория номера, только её строки.
+"""
+import os
+import re
+import calendar
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+RAG_TARIFF_ROWS = os.environ.get('RAG_TARIFF_ROWS', 'true').lower() == 'true'
+TARIFF_ROWS_LIMIT = int(os.environ.get('TARIFF_ROWS_LIMIT', '30'))
+
+_MONTHS = {
+    'янв': 1, 'фев': 2, 'мар': 3, 'апр': 4, 'май': 5, 'мая': 5, 'мае': 5, 'июн': 6,
+    'июл': 7, 'авг': 8, 'сен': 9, 'окт': 10, 'ноя': 11, 'дек': 12
+}
+_MONTH_WORD = r'(?:январ|феврал|март|апрел|ма[йяе]|июн|июл|август|сентябр|октябр|ноябр|декабр)[а-я]*'
+_DASH = r'\s*(?:-|–|—|по|до)\s*'
+
+# «с 10 по 15 июня», «10–15 июня»
+_SAME_MONTH_RANGE_RE = re.compile(
+    rf'(\d{{1,2}}){_DASH}(\d{{1,2}})\s+({_MONTH_WORD})(?:\s+(\d{{4}}))?', re.IGNORECASE
+)
+# «22.05–25.05», «25.02–29.02.2028»: число с точкой без года — дата только внутри диапазона
+# («на 2.5 суток» — не 2 мая)
+_NUMERIC_RANGE_RE = re.compile(
+    rf'(\d{{1,2}})[./](\d{{1,2}})(?:[./](\d{{2,4}}))?{_DASH}(\d{{1,2}})[./](\d{{1,2}})(?:[./](\d{{2,4}}))?'
+)
+_DATE_RE = re.compile(
+    rf'(\d{{4}})-(\d{{1,2}})-(\d{{1,2}})'
+    rf'|(\d{{1,2}})[./](\d{{1,2}})[./](\d{{2,4}})'
+    rf'|(\d{{1,2}})\s+({_MONTH_WORD})(?:\s+(\d{{4}}))?',
+    re.IGNORECASE
+)
+_MONTH_RE = re.compile(rf'\b({_MONTH_WORD})\b', re.IGNORECASE)
+_WORD_RE = re.compile(r'[a-zа-яё]{4,}', re.IGNORECASE)
+# Общие слова вопроса о цене: «номер» есть почти в каждой категории и совпал бы со всеми
+_GENERIC_WORD_RE = re.compile(
+    r'^(?:номер|стои|скольк|цен|тариф|прайс|сут|ноч|прожив|будет|нуж|хоч|можн|есть|как|период|дат|челов)',
+    re.IGNORECASE
+)
+
+
+def is_tariff_rows_enabled(tenant_overrides: dict = None) -> bool:
+    value = (tenant_overrides or {}).get('tariff_rows_enabled')
+    if value is None:
+        return RAG_TARIFF_ROWS
+    return str(value).lower() in ('true', '1')
+
+
+def _month_number(word: str) -> Optional[int]:
+    return _MONTHS.get(word.lower()[:3])
+
+
+def _make_date(day: int, month: Optional[int], year_text: Optional[str], today: date) -> Optional[date]:
+    """Дата без года — ближайшая будущая (в октябре «22 мая» — это май следующего года)"""
+    try:
+        if year_text:
+            return date(int(year_text) + (2000 if len(year_text) == 2 else 0), month, day)
+        result = date(today.year, month, day)
+        return result if result >= today else _with_year(result, today.year + 1)
+    except (TypeError, ValueError):
+        return None
+
+
+def _with_year(value: date, year: int) -> date:
+    """Та же дата в другом году; 29 февраля в невисокосном году — 28 февраля"""
+    return value.replace(year=year, day=min(value.day, calendar.monthrange(year, value.month)[1]))
+
+
+def _order_range(start: date, start_explicit: bool, end: date, end_explicit: bool) -> Tuple[date, date]:
+    """Согласует годы границ: год начала без года берём у конца, конец без года — не раньше начала"""
+    if end_explicit and not start_explicit:
+        start = _with_year(start, end.year)
+        if start > end:
+            start = _with_year(start, end.year - 1)
+    elif not end_explicit and end < start:
+        # «с 28 декабря по 3 января»: конец в следующем году
+        end = _with_year(end, start.year)
+        if end < start:
+            end = _with_year(end, start.year + 1)
+    return start, max(end, start)
+
+
+def parse_query_period(text: str, today: date) -> Optional[Tuple[date, date]]:
+    """Период из вопроса: «с 10 по 15 июня», «22.05–25.05», «2026-05-22», «в июле»"""
+    match = _SAME_MONTH_RANGE_RE.search(text)
+    if match:
+        month = _month_number(match.group(3))
+        start = _make_date(int(match.group(1)), month, match.group(4), today)
+        end = _make_date(int(match.group(2)), month, match.group(4) or (str(start.year) if start else None), today)
+        if start and end and end >= start:
+            return start, end
+
+    match = _NUMERIC_RANGE_RE.search(text)
+    if match:
+        start = _make_date(int(match.group(1)), int(match.group(2)), match.group(3), today)
+        end = _make_date(int(match.group(4)), int(match.group(5)), match.group(6), today)
+        if start and end:
+            return _order_range(start, bool(match.group(3)), end, bool(match.group(6)))
+
+    dates = []
+    for match in _DATE_RE.finditer(text):
+        if match.group(1):
+            parsed = _make_date(int(match.group(3)), int(match.group(2)), match.group(1), today)
+        elif match.group(4):
+            parsed = _make_date(int(match.group(4)), int(match.group(5)), match.group(6), today)
+        else:
+            parsed = _make_date(int(match.group(7)), _month_number(match.group(8)), match.group(9), today)
+        if parsed:
+            dates.append((parsed, not match.group(7) or bool(match.group(9))))
+    if dates:
+        (start, start_explicit), (end, end_explicit) = dates[0], dates[-1]
+        return _order_range(start, start_explicit, end, end_explicit)
+
+    match = _MONTH_RE.search(text)
+    if match:
+        month = _month_number(match.group(1))
+        start = _make_date(1, month, None, today.replace(day=1))
+        if start:
+            next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+            return start, next_month - timedelta(days=1)
+    return None
+
+
+def _stems(text: str) -> set:
+    """Грубые основы слов для сравнения категорий: «люкса» и «Люкс», «стандартный» и «Стандарт»"""
+    return {word.lower()[:4] for word in _WORD_RE.findall(text) if not _GENERIC_WORD_RE.match(word)}
+
+
+def _stem_pattern(stem: str) -> str:
+    """Регулярка «слово начинается с основы» без учёта регистра: [Лл][Юю][Кк][Сс].
+    ~* и ILIKE для кириллицы зависят от локали БД, классы символов — нет"""
+    return r'\m' + ''.join(f'[{c.upper()}{c}]' if c.upper() != c else re.escape(c) for c in stem)
+
+
+def _select_rows(cur, tenant_id: int, date_from: date, date_to: Optional[date], patterns: List[str]) -> List[tuple]:
+    category_filter = "AND room_category ~ ANY(%s)" if patterns else ""
+    params = [tenant_id, date_from, date_to] + ([patterns] if patterns else []) + [TARIFF_ROWS_LIMIT]
+    cur.execute(f"""
+        SELECT room_category, date_from, date_to, price, currency, conditions
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_tariff_rows
+        WHERE tenant_id = %s
+          AND daterange(date_from, date_to, '[]') && daterange(%s, %s, '[]')
+          {category_filter}
+        ORDER BY room_category, date_from NULLS FIRST, price
+        LIMIT %s
+    """, params)
+    return cur.fetchall()
+
+
+def search_tariff_rows(cur, tenant_id: int, query_text: str, today: date) -> Tuple[List[tuple], Optional[Tuple[date, date]]]:
+    """
+    Строки тарифов под вопрос: (room_category, date_from, date_to, price, currency, conditions).
+    Без дат в вопросе — действующие и будущие периоды названной категории.
+    Возвращает строки и разобранный период; пустой список — отвечать через обычный RAG.
+    """
+    period = parse_query_period(query_text, today)
+    date_from, date_to = period if period else (today, None)
+
+    # Категория названа в вопросе — фильтруем в SQL, до LIMIT: иначе в длинном прайсе
+    # категории из конца алфавита не попадут в выборку
+    patterns = [_stem_pattern(stem) for stem in sorted(_stems(query_text))]
+    if patterns:
+        rows = _select_rows(cur, tenant_id, date_from, date_to, patterns)
+        if rows:
+            return rows, period
+    if not period:
+        return [], None  # «сколько стоит трансфер»: ни дат, ни категории — это вопрос не к таблице
+    return _select_rows(cur, tenant_id, date_from, date_to, []), period
+
+
+def _format_price(price, currency: Optional[str]) -> str:
+    value = float(price)
+    amount = f"{value:,.0f}" if value == int(value) else f"{value:,.2f}"
+    return f"{amount.replace(',', ' ')} {currency or ''}".strip()
+
+
+def build_tariff_context(rows: List[tuple], period: Optional[Tuple[date, date]]) -> str:
+    """Компактный контекст для LLM: одна строка на тариф"""
+    if period:
+        title = f"Тарифы из прайс-листа на даты {period[0]:%d.%m.%Y}–{period[1]:%d.%m.%Y}:"
+    else:
+        title = "Действующие тарифы из прайс-листа:"
+
+    lines = [title]
+    for room_category, date_from, date_to, price, currency, conditions in rows:
+        since = f"{date_from:%d.%m.%Y}" if date_from else '…'
+        until = f"{date_to:%d.%m.%Y}" if date_to else '…'
+        line = f"- {room_category}, {since}–{until}: {_format_price(price, currency)}"
+        if conditions:
+            line += f" ({conditions})"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,199 @@
+"""
+Контекст тенанта для горячего пути чата одним запросом к БД.
+Настройки ИИ, эмбеддингов, quality gate, прокси, API ключи, форматирование и дефолтный промпт
+кэшируются в памяти тёплого инстанса на TENANT_CONTEXT_TTL_SEC. История сессии читается тем же
+запросом, что и tenants.settings_version: если update-*-settings подняли версию (bump_settings_version),
+контекст перечитывается. Дефолтный промпт из default_settings меняют миграции — они поднимают версию всем
+тенантам, иначе новый промпт подхватится только через TENANT_CONTEXT_TTL_SEC.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from api_keys_helper import resolve_api_key
+from formatting_helper import formatting_settings_from_row
+
+TENANT_CONTEXT_TTL_SEC = float(os.environ.get('TENANT_CONTEXT_TTL_SEC', '60'))
+TENANT_CONTEXT_CACHE_SIZE = int(os.environ.get('TENANT_CONTEXT_CACHE_SIZE', '500'))
+HISTORY_LIMIT = 10
+
+# tenant_id -> (loaded_at, TenantContext)
+_context_cache: 'OrderedDict[int, Tuple[float, TenantContext]]' = OrderedDict()
+# slug -> (loaded_at, tenant_id)
+_slug_cache: Dict[str, Tuple[float, Optional[int]]] = {}
+
+_HISTORY_SQL = f"""
+    (SELECT COALESCE(json_agg(json_build_object('role', h.role, 'content', h.content) ORDER BY h.created_at DESC), '[]'::json)
+     FROM (
+        SELECT role, content, created_at FROM t_p56134400_telegram_ai_bot_pdf.chat_messages
+        WHERE session_id = %s AND tenant_id = t.id
+        ORDER BY created_at DESC
+        LIMIT {HISTORY_LIMIT}
+     ) h)
+"""
+
+
+def parse_proxy(proxy_string: str):
+    """Парсит прокси из формата ip:port@login:pass в dict для httpx"""
+    if not proxy_string or not proxy_string.strip():
+        return None
+
+    try:
+        # Формат: ip:port@login:pass
+        if '@' in proxy_string:
+            ip_port, login_pass = proxy_string.split('@', 1)
+            proxy_url = f'http://{login_pass}@{ip_port}'
+        else:
+            proxy_url = f'http://{proxy_string}'
+
+        return {
+            'http://': proxy_url,
+            'https://': proxy_url
+        }
+    except Exception as e:
+        print(f'Failed to parse proxy: {e}')
+        return None
+
+
+def proxy_settings_from_row(row) -> dict:
+    """Настройки прокси для DeepSeek, OpenRouter и ProxyAPI из колонок tenant_settings"""
+    if not row or all(value is None for value in row):
+        return {}
+
+    return {
+        'deepseek': {
+            'enabled': row[0] or False,
+            'proxy': parse_proxy(row[1]) if row[0] and row[1] else None
+        },
+        'openrouter': {
+            'enabled': row[2] or False,
+            'proxy': parse_proxy(row[3]) if row[2] and row[3] else None
+        },
+        'proxyapi': {
+            'enabled': row[4] or False,
+            'proxy': parse_proxy(row[5]) if row[4] and row[5] else None
+        }
+    }
+
+
+class TenantContext:
+    """Неизменяемая между правками настроек часть состояния тенанта"""
+
+    def __init__(self, tenant_id: int, settings_version, has_settings: bool, ai_settings: Optional[dict],
+                 embedding_provider: Optional[str], embedding_query_model: Optional[str],
+                 quality_gate_settings: Optional[dict], default_prompt: Optional[str],
+                 proxy_settings: dict, api_keys: Dict[str, str], formatting_rows: Dict[str, dict]):
+        self.tenant_id = tenant_id
+        self.settings_version = settings_version
+        self.has_settings = has_settings
+        self.ai_settings = ai_settings
+        self.embedding_provider = embedding_provider
+        self.embedding_query_model = embedding_query_model
+        self.quality_gate_settings = quality_gate_settings
+        self.default_prompt = default_prompt
+        self.proxy_settings = proxy_settings
+        self.api_keys = api_keys
+        self.formatting_rows = formatting_rows
+
+    def get_api_key(self, provider: str, key_name: str) -> Tuple[Optional[str], Optional[dict]]:
+        """Как api_keys_helper.get_tenant_api_key, но без похода в БД"""
+        return resolve_api_key(self.api_keys.get(f'{provider}.{key_name}'), provider, key_name)
+
+    def get_formatting_settings(self, messenger: str) -> dict:
+        """Как formatting_helper.get_formatting_settings, но без похода в БД"""
+        return formatting_settings_from_row(self.formatting_rows.get(messenger), messenger)
+
+
+def _history_from_json(history_json) -> List[tuple]:
+    """(role, content) в порядке ORDER BY created_at DESC, как прежний fetchall"""
+    return [(item['role'], item['content']) for item in (history_json or [])]
+
+
+def resolve_tenant_slug(cur, tenant_slug: str) -> Optional[int]:
+    """tenant_id по slug с кэшем на TTL (None, если slug не найден)"""
+    cached = _slug_cache.get(tenant_slug)
+    if cached and time.monotonic() - cached[0] < TENANT_CONTEXT_TTL_SEC:
+        return cached[1]
+
+    cur.execute("""
+        SELECT id FROM t_p56134400_telegram_ai_bot_pdf.tenants
+        WHERE slug = %s
+    """, (tenant_slug,))
+    row = cur.fetchone()
+    tenant_id = row[0] if row else None
+    _slug_cache[tenant_slug] = (time.monotonic(), tenant_id)
+    return tenant_id
+
+
+def _load_full(cur, tenant_id: int, session_id: str) -> Tuple[TenantContext, List[tuple]]:
+    cur.execute(f"""
+        SELECT
+            tn.settings_version,
+            ts.tenant_id IS NOT NULL,
+            ts.ai_settings, ts.embedding_provider, ts.embedding_query_model, ts.quality_gate_settings,
+            ts.use_proxy_deepseek, ts.proxy_deepseek,
+            ts.use_proxy_openrouter, ts.proxy_openrouter,
+            ts.use_proxy_proxyapi, ts.proxy_proxyapi,
+            (SELECT setting_value FROM t_p56134400_telegram_ai_bot_pdf.default_settings
+             WHERE setting_key = 'default_system_prompt'),
+            (SELECT COALESCE(json_object_agg(k.provider || '.' || k.key_name, k.key_value), '{{}}'::json)
+             FROM t_p56134400_telegram_ai_bot_pdf.tenant_api_keys k
+             WHERE k.tenant_id = t.id AND k.is_active = true),
+            (SELECT COALESCE(json_object_agg(f.messenger, json_build_object(
+                        'use_emoji', f.use_emoji,
+                        'use_markdown', f.use_markdown,
+                        'use_lists_formatting', f.use_lists_formatting,
+                        'custom_emoji_map', f.custom_emoji_map,
+                        'list_bullet_char', f.list_bullet_char,
+                        'numbered_list_char', f.numbered_list_char)), '{{}}'::json)
+             FROM t_p56134400_telegram_ai_bot_pdf.messenger_formatting_settings f
+             WHERE f.tenant_id = t.id),
+            {_HISTORY_SQL}
+        FROM (SELECT %s::int AS id) t
+        LEFT JOIN t_p56134400_telegram_ai_bot_pdf.tenants tn ON tn.id = t.id
+        LEFT JOIN t_p56134400_telegram_ai_bot_pdf.tenant_settings ts ON ts.tenant_id = t.id
+    """, (session_id, tenant_id))
+    row = cur.fetchone()
+
+    ctx = TenantContext(
+        tenant_id=tenant_id,
+        settings_version=row[0],
+        has_settings=bool(row[1]),
+        ai_settings=row[2],
+        embedding_provider=row[3],
+        embedding_query_model=row[4],
+        quality_gate_settings=row[5],
+        default_prompt=row[12],
+        proxy_settings=proxy_settings_from_row(row[6:12]),
+        api_keys=row[13] or {},
+        formatting_rows=row[14] or {}
+    )
+    return ctx, _history_from_json(row[15])
+
+
+def load_tenant_context(cur, tenant_id: int, session_id: str) -> Tuple[TenantContext, List[tuple]]:
+    """
+    Контекст тенанта и последние HISTORY_LIMIT сообщений сессии (role, content), новые первыми.
+    Тёплый кэш: один лёгкий запрос (версия настроек + история), холодный — один большой.
+    """
+    now = time.monotonic()
+    cached = _context_cache.get(tenant_id)
+    if cached and now - cached[0] < TENANT_CONTEXT_TTL_SEC:
+        cur.execute(f"""
+            SELECT t.settings_version, {_HISTORY_SQL}
+            FROM t_p56134400_telegram_ai_bot_pdf.tenants t
+            WHERE t.id = %s
+        """, (session_id, tenant_id))
+        row = cur.fetchone()
+        if row and row[0] == cached[1].settings_version:
+            _context_cache.move_to_end(tenant_id)
+            return cached[1], _history_from_json(row[1])
+        print(f"🔄 [tenant_context] Settings changed for tenant {tenant_id}, reloading")
+
+    ctx, history = _load_full(cur, tenant_id, session_id)
+    _context_cache[tenant_id] = (now, ctx)
+    _context_cache.move_to_end(tenant_id)
+    while len(_context_cache) > TENANT_CONTEXT_CACHE_SIZE:
+        _context_cache.popitem(last=False)
+    return ctx, history
@@ -1,7 +1,8 @@
-import psycopg2
 import os
 from typing import Optional
 
+from usage_buffer import enqueue, flush as flush_token_usage, flushes_token_usage
+
 # Тарифы провайдеров (руб за 1000 токенов)
 # Курс: 1$ = 100₽ (примерно)
 PRICING = {
@@ -56,7 +57,7 @@ def log_token_usage(
     metadata: Optional[dict] = None
 ):
     """
-    Логирует использование токенов в БД
+    Логирует использование токенов в БД (через буфер usage_buffer, без ожидания INSERT)
     
     Args:
         tenant_id: ID тенанта
@@ -75,21 +76,11 @@ def log_token_usage(
         if price_per_1k == 0 and model not in PRICING:
             print(f"WARNING: No pricing found for model '{model}', cost set to 0")
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cur = conn.cursor()
-        
         import json
         metadata_json = json.dumps(metadata) if metadata else None
         
-        cur.execute("""
-            INSERT INTO t_p56134400_telegram_ai_bot_pdf.token_usage 
-            (tenant_id, operation_type, model, tokens_used, cost_rubles, request_id, metadata)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (tenant_id, operation_type, model, tokens_used, cost_rubles, request_id, metadata_json))
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Запись уходит в БД пачкой: по порогам буфера или в конце handler
+        enqueue([tenant_id, operation_type, model, tokens_used, cost_rubles, request_id, metadata_json])
         
     except Exception as e:
         print(f"Error logging token usage: {e}")
\ No newline at end of file
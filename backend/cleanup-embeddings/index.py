@@ -56,9 +56,26 @@ def handler(event: dict, context) -> dict:
             WHERE document_id NOT IN (
                 SELECT id FROM t_p56134400_telegram_ai_bot_pdf.tenant_documents
             )
+            RETURNING tenant_id
         """)
         
         deleted_tenant_chunks = cur.rowcount
+        affected_tenant_ids = list({row[0] for row in cur.fetchall()})
+
+        cur.execute("""
+            DELETE FROM t_p56134400_telegram_ai_bot_pdf.tenant_tariff_rows
+            WHERE document_id NOT IN (
+                SELECT id FROM t_p56134400_telegram_ai_bot_pdf.tenant_documents
+            )
+        """)
+        
+        # Инвалидируем тёплый кэш индекса затронутых тенантов в chat
+        if affected_tenant_ids:
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.tenants
+                SET chunks_version = chunks_version + 1
+                WHERE id = ANY(%s)
+            """, (affected_tenant_ids,))
         
         cur.execute("""
             DELETE FROM t_p56134400_telegram_ai_bot_pdf.document_chunks
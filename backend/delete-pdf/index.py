@@ -94,11 +94,23 @@ def handler(event: dict, context) -> dict:
                 WHERE document_id = %s AND tenant_id = %s
             """, (document_id, tenant_id))
 
+            cur.execute("""
+                DELETE FROM t_p56134400_telegram_ai_bot_pdf.tenant_tariff_rows
+                WHERE document_id = %s AND tenant_id = %s
+            """, (document_id, tenant_id))
+
             cur.execute("""
                 DELETE FROM t_p56134400_telegram_ai_bot_pdf.tenant_documents 
                 WHERE id = %s AND tenant_id = %s
             """, (document_id, tenant_id))
 
+            # Инвалидируем тёплый кэш индекса тенанта в chat
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.tenants
+                SET chunks_version = chunks_version + 1
+                WHERE id = %s
+            """, (tenant_id,))
+
             conn.commit()
         except Exception as db_error:
             conn.rollback()
@@ -108,6 +108,15 @@ def handler(event: dict, context) -> dict:
         top_users = cur.fetchall()
         top_users_list = [{'user': u[0], 'messages': u[1]} for u in top_users]
 
+        cur.execute("""
+            SELECT hits, misses
+            FROM t_p56134400_telegram_ai_bot_pdf.answer_cache_stats
+            WHERE tenant_id = %s
+        """, (tenant_id,))
+        cache_row = cur.fetchone()
+        cache_hits, cache_misses = (cache_row[0], cache_row[1]) if cache_row else (0, 0)
+        cache_lookups = cache_hits + cache_misses
+
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -118,7 +127,12 @@ def handler(event: dict, context) -> dict:
                 'messagesWeek': messages_week,
                 'popularQuestions': popular_questions_list,
                 'dailyStats': daily_stats_list,
-                'topUsers': top_users_list
+                'topUsers': top_users_list,
+                'answerCache': {
+                    'hits': cache_hits,
+                    'misses': cache_misses,
+                    'hitRate': round(cache_hits / cache_lookups, 4) if cache_lookups else 0
+                }
             }),
             'isBase64Encoded': False
         }
@@ -40,11 +40,20 @@ def handler(event: dict, context) -> dict:
         conn = psycopg2.connect(os.environ['DATABASE_URL'])
         cur = conn.cursor()
         
+        # Последняя задача индексации документа — живой прогресс обработки
         cur.execute("""
-            SELECT id, file_name, file_size_bytes, pages, category, status, uploaded_at, file_key
-            FROM t_p56134400_telegram_ai_bot_pdf.tenant_documents
-            WHERE tenant_id = %s
-            ORDER BY uploaded_at DESC
+            SELECT d.id, d.file_name, d.file_size_bytes, d.pages, d.category, d.status, d.uploaded_at, d.file_key,
+                   j.status, j.stage, j.stage_done, j.stage_total, j.last_error
+            FROM t_p56134400_telegram_ai_bot_pdf.tenant_documents d
+            LEFT JOIN LATERAL (
+                SELECT status, stage, stage_done, stage_total, last_error
+                FROM t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+                WHERE document_id = d.id
+                ORDER BY id DESC
+                LIMIT 1
+            ) j ON TRUE
+            WHERE d.tenant_id = %s
+            ORDER BY d.uploaded_at DESC
         """, (tenant_id,))
         
         rows = cur.fetchall()
@@ -79,6 +88,14 @@ def handler(event: dict, context) -> dict:
                 'uploadedAt': row[6].strftime('%Y-%m-%d') if row[6] else None,
                 'fileUrl': file_url
             }
+            if row[8]:
+                doc['ingestion'] = {
+                    'status': row[8],
+                    'stage': row[9],
+                    'done': row[10],
+                    'total': row[11],
+                    'error': row[12]
+                }
             documents.append(doc)
 
         cur.close()
@@ -7,6 +7,7 @@ import psycopg2
 import sys
 sys.path.insert(0, '/function/code/shared')
 from auth_middleware import get_tenant_id_from_request
+from settings_version import bump_settings_version
 
 def handler(event: dict, context) -> dict:
     """Управление API ключами клиента"""
@@ -110,6 +111,8 @@ def handler(event: dict, context) -> dict:
                 """, (tenant_id, provider, key_name, key_value))
                 saved_count += 1
             
+            bump_settings_version(cur, tenant_id)
+
             conn.commit()
             cur.close()
             conn.close()
@@ -2,6 +2,7 @@ import json
 import os
 import psycopg2
 from auth_middleware import require_auth
+from settings_version import bump_settings_version
 
 def handler(event: dict, context) -> dict:
     """Управление настройками эмбеддингов для суперадмина"""
@@ -59,7 +60,8 @@ def handler(event: dict, context) -> dict:
                         ts.embedding_provider,
                         ts.embedding_doc_model,
                         ts.embedding_query_model,
-                        t.fz152_enabled
+                        t.fz152_enabled,
+                        ts.chunking_settings
                     FROM t_p56134400_telegram_ai_bot_pdf.tenant_settings ts
                     JOIN t_p56134400_telegram_ai_bot_pdf.tenants t ON t.id = ts.tenant_id
                     WHERE ts.tenant_id = %s
@@ -80,7 +82,30 @@ def handler(event: dict, context) -> dict:
                     'embedding_provider': row[0] or 'yandex',
                     'embedding_doc_model': row[1] or 'text-search-doc',
                     'embedding_query_model': row[2] or 'text-search-query',
-                    'fz152_enabled': row[3] if row[3] is not None else False
+                    'fz152_enabled': row[3] if row[3] is not None else False,
+                    'chunking_settings': row[4] or {}
+                }
+
+                # Замеры бэкендов извлечения PDF по документам тенанта — для выбора chunking_settings.extractor
+                cur.execute("""
+                    SELECT probe.key,
+                           COUNT(*),
+                           AVG((probe.value->>'pages_per_sec')::float),
+                           AVG((probe.value->>'chars')::float),
+                           COUNT(*) FILTER (WHERE j.metrics->'extractor'->>'backend' = probe.key)
+                    FROM t_p56134400_telegram_ai_bot_pdf.ingestion_jobs j,
+                         jsonb_each(j.metrics->'extractor_probe') probe
+                    WHERE j.tenant_id = %s AND j.status = 'done'
+                    GROUP BY probe.key
+                """, (target_tenant_id,))
+                result['extractor_stats'] = {
+                    stat_row[0]: {
+                        'documents': stat_row[1],
+                        'pages_per_sec': round(stat_row[2] or 0, 1),
+                        'avg_chars': round(stat_row[3] or 0),
+                        'selected': stat_row[4]
+                    }
+                    for stat_row in cur.fetchall()
                 }
 
                 cur.close()
@@ -135,6 +160,7 @@ def handler(event: dict, context) -> dict:
             embedding_provider = body.get('embedding_provider')
             embedding_doc_model = body.get('embedding_doc_model')
             embedding_query_model = body.get('embedding_query_model')
+            chunking_settings = body.get('chunking_settings')
 
             if not target_tenant_id:
                 cur.close()
@@ -184,6 +210,16 @@ def handler(event: dict, context) -> dict:
                 WHERE tenant_id = %s
             """, (embedding_provider, embedding_doc_model, embedding_query_model, target_tenant_id))
 
+            # Нарезка применяется при следующей (пере)индексации документов
+            if chunking_settings is not None:
+                cur.execute("""
+                    UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+                    SET chunking_settings = %s::jsonb
+                    WHERE tenant_id = %s
+                """, (json.dumps(chunking_settings), target_tenant_id))
+
+            bump_settings_version(cur, target_tenant_id)
+
             conn.commit()
             cur.close()
             conn.close()
@@ -0,0 +1,27 @@
+"""
+Версия настроек тенанта (tenants.settings_version). chat держит контекст тенанта в памяти тёплого
+инстанса и перечитывает его, как только версия изменилась, поэтому handler, меняющий настройки,
+которые читает chat (ИИ, ключи API, прокси, форматирование, quality gate, эмбеддинги), поднимает
+версию в своей транзакции.
+
+default_settings (default_system_prompt) общие для всех тенантов и меняются миграциями БД: такая
+миграция должна сама поднять версию всем тенантам
+    UPDATE t_p56134400_telegram_ai_bot_pdf.tenants SET settings_version = settings_version + 1;
+иначе тёплые инстансы chat увидят новый промпт только после TENANT_CONTEXT_TTL_SEC.
+"""
+from typing import Optional
+
+
+def bump_settings_version(cur, tenant_id: Optional[int]):
+    """Поднимает версию настроек тенанта; tenant_id=None — всем тенантам (изменились общие настройки)"""
+    if tenant_id is None:
+        cur.execute("""
+            UPDATE t_p56134400_telegram_ai_bot_pdf.tenants
+            SET settings_version = settings_version + 1
+        """)
+        return
+    cur.execute("""
+        UPDATE t_p56134400_telegram_ai_bot_pdf.tenants
+        SET settings_version = settings_version + 1
+        WHERE id = %s
+    """, (tenant_id,))
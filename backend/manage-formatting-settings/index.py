@@ -5,6 +5,7 @@ import psycopg2
 
 sys.path.append('/function/code')
 from auth_middleware import get_authenticated_user
+from settings_version import bump_settings_version
 
 def handler(event: dict, context) -> dict:
     """Управление настройками форматирования сообщений мессенджеров (только для суперадминов)"""
@@ -162,6 +163,8 @@ def handler(event: dict, context) -> dict:
                     WHERE tenant_id = %s
                 """, (json.dumps(emoji_map), tenant_id))
                 
+                bump_settings_version(cur, tenant_id)
+
                 conn.commit()
                 cur.close()
                 conn.close()
@@ -207,6 +210,8 @@ def handler(event: dict, context) -> dict:
             """, (tenant_id, messenger, use_emoji, use_markdown, use_lists_formatting,
                   json.dumps(custom_emoji_map), list_bullet_char, numbered_list_char))
             
+            bump_settings_version(cur, tenant_id)
+
             conn.commit()
             cur.close()
             conn.close()
@@ -4,6 +4,7 @@
 import json
 import os
 import psycopg2
+from settings_version import bump_settings_version
 
 
 def handler(event: dict, context) -> dict:
@@ -144,6 +145,8 @@ def handler(event: dict, context) -> dict:
                 tenant_id
             ))
             
+            bump_settings_version(cur, tenant_id)
+
             conn.commit()
             cur.close()
             conn.close()
@@ -0,0 +1,210 @@
+"""
+Очередь входящих апдейтов мессенджеров в Postgres (webhook_jobs, FOR UPDATE SKIP LOCKED).
+Webhook кладёт апдейт в очередь и сразу отвечает 200; повтор того же апдейта (Telegram
+переотправляет медленные webhook) отбрасывается уникальным ключом (channel, tenant_id, update_id).
+Очередь разбирает drain(): пул потоков берёт задачи по одной так, что в одном чате задачи
+выполняются строго по порядку, а у тенанта одновременно идёт не больше WEBHOOK_TENANT_CONCURRENCY.
+drain запускает сам webhook асинхронным вызовом себя (?drain=1), а таймер подбирает хвосты.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import requests
+
+from db_pool import connection
+
+# Воркер держит соединение пайплайна чата и берёт ещё одно на служебные запросы — при
+# DB_POOL_MAX_CONN=4 больше двух воркеров упрутся в пул
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '2'))
+WEBHOOK_TENANT_CONCURRENCY = int(os.environ.get('WEBHOOK_TENANT_CONCURRENCY', '2'))
+WEBHOOK_JOB_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_JOB_MAX_ATTEMPTS', '3'))
+# Задача в processing дольше этого считается брошенной (инстанс упал посреди обработки)
+WEBHOOK_JOB_LOCK_TIMEOUT_SEC = int(os.environ.get('WEBHOOK_JOB_LOCK_TIMEOUT_SEC', '180'))
+# drain перестаёт брать новые задачи, когда до конца бюджета остаётся меньше этого
+WEBHOOK_DRAIN_BUDGET_SEC = float(os.environ.get('WEBHOOK_DRAIN_BUDGET_SEC', '240'))
+WEBHOOK_JOB_RESERVE_SEC = 90
+WEBHOOK_JOB_RETENTION_DAYS = int(os.environ.get('WEBHOOK_JOB_RETENTION_DAYS', '7'))
+
+_worker_id = f'{os.getpid()}-{threading.get_ident()}'
+
+
+def update_key(*parts) -> str:
+    """Ключ дедупликации апдейта: id из мессенджера или хэш тела"""
+    parts = [str(part) for part in parts if part not in (None, '')]
+    if len(parts) == 1:
+        return parts[0]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def enqueue(channel: str, tenant_id: int, chat_key, update_id: str, payload: dict) -> bool:
+    """Кладёт апдейт в очередь. False — такой апдейт уже был (повтор webhook)"""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.webhook_jobs
+                (channel, tenant_id, chat_key, update_id, payload)
+            VALUES (%s, %s, %s, %s, %s::jsonb)
+            ON CONFLICT (channel, tenant_id, update_id) DO NOTHING
+            RETURNING id
+        """, (channel, tenant_id, str(chat_key), str(update_id), json.dumps(payload, ensure_ascii=False)))
+        created = cur.fetchone() is not None
+        conn.commit()
+        cur.close()
+    return created
+
+
+def kick_drain(drain_url: str):
+    """Асинхронно запускает разбор очереди: не ждём ответа, функция продолжит работу сама"""
+    headers = {'Content-Type': 'application/json'}
+    token = os.environ.get('CRON_SECRET_TOKEN')
+    if token:
+        headers['X-Auth-Token'] = token
+    try:
+        requests.post(f'{drain_url}?drain=1', json={}, headers=headers, timeout=(3, 0.5))
+    except requests.exceptions.ReadTimeout:
+        pass
+    except requests.exceptions.RequestException as e:
+        # Задача останется в очереди до таймера
+        print(f'[webhook-queue] Drain kick failed: {e}')
+
+
+def is_timer_event(event: dict) -> bool:
+    """Вызов от Yandex Cloud Timer Trigger (через HTTP такое событие не подделать: там тело в event['body'])"""
+    messages = event.get('messages') or []
+    return any(
+        'TimerMessage' in (message.get('event_metadata', {}).get('event_type') or '')
+        for message in messages if isinstance(message, dict)
+    )
+
+
+def is_drain_authorized(event: dict) -> bool:
+    if is_timer_event(event):
+        return True
+    headers = event.get('headers') or {}
+    expected_token = os.environ.get('CRON_SECRET_TOKEN')
+    auth_token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
+    return not expected_token or auth_token == expected_token
+
+
+def _requeue_stale(cur, channel: str):
+    cur.execute(f"""
+        UPDATE t_p56134400_telegram_ai_bot_pdf.webhook_jobs
+        SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+            last_error = 'lock timeout'
+        WHERE channel = %s AND status = 'processing'
+          AND locked_at < NOW() - INTERVAL '{WEBHOOK_JOB_LOCK_TIMEOUT_SEC} seconds'
+    """, (WEBHOOK_JOB_MAX_ATTEMPTS, channel))
+    cur.execute(f"""
+        DELETE FROM t_p56134400_telegram_ai_bot_pdf.webhook_jobs
+        WHERE channel = %s AND status IN ('done', 'failed')
+          AND finished_at < NOW() - INTERVAL '{WEBHOOK_JOB_RETENTION_DAYS} days'
+    """, (channel,))
+
+
+def _claim(cur, channel: str) -> Optional[dict]:
+    """
+    Самая старая задача канала, у чата которой нет задач в работе и более ранних в очереди,
+    а у тенанта свободен слот. SKIP LOCKED не даёт двум воркерам взять одну задачу.
+    """
+    cur.execute("""
+        WITH candidate AS (
+            SELECT j.id
+            FROM t_p56134400_telegram_ai_bot_pdf.webhook_jobs j
+            WHERE j.channel = %s
+              AND j.status = 'pending'
+              AND j.run_after <= NOW()
+              AND NOT EXISTS (
+                  SELECT 1 FROM t_p56134400_telegram_ai_bot_pdf.webhook_jobs p
+                  WHERE p.channel = j.channel AND p.tenant_id = j.tenant_id AND p.chat_key = j.chat_key
+                    AND (p.status = 'processing' OR (p.status = 'pending' AND p.id < j.id))
+              )
+              AND (
+                  SELECT COUNT(*) FROM t_p56134400_telegram_ai_bot_pdf.webhook_jobs r
+                  WHERE r.tenant_id = j.tenant_id AND r.status = 'processing'
+              ) < %s
+            ORDER BY j.id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE t_p56134400_telegram_ai_bot_pdf.webhook_jobs j
+        SET status = 'processing', locked_at = NOW(), locked_by = %s, attempts = j.attempts + 1
+        FROM candidate
+        WHERE j.id = candidate.id
+        RETURNING j.id, j.tenant_id, j.chat_key, j.payload, j.attempts
+    """, (channel, WEBHOOK_TENANT_CONCURRENCY, _worker_id))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return {'id': row[0], 'tenant_id': row[1], 'chat_key': row[2], 'payload': row[3], 'attempts': row[4]}
+
+
+def _finish(job: dict, error: Optional[str]):
+    with connection() as conn:
+        cur = conn.cursor()
+        if error is None:
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.webhook_jobs
+                SET status = 'done', finished_at = NOW(), last_error = NULL
+                WHERE id = %s
+            """, (job['id'],))
+        else:
+            # Повтор с экспоненциальной паузой; задачи этого чата ждут его (порядок сохраняется)
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.webhook_jobs
+                SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                    run_after = NOW() + (INTERVAL '5 seconds' * POWER(2, attempts - 1)),
+                    finished_at = CASE WHEN attempts >= %s THEN NOW() END,
+                    last_error = %s
+                WHERE id = %s
+            """, (WEBHOOK_JOB_MAX_ATTEMPTS, WEBHOOK_JOB_MAX_ATTEMPTS, error[:1000], job['id']))
+        conn.commit()
+        cur.close()
+
+
+def drain(channel: str, process: Callable[[dict], None], budget_sec: float = WEBHOOK_DRAIN_BUDGET_SEC) -> dict:
+    """
+    Разбирает очередь канала пулом из WEBHOOK_WORKERS потоков, пока есть доступные задачи
+    и хватает времени. process(job) получает {'id', 'tenant_id', 'chat_key', 'payload', 'attempts'};
+    исключение из process — повтор задачи позже.
+    """
+    deadline = time.monotonic() + budget_sec
+    stats = {'done': 0, 'failed': 0}
+    stats_lock = threading.Lock()
+
+    with connection() as conn:
+        cur = conn.cursor()
+        _requeue_stale(cur, channel)
+        conn.commit()
+        cur.close()
+
+    def worker():
+        while time.monotonic() < deadline - WEBHOOK_JOB_RESERVE_SEC:
+            with connection() as conn:
+                cur = conn.cursor()
+                job = _claim(cur, channel)
+                conn.commit()
+                cur.close()
+            if job is None:
+                return
+
+            try:
+                process(job)
+                error = None
+            except Exception as e:
+                print(f'[webhook-queue] Job {job["id"]} failed (attempt {job["attempts"]}): {e}')
+                error = str(e) or type(e).__name__
+            _finish(job, error)
+            with stats_lock:
+                stats['done' if error is None else 'failed'] += 1
+
+    with ThreadPoolExecutor(max_workers=WEBHOOK_WORKERS) as pool:
+        for future in [pool.submit(worker) for _ in range(WEBHOOK_WORKERS)]:
+            future.result()
+
+    print(f"[webhook-queue] {channel}: processed {stats['done']}, failed {stats['failed']}")
+    return stats
@@ -0,0 +1,193 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2.extras import execute_values
+import requests
+
+OPENROUTER_MODELS_URL = 'https://openrouter.ai/api/v1/models'
+OPENROUTER_COMPLETIONS_URL = 'https://openrouter.ai/api/v1/chat/completions'
+PROBE_TIMEOUT_SEC = float(os.environ.get('MODEL_PROBE_TIMEOUT_SEC', '20'))
+PROBE_WORKERS = int(os.environ.get('MODEL_PROBE_WORKERS', '8'))
+# Вес нового замера в скользящем среднем задержки и доли ошибок
+EWMA_ALPHA = 0.3
+
+# Группы взаимозаменяемых бесплатных моделей (в порядке предпочтения).
+# Ключи совпадают с friendly name из chat (get_provider_and_api_model), chat выбирает
+# самую быструю здоровую модель группы.
+PREFERRED_MODELS = {
+    'llama-3.3-70b': ['meta-llama/llama-3.3-70b-instruct:free'],
+    'gemini-2.0-flash': ['google/gemini-2.0-flash-exp:free'],
+    'deepseek-v3': ['deepseek/deepseek-chat:free', 'deepseek/deepseek-chat-v3-0324:free'],
+    'deepseek-r1': ['deepseek/deepseek-r1:free', 'deepseek/deepseek-r1-distill-llama-70b:free'],
+    'llama-3.1-405b': ['meta-llama/llama-3.1-405b-instruct:free'],
+    'qwen-2.5-72b': ['qwen/qwen-2.5-72b-instruct:free'],
+    'mistral-small': ['mistralai/mistral-small-3.1-24b-instruct:free', 'mistralai/mistral-7b-instruct:free'],
+    'phi-3-medium': ['microsoft/phi-3-medium-128k-instruct:free'],
+    'llama-3.1-8b': ['meta-llama/llama-3.1-8b-instruct:free', 'meta-llama/llama-3.2-3b-instruct:free'],
+    'gemma-2-9b': ['google/gemma-2-9b-it:free'],
+    'qwen-2.5-7b': ['qwen/qwen-2.5-7b-instruct:free'],
+}
+
+
+def is_timer_event(event: dict) -> bool:
+    """Вызов от Yandex Cloud Timer Trigger (через HTTP такое событие не подделать: там тело в event['body'])"""
+    messages = event.get('messages') or []
+    return any(
+        'TimerMessage' in (message.get('event_metadata', {}).get('event_type') or '')
+        for message in messages if isinstance(message, dict)
+    )
+
+
+def fetch_free_model_ids() -> set:
+    """ID бесплатных моделей из каталога OpenRouter (пустое множество, если каталог недоступен)"""
+    response = requests.get(OPENROUTER_MODELS_URL, timeout=15)
+    response.raise_for_status()
+
+    free_ids = set()
+    for model in response.json().get('data', []):
+        pricing = model.get('pricing', {})
+        if float(pricing.get('prompt', '0')) == 0 and float(pricing.get('completion', '0')) == 0:
+            free_ids.add(model.get('id', ''))
+    return free_ids
+
+
+def probe_model(api_key: str, model_id: str) -> dict:
+    """Один короткий запрос к модели: задержка и код ответа"""
+    started = time.monotonic()
+    try:
+        response = requests.post(
+            OPENROUTER_COMPLETIONS_URL,
+            headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'},
+            json={'model': model_id, 'messages': [{'role': 'user', 'content': 'ping'}], 'max_tokens': 1},
+            timeout=PROBE_TIMEOUT_SEC
+        )
+        latency_ms = (time.monotonic() - started) * 1000
+        ok = response.status_code == 200 and bool(response.json().get('choices'))
+        return {
+            'ok': ok,
+            'status': response.status_code,
+            'latency_ms': latency_ms,
+            'error': None if ok else response.text[:500]
+        }
+    except Exception as e:
+        return {'ok': False, 'status': None, 'latency_ms': None, 'error': str(e)[:500]}
+
+
+def handler(event: dict, context) -> dict:
+    """Фоновая проверка бесплатных моделей OpenRouter (вызывается по таймеру)
+
+    Опрашивает кандидатов из PREFERRED_MODELS, которые есть в каталоге, и пишет задержку
+    и долю ошибок в openrouter_model_health. chat читает таблицу и не ждёт каталог сам.
+
+    Настройка триггера: Yandex Cloud Functions → Trigger типа "Timer",
+    cron expression: */15 * * * ? * (каждые 15 минут)
+    """
+    if not is_timer_event(event):
+        headers = event.get('headers') or {}
+        expected_token = os.environ.get('CRON_SECRET_TOKEN')
+        auth_token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
+        if expected_token and auth_token != expected_token:
+            return {
+                'statusCode': 403,
+                'body': json.dumps({'success': False, 'error': 'Unauthorized: invalid cron token'})
+            }
+
+    api_key = os.environ.get('OPENROUTER_PROBE_API_KEY', '').strip()
+    if not api_key:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'success': False, 'error': 'OPENROUTER_PROBE_API_KEY не настроен'})
+        }
+
+    try:
+        try:
+            free_ids = fetch_free_model_ids()
+        except Exception as e:
+            # Без каталога проверяем всех кандидатов: недоступные отсеются по ошибкам
+            print(f"⚠️ [model-health] Catalogue fetch failed: {e}")
+            free_ids = None
+
+        candidates = []
+        for friendly_name, model_ids in PREFERRED_MODELS.items():
+            for model_id in model_ids:
+                candidates.append((friendly_name, model_id, free_ids is None or model_id in free_ids))
+
+        listed = [(friendly_name, model_id) for friendly_name, model_id, is_listed in candidates if is_listed]
+        with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as pool:
+            results = dict(zip(
+                [model_id for _, model_id in listed],
+                pool.map(lambda item: probe_model(api_key, item[1]), listed)
+            ))
+
+        rows = []
+        for friendly_name, model_id, is_listed in candidates:
+            result = results.get(model_id)
+            if result is None:
+                rows.append((model_id, friendly_name, False, 0, 0, None, None, None, 'not listed in catalogue'))
+                continue
+            rows.append((
+                model_id, friendly_name, True, 1, 0 if result['ok'] else 1,
+                result['latency_ms'] if result['ok'] else None,
+                0.0 if result['ok'] else 1.0, result['status'], result['error']
+            ))
+
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cur = conn.cursor()
+        # Задержка и доля ошибок — скользящие средние, чтобы один сбой не выкидывал модель
+        execute_values(cur, f"""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.openrouter_model_health
+                (model_id, friendly_name, is_listed, probes, failures, ewma_latency_ms, error_rate,
+                 last_status, last_error, last_probe_at, updated_at)
+            VALUES %s
+            ON CONFLICT (model_id) DO UPDATE SET
+                friendly_name = EXCLUDED.friendly_name,
+                is_listed = EXCLUDED.is_listed,
+                probes = openrouter_model_health.probes + EXCLUDED.probes,
+                failures = openrouter_model_health.failures + EXCLUDED.failures,
+                ewma_latency_ms = CASE
+                    WHEN EXCLUDED.ewma_latency_ms IS NULL THEN openrouter_model_health.ewma_latency_ms
+                    WHEN openrouter_model_health.ewma_latency_ms IS NULL THEN EXCLUDED.ewma_latency_ms
+                    ELSE {EWMA_ALPHA} * EXCLUDED.ewma_latency_ms + {1 - EWMA_ALPHA} * openrouter_model_health.ewma_latency_ms
+                END,
+                error_rate = CASE
+                    WHEN EXCLUDED.probes = 0 THEN openrouter_model_health.error_rate
+                    ELSE {EWMA_ALPHA} * EXCLUDED.error_rate + {1 - EWMA_ALPHA} * openrouter_model_health.error_rate
+                END,
+                last_status = EXCLUDED.last_status,
+                last_error = EXCLUDED.last_error,
+                last_probe_at = CASE WHEN EXCLUDED.probes = 0 THEN openrouter_model_health.last_probe_at ELSE NOW() END,
+                updated_at = NOW()
+        """, rows, template='(%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())')
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        healthy = sum(1 for result in results.values() if result['ok'])
+        print(f"✅ [model-health] Probed {len(results)} models, healthy: {healthy}, not listed: {len(candidates) - len(listed)}")
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'success': True,
+                'probed': len(results),
+                'healthy': healthy,
+                'models': {
+                    model_id: {
+                        'ok': result['ok'],
+                        'latency_ms': round(result['latency_ms']) if result['latency_ms'] else None
+                    }
+                    for model_id, result in results.items()
+                }
+            })
+        }
+
+    except Exception as e:
+        error_msg = f'Model health probe error: {str(e)}'
+        print(error_msg)
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'success': False, 'error': error_msg})
+        }
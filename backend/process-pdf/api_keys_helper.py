@@ -1,7 +1,7 @@
 """Утилита для работы с API ключами клиентов"""
 import os
 import json
-import psycopg2
+from db_pool import connection
 
 def get_tenant_api_key(tenant_id: int, provider: str, key_name: str) -> tuple[str | None, dict | None]:
     """
@@ -16,21 +16,20 @@ def get_tenant_api_key(tenant_id: int, provider: str, key_name: str) -> tuple[st
         (key_value, error_response) - либо значение ключа, либо HTTP ошибка
     """
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
         
-        cur.execute("""
-            SELECT key_value
-            FROM t_p56134400_telegram_ai_bot_pdf.tenant_api_keys
-            WHERE tenant_id = %s 
-              AND provider = %s 
-              AND key_name = %s 
-              AND is_active = true
-        """, (tenant_id, provider, key_name))
+            cur.execute("""
+                SELECT key_value
+                FROM t_p56134400_telegram_ai_bot_pdf.tenant_api_keys
+                WHERE tenant_id = %s 
+                  AND provider = %s 
+                  AND key_name = %s 
+                  AND is_active = true
+            """, (tenant_id, provider, key_name))
         
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+            row = cur.fetchone()
+            cur.close()
         
         if not row:
             error_msg = f"API ключ не настроен: {provider}.{key_name}. Добавьте ключи в админ-панели."
@@ -0,0 +1,122 @@
+"""
+Запись чанков документа в БД одной транзакцией.
+Старые чанки (и строки тарифов из tariff_table) удаляются и новые вставляются пачками через
+execute_values в рамках одного COMMIT, поэтому chat никогда не видит наполовину
+переиндексированный документ.
+По content_hash (модель + текст) уже посчитанные векторы переиспользуются без вызова API.
+"""
+import json
+import hashlib
+from typing import Dict, List, Optional
+
+from psycopg2.extras import execute_values
+
+from pgvector_helper import has_pgvector_column
+
+INSERT_PAGE_SIZE = 200
+
+
+def content_hash(chunk_text: str, embedding_provider: str, embedding_model: str) -> str:
+    """sha256 от модели эмбеддинга и текста: смена модели делает все хэши новыми"""
+    payload = f"{embedding_provider}:{embedding_model}\n{chunk_text}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def load_reusable_embeddings(cur, tenant_id: int, hashes: List[str]) -> Dict[str, bytes]:
+    """embedding_bin уже проиндексированных чанков тенанта по их content_hash"""
+    if not hashes:
+        return {}
+    cur.execute("""
+        SELECT DISTINCT ON (content_hash) content_hash, embedding_bin
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+        WHERE tenant_id = %s AND content_hash = ANY(%s) AND embedding_bin IS NOT NULL
+    """, (tenant_id, list(set(hashes))))
+    return {row[0]: bytes(row[1]) for row in cur.fetchall()}
+
+
+def replace_document_chunks(conn, tenant_id: int, document_id: int, chunk_records: List[Dict],
+                            chunk_embeddings: List[tuple], tariff_rows: Optional[List[Dict]] = None) -> int:
+    """
+    Атомарно заменяет чанки документа.
+    chunk_records — результат chunker.build_chunks, chunk_embeddings — кортежи
+    (chunk_text, embedding_json, embedding_bin, embedding_vec) в том же порядке,
+    tariff_rows — результат tariff_table.extract_tariff_rows (None — строки тарифов не трогаем).
+    content_hash пишется только для чанков с эмбеддингом, иначе повторный запуск не стал бы их досчитывать.
+    """
+    previous_autocommit = conn.autocommit
+    conn.autocommit = False
+    cur = conn.cursor()
+    try:
+        write_vec = has_pgvector_column(cur)
+
+        # Блокируем строку тенанта: параллельные переиндексации одного тенанта идут по очереди
+        cur.execute("""
+            SELECT chunks_version FROM t_p56134400_telegram_ai_bot_pdf.tenants
+            WHERE id = %s FOR UPDATE
+        """, (tenant_id,))
+
+        cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.document_chunks WHERE document_id = %s", (document_id,))
+        cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks WHERE document_id = %s", (document_id,))
+
+        document_rows = []
+        tenant_rows = []
+        for idx, (chunk_text, embedding_json, embedding_bin, embedding_vec) in enumerate(chunk_embeddings):
+            record = chunk_records[idx]
+            chunk_metadata = json.dumps({
+                'page_start': record['page_start'],
+                'page_end': record['page_end'],
+                'heading': record['heading']
+            }, ensure_ascii=False)
+
+            chunk_hash = record.get('content_hash') if embedding_bin is not None else None
+
+            document_rows.append((document_id, chunk_text, idx, embedding_json))
+            row = (tenant_id, document_id, chunk_text, idx, embedding_json, embedding_bin, chunk_metadata, chunk_hash)
+            tenant_rows.append(row + (embedding_vec,) if write_vec else row)
+
+        execute_values(cur, """
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.document_chunks
+            (document_id, chunk_text, chunk_index, embedding_text)
+            VALUES %s
+        """, document_rows, page_size=INSERT_PAGE_SIZE)
+
+        if write_vec:
+            execute_values(cur, """
+                INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+                (tenant_id, document_id, chunk_text, chunk_index, embedding_text, embedding_bin, chunk_metadata, content_hash, embedding_vec)
+                VALUES %s
+            """, tenant_rows, template='(%s, %s, %s, %s, %s, %s, %s::jsonb, %s, %s::vector)', page_size=INSERT_PAGE_SIZE)
+        else:
+            execute_values(cur, """
+                INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+                (tenant_id, document_id, chunk_text, chunk_index, embedding_text, embedding_bin, chunk_metadata, content_hash)
+                VALUES %s
+            """, tenant_rows, template='(%s, %s, %s, %s, %s, %s, %s::jsonb, %s)', page_size=INSERT_PAGE_SIZE)
+
+        if tariff_rows is not None:
+            cur.execute("DELETE FROM t_p56134400_telegram_ai_bot_pdf.tenant_tariff_rows WHERE document_id = %s", (document_id,))
+            execute_values(cur, """
+                INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_tariff_rows
+                (tenant_id, document_id, room_category, date_from, date_to, price, currency, conditions, page_number, source_text)
+                VALUES %s
+            """, [
+                (tenant_id, document_id, row['room_category'], row['date_from'], row['date_to'], row['price'],
+                 row['currency'], row['conditions'], row['page'], row['source_text'])
+                for row in tariff_rows
+            ], page_size=INSERT_PAGE_SIZE)
+
+        # Инвалидируем тёплый кэш индекса тенанта в chat
+        cur.execute("""
+            UPDATE t_p56134400_telegram_ai_bot_pdf.tenants
+            SET chunks_version = chunks_version + 1
+            WHERE id = %s
+        """, (tenant_id,))
+
+        conn.commit()
+        return len(tenant_rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.autocommit = previous_autocommit
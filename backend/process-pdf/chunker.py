@@ -0,0 +1,169 @@
+"""
+Разбиение текста PDF на чанки по структуре документа: страницы → абзацы → предложения.
+Чанк набирается целыми абзацами/предложениями до target_size символов, следующий чанк
+начинается с хвоста предыдущего (overlap). Номера страниц и ближайший заголовок
+сохраняются в метаданных чанка.
+"""
+import re
+from typing import Dict, Iterable, List, Optional
+
+CHUNK_TARGET_SIZE_DEFAULT = 1000
+CHUNK_OVERLAP_DEFAULT = 150
+CHUNK_STRATEGIES = ('structured', 'fixed')
+
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?…])\s+(?=[A-ZА-ЯЁ0-9«"(])')
+_PARAGRAPH_SPLIT_RE = re.compile(r'\n\s*\n')
+_NUMBERED_HEADING_RE = re.compile(r'^(\d+(\.\d+)*\.?|[IVXLC]+\.)\s+\S')
+
+
+def get_chunking_settings(raw: Optional[dict]) -> Dict:
+    """Настройки из tenant_settings.chunking_settings с дефолтами и защитой от мусора"""
+    raw = raw or {}
+
+    def to_int(value, default, low, high):
+        try:
+            return max(low, min(high, int(value)))
+        except (TypeError, ValueError):
+            return default
+
+    target_size = to_int(raw.get('target_size'), CHUNK_TARGET_SIZE_DEFAULT, 200, 4000)
+    overlap = to_int(raw.get('overlap'), CHUNK_OVERLAP_DEFAULT, 0, target_size // 2)
+    strategy = raw.get('strategy') if raw.get('strategy') in CHUNK_STRATEGIES else 'structured'
+    return {'target_size': target_size, 'overlap': overlap, 'strategy': strategy}
+
+
+def is_heading(line: str) -> bool:
+    line = line.strip()
+    if not line or len(line) > 80 or line.endswith(('.', ',', ';')):
+        return False
+    letters = [c for c in line if c.isalpha()]
+    if len(letters) < 3:
+        return False
+    if all(c.isupper() for c in letters):
+        return True
+    if line.endswith(':') and len(line.split()) <= 8:
+        return True
+    return bool(_NUMBERED_HEADING_RE.match(line)) and len(line.split()) <= 10
+
+
+def _split_long(text: str, max_size: int) -> List[str]:
+    """Абзац длиннее max_size режется по предложениям, предложение — по словам"""
+    if len(text) <= max_size:
+        return [text]
+
+    pieces: List[str] = []
+    for sentence in _SENTENCE_SPLIT_RE.split(text):
+        if len(sentence) <= max_size:
+            pieces.append(sentence)
+            continue
+        words, current = sentence.split(), ''
+        for word in words:
+            if current and len(current) + 1 + len(word) > max_size:
+                pieces.append(current)
+                current = word
+            else:
+                current = f"{current} {word}" if current else word
+        if current:
+            pieces.append(current)
+    return pieces
+
+
+def _page_units(page_text: str, page_number: int, max_size: int, heading: Optional[str]):
+    """Единицы упаковки (текст, страница, заголовок) для одной страницы"""
+    units = []
+    for paragraph in _PARAGRAPH_SPLIT_RE.split(page_text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+
+        first_line = paragraph.split('\n', 1)[0]
+        if is_heading(first_line):
+            heading = first_line.strip().rstrip(':')
+
+        # Внутри абзаца переносы строк из PDF — это перенос вёрстки, а не смысловая граница.
+        # Строки таблиц (несколько колонок через пробелы) оставляем построчно.
+        lines = [line.strip() for line in paragraph.split('\n') if line.strip()]
+        looks_like_table = sum(1 for line in lines if re.search(r'\S\s{2,}\S|\t', line)) >= max(2, len(lines) // 2)
+        joined = '\n'.join(lines) if looks_like_table else ' '.join(lines)
+
+        for piece in _split_long(joined, max_size):
+            units.append((piece, page_number, heading))
+    return units, heading
+
+
+def chunk_pages(page_texts: Iterable[str], target_size: int = CHUNK_TARGET_SIZE_DEFAULT,
+                overlap: int = CHUNK_OVERLAP_DEFAULT) -> List[Dict]:
+    """
+    Чанки документа: [{'text', 'page_start', 'page_end', 'heading'}].
+    page_texts — текст каждой страницы в порядке следования (страницы нумеруются с 1);
+    может быть генератором — страницы обрабатываются по мере поступления.
+    """
+    chunks: List[Dict] = []
+    current: List[tuple] = []
+    current_len = 0
+    carried = 0  # сколько единиц в начале буфера перенесено из предыдущего чанка
+    heading = None
+    units_total = 0
+    units_emitted = 0  # собственные (не перенесённые) единицы, попавшие в чанки
+
+    def emit():
+        nonlocal units_emitted
+        units_emitted += len(current) - carried
+        text = '\n'.join(unit[0] for unit in current).strip()
+        if text:
+            chunks.append({
+                'text': text,
+                'page_start': current[0][1],
+                'page_end': current[-1][1],
+                'heading': current[min(carried, len(current) - 1)][2],
+            })
+
+    def carry_overlap():
+        # Хвост текущего чанка переносим в следующий целыми единицами
+        nonlocal current, current_len, carried
+        tail: List[tuple] = []
+        tail_len = 0
+        for unit in reversed(current):
+            if tail_len + len(unit[0]) > overlap:
+                break
+            tail.insert(0, unit)
+            tail_len += len(unit[0]) + 1
+        current = tail
+        current_len = tail_len
+        carried = len(tail)
+
+    for page_number, page_text in enumerate(page_texts, start=1):
+        units, heading = _page_units(page_text or '', page_number, target_size, heading)
+        for unit in units:
+            # len(current) == carried означает, что в буфере только перенесённый хвост
+            if current_len + len(unit[0]) > target_size and len(current) > carried:
+                emit()
+                carry_overlap()
+            current.append(unit)
+            current_len += len(unit[0]) + 1
+            units_total += 1
+
+    # Последний чанк, если в нём есть что-то кроме хвоста предыдущего
+    if len(current) > carried:
+        emit()
+
+    if units_emitted != units_total:
+        print(f"⚠️ CHUNKER LOST TEXT: {units_total - units_emitted} of {units_total} units not in any chunk")
+
+    return chunks
+
+
+def chunk_fixed(page_texts: Iterable[str], chunk_size: int = CHUNK_TARGET_SIZE_DEFAULT) -> List[Dict]:
+    """Прежняя нарезка каждые chunk_size символов (strategy='fixed')"""
+    full_text = ''.join(f"{text or ''}\n\n" for text in page_texts)
+    return [
+        {'text': full_text[i:i + chunk_size], 'page_start': None, 'page_end': None, 'heading': None}
+        for i in range(0, len(full_text), chunk_size)
+        if full_text[i:i + chunk_size].strip()
+    ]
+
+
+def build_chunks(page_texts: Iterable[str], settings: Dict) -> List[Dict]:
+    if settings['strategy'] == 'fixed':
+        return chunk_fixed(page_texts, settings['target_size'])
+    return chunk_pages(page_texts, settings['target_size'], settings['overlap'])
@@ -0,0 +1,19 @@
+"""
+Бинарный формат эмбеддингов для tenant_chunks.embedding_bin.
+float32 big-endian подряд, без заголовка — байт-в-байт то же, что float4send() в Postgres,
+поэтому миграция может заполнить колонку из JSON прямо в SQL.
+"""
+import struct
+
+EMBEDDING_DTYPE = '>f4'
+
+
+def encode_embedding(vector) -> bytes:
+    """Список float → bytes для колонки embedding_bin"""
+    return struct.pack(f'>{len(vector)}f', *vector)
+
+
+def decode_embedding(data) -> list:
+    """bytes/memoryview из embedding_bin → список float"""
+    data = bytes(data)
+    return list(struct.unpack(f'>{len(data) // 4}f', data))
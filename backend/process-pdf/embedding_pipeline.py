@@ -0,0 +1,151 @@
+"""
+Параллельная генерация эмбеддингов чанков через Yandex textEmbedding.
+Пул потоков с общей keep-alive сессией (переживает тёплые вызовы функции), token bucket вместо фиксированных sleep,
+повтор с джиттером на 429/5xx и сетевых ошибках.
+"""
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+YANDEX_EMBEDDING_URL = 'https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding'
+
+EMBED_MAX_WORKERS = int(os.environ.get('EMBED_MAX_WORKERS', '8'))
+EMBED_RATE_PER_SEC = float(os.environ.get('EMBED_RATE_PER_SEC', '10'))
+EMBED_MAX_RETRIES = int(os.environ.get('EMBED_MAX_RETRIES', '4'))
+EMBED_TIMEOUT = 30
+# Сессию делят воркеры индексации, которые эмбеддят разные документы одновременно
+EMBED_SESSION_POOL_FACTOR = 3
+
+
+class TokenBucket:
+    """Потокобезопасный token bucket: не больше rate запросов в секунду, всплеск до capacity"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RetryableEmbeddingError(Exception):
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _backoff_delay(attempt: int, retry_after: float = None) -> float:
+    if retry_after:
+        return retry_after
+    # full jitter: равномерно от 0 до 0.5 * 2^attempt, но не больше 8 секунд
+    return random.uniform(0, min(8.0, 0.5 * (2 ** attempt)))
+
+
+_session = None
+_session_lock = threading.Lock()
+# Один bucket на процесс: документы, которые индексируются параллельно, делят общий лимит API
+_bucket = TokenBucket(EMBED_RATE_PER_SEC)
+
+
+def _get_session() -> requests.Session:
+    """Сессия на модуль: TLS-соединения с Yandex переиспользуются между документами"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, EMBED_MAX_WORKERS * EMBED_SESSION_POOL_FACTOR))
+            _session.mount('https://', adapter)
+        return _session
+
+
+def _embed_one(session: requests.Session, bucket: TokenBucket, headers: dict, model_uri: str, text: str) -> List[float]:
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        bucket.acquire()
+        try:
+            response = session.post(
+                YANDEX_EMBEDDING_URL,
+                headers=headers,
+                json={'modelUri': model_uri, 'text': text},
+                timeout=EMBED_TIMEOUT
+            )
+            if response.status_code == 429 or response.status_code >= 500:
+                retry_after = response.headers.get('Retry-After')
+                raise RetryableEmbeddingError(
+                    f"Yandex API error: {response.status_code}",
+                    float(retry_after) if retry_after and retry_after.isdigit() else None
+                )
+            if response.status_code != 200:
+                raise Exception(f"Yandex API error: {response.status_code}, {response.text[:200]}")
+
+            data = response.json()
+            if 'embedding' not in data:
+                raise Exception("Missing 'embedding' in response")
+            return data['embedding']
+
+        except (RetryableEmbeddingError, requests.ConnectionError, requests.Timeout) as e:
+            if attempt == EMBED_MAX_RETRIES:
+                raise
+            delay = _backoff_delay(attempt, getattr(e, 'retry_after', None))
+            print(f"⏳ Embedding retry {attempt + 1}/{EMBED_MAX_RETRIES} in {delay:.2f}s: {e}")
+            time.sleep(delay)
+
+
+def embed_chunks(chunks: List[str], api_key: str, folder_id: str, model: str) -> Tuple[List[Optional[List[float]]], int]:
+    """
+    Эмбеддинги для всех чанков в исходном порядке (None для чанков, которые не удалось обработать)
+    и суммарная оценка токенов по успешным чанкам — для одной записи в token_usage.
+    """
+    if not chunks:
+        return [], 0
+
+    workers = max(1, min(EMBED_MAX_WORKERS, len(chunks)))
+    session = _get_session()
+    bucket = _bucket
+    headers = {
+        'Authorization': f'Api-Key {api_key}',
+        'Content-Type': 'application/json'
+    }
+    model_uri = f'emb://{folder_id}/{model}/latest'
+
+    results: List[Optional[List[float]]] = [None] * len(chunks)
+    done = {'count': 0}
+    done_lock = threading.Lock()
+
+    def worker(idx: int):
+        try:
+            results[idx] = _embed_one(session, bucket, headers, model_uri, chunks[idx])
+        except Exception as e:
+            print(f"❌ Embedding error for chunk {idx}: {e}")
+        with done_lock:
+            done['count'] += 1
+            if done['count'] % 20 == 0:
+                print(f"✅ Processed {done['count']}/{len(chunks)} chunks")
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(worker, range(len(chunks))))
+
+    # Примерно 256 токенов на chunk, как и раньше
+    tokens_total = sum(min(len(chunks[i]) // 4, 256) for i, vector in enumerate(results) if vector is not None)
+    failed = sum(1 for vector in results if vector is None)
+    print(f"⚡ Embedded {len(chunks) - failed}/{len(chunks)} chunks in {time.monotonic() - started:.1f}s "
+          f"(workers={workers}, rate={EMBED_RATE_PER_SEC}/s, failed={failed})")
+    return results, tokens_total
@@ -0,0 +1,306 @@
+"""
+Стадии индексации документа: fetch → extract → chunk → embed → write.
+Каждая стадия читает результат предыдущей из checkpoint задачи и сохраняет свой, поэтому
+повторный запуск пропускает пройденные стадии, а embed досчитывает только недостающие векторы.
+extract и chunk идут потоком: страницы из pdf_extract сразу попадают в чанкер.
+"""
+import os
+import json
+import base64
+import time
+from typing import Iterable, Iterator, List, Optional
+
+import boto3
+
+from db_pool import connection
+from token_logger import log_token_usage
+from embedding_codec import encode_embedding, decode_embedding
+from pgvector_helper import to_pgvector_literal
+from embedding_pipeline import embed_chunks
+from chunker import get_chunking_settings, build_chunks
+from pdf_extract import count_pages, iter_page_texts, select_extractor, resolve_extractor
+from chunk_store import replace_document_chunks, content_hash, load_reusable_embeddings
+from tariff_table import extract_tariff_rows
+from ingestion_worker import JobContext, JobYield, IngestionError, DocumentGone
+
+# Защита от случайно загруженных книг; время вызова больше не ограничение — задача продолжится в следующем
+INGEST_MAX_PAGES = int(os.environ.get('INGEST_MAX_PAGES', '1000'))
+INGEST_MAX_CHUNKS = int(os.environ.get('INGEST_MAX_CHUNKS', '5000'))
+# Сколько страниц извлекаем и сколько чанков эмбеддим между сохранениями checkpoint
+INGEST_EXTRACT_CHECKPOINT_PAGES = int(os.environ.get('INGEST_EXTRACT_CHECKPOINT_PAGES', '50'))
+INGEST_EMBED_BATCH = int(os.environ.get('INGEST_EMBED_BATCH', '64'))
+
+
+def _load_document(document_id: int, tenant_id: int) -> Optional[tuple]:
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT file_key FROM t_p56134400_telegram_ai_bot_pdf.tenant_documents
+            WHERE id = %s AND tenant_id = %s
+        """, (document_id, tenant_id))
+        row = cur.fetchone()
+        cur.close()
+    return row
+
+
+def fetch_pdf(ctx: JobContext) -> bytes:
+    row = _load_document(ctx.document_id, ctx.tenant_id)
+    if not row:
+        raise DocumentGone(f'document {ctx.document_id} not found')
+
+    s3 = boto3.client('s3',
+        endpoint_url='https://bucket.poehali.dev',
+        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+    )
+    print(f"📦 TRYING TO GET FILE FROM S3: Bucket='files', Key='{row[0]}'")
+    pdf_data = s3.get_object(Bucket='files', Key=row[0])['Body'].read()
+    print(f"✅ FILE DOWNLOADED FROM S3: {len(pdf_data)} bytes")
+    ctx.metrics['file_size'] = len(pdf_data)
+    return pdf_data
+
+
+def extract_pages(ctx: JobContext, pdf_data: bytes, page_texts: List[str], extractor: str = 'auto') -> Iterator[str]:
+    """Текст страниц потоком; по пути копит их в page_texts и пишет прогресс.
+    Бэкенд выбирается пробой на нескольких страницах, замеры бэкендов уходят в metrics задачи.
+    Извлечённые страницы сохраняются в checkpoint['extracted_pages'] каждые INGEST_EXTRACT_CHECKPOINT_PAGES
+    страниц и перед JobYield: следующий вызов продолжает со следующей страницы тем же бэкендом"""
+    pages_count = count_pages(pdf_data)
+    print(f"📄 PDF HAS {pages_count} PAGES")
+    if pages_count > INGEST_MAX_PAGES:
+        raise IngestionError(f'PDF слишком большой: {pages_count} страниц. Максимум: {INGEST_MAX_PAGES} страниц')
+
+    choice = ctx.checkpoint.get('extractor')
+    if choice is None:
+        choice = select_extractor(pdf_data, pages_count, extractor)
+        print(f"🔧 PDF EXTRACTOR: {choice['backend']} (layout={choice['layout']}, reason={choice['reason']}, "
+              f"table_score={choice['table_score']}), probe={choice['probe']}")
+        ctx.metrics['extractor_probe'] = choice.pop('probe')
+        ctx.save_checkpoint(extractor=choice)
+
+    # Страницы прошлых вызовов: ключи — номера страниц с нуля, сохраняются по порядку
+    extracted = ctx.checkpoint.get('extracted_pages', {})
+    for idx in range(len(extracted)):
+        page_texts.append(extracted[str(idx)])
+        yield page_texts[-1]
+    first_page = len(page_texts)
+    if first_page:
+        print(f"⏯️ RESUMING EXTRACTION FROM PAGE {first_page + 1}")
+
+    ctx.progress(first_page, pages_count)
+    pages = iter_page_texts(pdf_data, pages_count, backend=choice['backend'], layout=choice['layout'],
+                            first_page=first_page)
+    pending = {}
+    # Время только самого извлечения: генератор прерывается чанкером на каждой странице
+    extract_time = 0.0
+    while True:
+        started = time.perf_counter()
+        text = next(pages, None)
+        extract_time += time.perf_counter() - started
+        if text is None:
+            break
+        pending[str(len(page_texts))] = text
+        page_texts.append(text)
+        ctx.progress(len(page_texts), pages_count)
+        if len(pending) >= INGEST_EXTRACT_CHECKPOINT_PAGES:
+            ctx.merge_checkpoint('extracted_pages', pending)
+            pending = {}
+        try:
+            ctx.check_time()
+        except JobYield:
+            if pending:
+                ctx.merge_checkpoint('extracted_pages', pending)
+            pages.close()
+            raise
+        yield text
+
+    chars = sum(len(text) for text in page_texts)
+    ctx.metrics['extractor'] = {
+        'backend': choice['backend'],
+        'layout': choice['layout'],
+        'reason': choice['reason'],
+        'table_score': choice['table_score'],
+        'text_density': choice['text_density'],
+        'pages_per_sec': round((pages_count - first_page) / max(extract_time, 1e-6), 1),
+        'chars': chars
+    }
+    print(f"✅ TEXT EXTRACTED: {chars} chars in {extract_time:.2f}s with {choice['backend']}")
+
+
+def load_embedding_settings(tenant_id: int) -> dict:
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT embedding_provider, embedding_doc_model, chunking_settings
+            FROM t_p56134400_telegram_ai_bot_pdf.tenant_settings
+            WHERE tenant_id = %s
+        """, (tenant_id,))
+        settings_row = cur.fetchone()
+        cur.close()
+
+    raw_chunking = (settings_row[2] if settings_row else None) or {}
+    settings = {
+        'provider': settings_row[0] if settings_row and settings_row[0] else 'yandex',
+        'model': settings_row[1] if settings_row and settings_row[1] else 'text-search-doc',
+        'chunking': get_chunking_settings(raw_chunking),
+        'extractor': resolve_extractor(raw_chunking.get('extractor'))
+    }
+    print(f"⚙️ EMBEDDING SETTINGS: provider={settings['provider']}, model={settings['model']}")
+    print(f"⚙️ CHUNKING SETTINGS: {settings['chunking']}, extractor={settings['extractor']}")
+    return settings
+
+
+def chunk_document(page_texts: Iterable[str], settings: dict) -> List[dict]:
+    """Чанки с content_hash под модель эмбеддинга; page_texts может быть генератором"""
+    chunk_records = build_chunks(page_texts, settings['chunking'])
+    print(f"✂️ CREATED {len(chunk_records)} CHUNKS")
+    if len(chunk_records) > INGEST_MAX_CHUNKS:
+        raise IngestionError(f'Слишком много текста: {len(chunk_records)} фрагментов. Максимум: {INGEST_MAX_CHUNKS}')
+
+    for record in chunk_records:
+        record['content_hash'] = content_hash(record['text'], settings['provider'], settings['model'])
+    return chunk_records
+
+
+def embed_document(ctx: JobContext) -> List[Optional[list]]:
+    """Векторы чанков: из checkpoint, по content_hash из БД, остальные — пачками через API"""
+    chunk_records = ctx.checkpoint['chunks']
+    embedding = ctx.checkpoint['embedding']
+    total = len(chunk_records)
+
+    vectors: List[Optional[list]] = [None] * total
+    for idx, encoded in (ctx.checkpoint.get('embeddings') or {}).items():
+        vectors[int(idx)] = decode_embedding(base64.b64decode(encoded))
+    resumed_count = sum(1 for vector in vectors if vector is not None)
+
+    pending_hashes = [record['content_hash'] for record, vector in zip(chunk_records, vectors) if vector is None]
+    with connection() as conn:
+        cur = conn.cursor()
+        reusable = load_reusable_embeddings(cur, ctx.tenant_id, pending_hashes)
+        cur.close()
+    for idx, record in enumerate(chunk_records):
+        if vectors[idx] is None and record['content_hash'] in reusable:
+            vectors[idx] = decode_embedding(reusable[record['content_hash']])
+
+    missing_idx = [idx for idx, vector in enumerate(vectors) if vector is None]
+    reused_count = total - len(missing_idx) - resumed_count
+    print(f"♻️ REUSED {reused_count}/{total} EMBEDDINGS BY CONTENT HASH, {resumed_count} FROM CHECKPOINT")
+    ctx.metrics['reused_chunks'] = reused_count
+    ctx.progress(total - len(missing_idx), total)
+
+    # ВСЕГДА используем PROJECT секреты для эмбеддингов
+    yandex_api_key = os.environ.get('YANDEXGPT_API_KEY')
+    yandex_folder_id = os.environ.get('YANDEXGPT_FOLDER_ID')
+    if not missing_idx:
+        return vectors
+    if embedding['provider'] != 'yandex' or not yandex_api_key or not yandex_folder_id:
+        print(f"Embeddings disabled: provider={embedding['provider']}, has_key={bool(yandex_api_key)}")
+        return vectors
+
+    print(f"🚀 STARTING EMBEDDING GENERATION for {len(missing_idx)} chunks...")
+    for start in range(0, len(missing_idx), INGEST_EMBED_BATCH):
+        ctx.check_time()
+        batch_idx = missing_idx[start:start + INGEST_EMBED_BATCH]
+        new_vectors, embedding_tokens = embed_chunks(
+            [chunk_records[idx]['text'] for idx in batch_idx], yandex_api_key, yandex_folder_id, embedding['model']
+        )
+
+        embedded = {}
+        for idx, vector in zip(batch_idx, new_vectors):
+            if vector is not None:
+                vectors[idx] = vector
+                embedded[str(idx)] = base64.b64encode(encode_embedding(vector)).decode('ascii')
+        if embedded:
+            ctx.merge_checkpoint('embeddings', embedded)
+
+        # Одна запись в token_usage на пачку вместо записи на каждый чанк
+        if embedding_tokens > 0:
+            log_token_usage(
+                tenant_id=ctx.tenant_id,
+                operation_type='embedding_create',
+                model=embedding['model'],
+                tokens_used=embedding_tokens,
+                metadata={'document_id': ctx.document_id, 'chunks': len(embedded), 'job_id': ctx.id}
+            )
+        ctx.metrics['embedded_chunks'] = ctx.metrics.get('embedded_chunks', 0) + len(embedded)
+        ctx.progress(total - len(missing_idx) + start + len(batch_idx), total)
+
+    return vectors
+
+
+def write_document(ctx: JobContext, vectors: List[Optional[list]]):
+    """Атомарная замена чанков и строк тарифов документа, статус ready"""
+    chunk_records = ctx.checkpoint['chunks']
+    chunk_embeddings = []
+    for record, vector in zip(chunk_records, vectors):
+        if vector is None:
+            chunk_embeddings.append((record['text'], None, None, None))
+        else:
+            chunk_embeddings.append((
+                record['text'],
+                json.dumps(vector),
+                encode_embedding(vector),
+                to_pgvector_literal(vector)
+            ))
+
+    if not _load_document(ctx.document_id, ctx.tenant_id):
+        raise DocumentGone(f'document {ctx.document_id} deleted during ingestion')
+
+    pages_count = len(ctx.checkpoint['pages'])
+    try:
+        tariff_rows = extract_tariff_rows(ctx.checkpoint['pages'])
+        print(f"💰 FOUND {len(tariff_rows)} TARIFF ROWS")
+    except Exception as e:
+        # Эмбеддинги уже оплачены: без строк тарифов документ остаётся доступен через обычный RAG
+        print(f"⚠️ Tariff rows extraction failed, storing chunks only: {e}")
+        tariff_rows = []
+    with connection() as conn:
+        inserted = replace_document_chunks(conn, ctx.tenant_id, ctx.document_id, chunk_records, chunk_embeddings,
+                                           tariff_rows)
+        print(f"📝 Replaced chunks for document_id={ctx.document_id}: {inserted} chunks, "
+              f"{len(tariff_rows)} tariff rows in one transaction")
+
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_documents
+            SET status = 'ready', pages = %s
+            WHERE id = %s
+        """, (pages_count, ctx.document_id))
+        conn.commit()
+        cur.close()
+
+    ctx.metrics.update({'pages': pages_count, 'chunks': inserted, 'tariff_rows': len(tariff_rows)})
+
+
+def run_job(ctx: JobContext):
+    """Проводит задачу по стадиям, начиная с первой непройденной"""
+    if 'chunks' not in ctx.checkpoint:
+        settings = load_embedding_settings(ctx.tenant_id)
+        if 'pages' in ctx.checkpoint:
+            page_texts = ctx.checkpoint['pages']
+            ctx.enter_stage('chunk', total=len(page_texts))
+            chunk_records = chunk_document(page_texts, settings)
+        else:
+            ctx.enter_stage('fetch')
+            pdf_data = fetch_pdf(ctx)
+            ctx.enter_stage('extract')
+            page_texts = []
+            chunk_records = chunk_document(extract_pages(ctx, pdf_data, page_texts, settings['extractor']), settings)
+            del pdf_data
+        # Страницы целиком переходят в checkpoint['pages'], частичное извлечение больше не нужно
+        ctx.checkpoint.pop('extracted_pages', None)
+        ctx.checkpoint.pop('extractor', None)
+        ctx.save_checkpoint(
+            pages=page_texts,
+            chunks=chunk_records,
+            embedding={'provider': settings['provider'], 'model': settings['model']},
+            embeddings={}
+        )
+    ctx.check_time()
+
+    ctx.enter_stage('embed', total=len(ctx.checkpoint['chunks']))
+    vectors = embed_document(ctx)
+
+    ctx.enter_stage('write', total=len(vectors))
+    write_document(ctx, vectors)
+    print(f"✅ ALL OPERATIONS COMPLETED SUCCESSFULLY: job={ctx.id}, doc={ctx.document_id}")
@@ -0,0 +1,323 @@
+"""
+Разбор очереди индексации документов (ingestion_jobs, FOR UPDATE SKIP LOCKED).
+drain() пулом потоков берёт задачи разных документов и тенантов параллельно (у тенанта
+одновременно не больше INGEST_TENANT_CONCURRENCY) и проводит каждую по стадиям
+ingestion_pipeline. Результат каждой стадии сохраняется в checkpoint задачи: если вызов
+функции упал или кончается время, задача возвращается в очередь и продолжается с того же места.
+"""
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from db_pool import connection
+from ingestion_jobs import kick_ingestion
+
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', '3'))
+INGEST_TENANT_CONCURRENCY = int(os.environ.get('INGEST_TENANT_CONCURRENCY', '2'))
+INGEST_JOB_MAX_ATTEMPTS = int(os.environ.get('INGEST_JOB_MAX_ATTEMPTS', '3'))
+# Задача в processing дольше этого считается брошенной (инстанс упал посреди обработки)
+INGEST_JOB_LOCK_TIMEOUT_SEC = int(os.environ.get('INGEST_JOB_LOCK_TIMEOUT_SEC', '300'))
+INGEST_DRAIN_BUDGET_SEC = float(os.environ.get('INGEST_DRAIN_BUDGET_SEC', '240'))
+# Новую задачу не берём, если до конца бюджета осталось меньше этого
+INGEST_JOB_RESERVE_SEC = 30
+INGEST_PROGRESS_INTERVAL_SEC = 1.0
+INGEST_JOB_RETENTION_DAYS = int(os.environ.get('INGEST_JOB_RETENTION_DAYS', '30'))
+
+_worker_id = f'{os.getpid()}-{threading.get_ident()}'
+
+
+class JobYield(Exception):
+    """Время вызова на исходе: задача вернётся в очередь и продолжится с checkpoint"""
+
+
+class IngestionError(Exception):
+    """Повтор не поможет (документ не подходит под ограничения) — задача сразу failed"""
+
+
+class DocumentGone(Exception):
+    """Документ удалили, пока задача ждала или шла — задача отменяется"""
+
+
+class JobContext:
+    """Состояние задачи для стадий: checkpoint, прогресс и метрики с записью в ingestion_jobs"""
+
+    def __init__(self, job: dict, deadline: float):
+        self.job = job
+        self.id = job['id']
+        self.tenant_id = job['tenant_id']
+        self.document_id = job['document_id']
+        self.checkpoint = dict(job['checkpoint'] or {})
+        self.metrics = dict(job['metrics'] or {})
+        self.metrics.setdefault('stages', {})
+        self.deadline = deadline
+        self.stage = None
+        self._stage_started = None
+        self._progress_written_at = 0.0
+
+    def check_time(self):
+        if time.monotonic() > self.deadline:
+            raise JobYield(f'stage {self.stage}')
+
+    def _close_stage(self):
+        if self.stage and self._stage_started is not None:
+            elapsed = time.monotonic() - self._stage_started
+            self.metrics['stages'][self.stage] = round(self.metrics['stages'].get(self.stage, 0) + elapsed, 3)
+
+    def enter_stage(self, stage: str, total: int = 0):
+        self._close_stage()
+        self.stage = stage
+        self._stage_started = time.monotonic()
+        print(f"⏩ [ingestion] job={self.id} doc={self.document_id}: {stage}")
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+                SET stage = %s, stage_done = 0, stage_total = %s, metrics = %s::jsonb, updated_at = NOW()
+                WHERE id = %s
+            """, (stage, total, json.dumps(self.metrics), self.id))
+            conn.commit()
+            cur.close()
+        self._progress_written_at = time.monotonic()
+
+    def progress(self, done: int, total: int):
+        """Прогресс стадии; пишется в БД не чаще раза в INGEST_PROGRESS_INTERVAL_SEC"""
+        now = time.monotonic()
+        if done < total and now - self._progress_written_at < INGEST_PROGRESS_INTERVAL_SEC:
+            return
+        self._progress_written_at = now
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+                SET stage_done = %s, stage_total = %s, updated_at = NOW()
+                WHERE id = %s
+            """, (done, total, self.id))
+            conn.commit()
+            cur.close()
+
+    def save_checkpoint(self, **values):
+        """Результат стадии: с него задача продолжится после сбоя"""
+        self.checkpoint.update(values)
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+                SET checkpoint = %s::jsonb, updated_at = NOW()
+                WHERE id = %s
+            """, (json.dumps(self.checkpoint, ensure_ascii=False), self.id))
+            conn.commit()
+            cur.close()
+
+    def merge_checkpoint(self, key: str, values: dict):
+        """Дописывает values в словарь checkpoint[key], не пересылая весь checkpoint"""
+        self.checkpoint.setdefault(key, {}).update(values)
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+                SET checkpoint = jsonb_set(
+                        COALESCE(checkpoint, '{}'::jsonb), %s,
+                        COALESCE(checkpoint -> %s, '{}'::jsonb) || %s::jsonb
+                    ),
+                    updated_at = NOW()
+                WHERE id = %s
+            """, ([key], key, json.dumps(values), self.id))
+            conn.commit()
+            cur.close()
+
+
+def _mark_document_failed(cur, document_id: int):
+    """Загрузка не удалась окончательно: документ больше не «processing» в get-documents"""
+    cur.execute("""
+        UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_documents
+        SET status = 'error'
+        WHERE id = %s AND status = 'processing'
+    """, (document_id,))
+
+
+def _close_reindex_batch(cur, tenant_id: int, batch_id: str):
+    """Последняя задача пакета закрывает переиндексацию в tenant_settings"""
+    cur.execute("""
+        UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+        SET revectorization_status = 'completed',
+            revectorization_progress = (
+                SELECT COUNT(*) FROM t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+                WHERE tenant_id = %s AND kind = 'reindex' AND batch_id = %s AND status = 'done'
+            )
+        WHERE tenant_id = %s AND NOT EXISTS (
+            SELECT 1 FROM t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+            WHERE tenant_id = %s AND kind = 'reindex' AND batch_id = %s
+              AND status IN ('pending', 'processing')
+        )
+    """, (tenant_id, batch_id, tenant_id, tenant_id, batch_id))
+
+
+def _requeue_stale(cur):
+    cur.execute(f"""
+        UPDATE t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+        SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+            finished_at = CASE WHEN attempts >= %s THEN NOW() END,
+            last_error = 'lock timeout', updated_at = NOW()
+        WHERE status = 'processing'
+          AND locked_at < NOW() - INTERVAL '{INGEST_JOB_LOCK_TIMEOUT_SEC} seconds'
+        RETURNING status, kind, tenant_id, document_id, batch_id
+    """, (INGEST_JOB_MAX_ATTEMPTS, INGEST_JOB_MAX_ATTEMPTS))
+    # Упавшие по таймауту блокировки без попыток в запасе закрываем так же, как _finish
+    for status, kind, tenant_id, document_id, batch_id in cur.fetchall():
+        if status != 'failed':
+            continue
+        print(f"❌ [ingestion] doc={document_id}: lock timeout, no attempts left")
+        if kind == 'upload':
+            _mark_document_failed(cur, document_id)
+        elif kind == 'reindex' and batch_id:
+            _close_reindex_batch(cur, tenant_id, batch_id)
+    cur.execute("""
+        UPDATE t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+        SET checkpoint = NULL
+        WHERE status IN ('done', 'failed', 'cancelled') AND checkpoint IS NOT NULL
+          AND finished_at < NOW() - INTERVAL '1 day'
+    """)
+    cur.execute(f"""
+        DELETE FROM t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+        WHERE status IN ('done', 'failed', 'cancelled')
+          AND finished_at < NOW() - INTERVAL '{INGEST_JOB_RETENTION_DAYS} days'
+    """)
+
+
+def _claim(cur) -> Optional[dict]:
+    """Самая старая готовая задача тенанта со свободным слотом. SKIP LOCKED не даёт двум воркерам взять одну"""
+    cur.execute("""
+        WITH candidate AS (
+            SELECT j.id
+            FROM t_p56134400_telegram_ai_bot_pdf.ingestion_jobs j
+            WHERE j.status = 'pending'
+              AND j.run_after <= NOW()
+              AND (
+                  SELECT COUNT(*) FROM t_p56134400_telegram_ai_bot_pdf.ingestion_jobs r
+                  WHERE r.tenant_id = j.tenant_id AND r.status = 'processing'
+              ) < %s
+            ORDER BY j.id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE t_p56134400_telegram_ai_bot_pdf.ingestion_jobs j
+        SET status = 'processing', locked_at = NOW(), locked_by = %s, attempts = j.attempts + 1,
+            started_at = COALESCE(j.started_at, NOW()), updated_at = NOW()
+        FROM candidate
+        WHERE j.id = candidate.id
+        RETURNING j.id, j.tenant_id, j.document_id, j.kind, j.batch_id, j.checkpoint, j.metrics, j.attempts
+    """, (INGEST_TENANT_CONCURRENCY, _worker_id))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return {
+        'id': row[0], 'tenant_id': row[1], 'document_id': row[2], 'kind': row[3], 'batch_id': row[4],
+        'checkpoint': row[5], 'metrics': row[6], 'attempts': row[7]
+    }
+
+
+def _finish(ctx: JobContext, outcome: str, error: Optional[str] = None):
+    """outcome: done | yield | retry | failed | cancelled"""
+    ctx._close_stage()
+    metrics = json.dumps(ctx.metrics)
+    with connection() as conn:
+        cur = conn.cursor()
+        if outcome == 'done':
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+                SET status = 'done', stage = 'done', metrics = %s::jsonb, checkpoint = NULL,
+                    last_error = NULL, finished_at = NOW(), updated_at = NOW()
+                WHERE id = %s
+            """, (metrics, ctx.id))
+        elif outcome == 'yield':
+            # Не ошибка: попытку не засчитываем, продолжим с checkpoint в следующем вызове
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+                SET status = 'pending', attempts = attempts - 1, run_after = NOW(),
+                    metrics = %s::jsonb, updated_at = NOW()
+                WHERE id = %s
+            """, (metrics, ctx.id))
+        elif outcome == 'retry' and ctx.job['attempts'] < INGEST_JOB_MAX_ATTEMPTS:
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+                SET status = 'pending', run_after = NOW() + (INTERVAL '10 seconds' * POWER(2, attempts - 1)),
+                    metrics = %s::jsonb, last_error = %s, updated_at = NOW()
+                WHERE id = %s
+            """, (metrics, (error or '')[:1000], ctx.id))
+        else:
+            status = 'cancelled' if outcome == 'cancelled' else 'failed'
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+                SET status = %s, metrics = %s::jsonb, last_error = %s, finished_at = NOW(), updated_at = NOW()
+                WHERE id = %s
+            """, (status, metrics, (error or '')[:1000] or None, ctx.id))
+            if status == 'failed' and ctx.job['kind'] == 'upload':
+                _mark_document_failed(cur, ctx.document_id)
+
+        if ctx.job['kind'] == 'reindex' and ctx.job['batch_id']:
+            _close_reindex_batch(cur, ctx.tenant_id, ctx.job['batch_id'])
+        conn.commit()
+        cur.close()
+
+
+def drain(run_job, budget_sec: float = INGEST_DRAIN_BUDGET_SEC) -> dict:
+    """
+    Разбирает очередь пулом из INGEST_WORKERS потоков, пока есть задачи и время.
+    run_job(ctx) проходит стадии; JobYield — продолжить позже, IngestionError — failed без повторов,
+    DocumentGone — cancelled, любое другое исключение — повтор с паузой.
+    """
+    deadline = time.monotonic() + budget_sec
+    stats = {'done': 0, 'failed': 0, 'yielded': 0, 'cancelled': 0}
+    stats_lock = threading.Lock()
+
+    with connection() as conn:
+        cur = conn.cursor()
+        _requeue_stale(cur)
+        conn.commit()
+        cur.close()
+
+    def worker():
+        while time.monotonic() < deadline - INGEST_JOB_RESERVE_SEC:
+            with connection() as conn:
+                cur = conn.cursor()
+                job = _claim(cur)
+                conn.commit()
+                cur.close()
+            if job is None:
+                return
+
+            ctx = JobContext(job, deadline)
+            try:
+                run_job(ctx)
+                outcome, error = 'done', None
+            except JobYield as e:
+                print(f"⏸️ [ingestion] job={job['id']} yielded at {e}, will resume from checkpoint")
+                outcome, error = 'yield', None
+            except DocumentGone as e:
+                outcome, error = 'cancelled', str(e)
+            except IngestionError as e:
+                print(f"❌ [ingestion] job={job['id']} rejected: {e}")
+                outcome, error = 'failed', str(e)
+            except Exception as e:
+                print(f"❌ [ingestion] job={job['id']} failed (attempt {job['attempts']}): {e}")
+                outcome, error = 'retry', str(e) or type(e).__name__
+            _finish(ctx, outcome, error)
+
+            key = {'done': 'done', 'yield': 'yielded', 'cancelled': 'cancelled'}.get(outcome, 'failed')
+            with stats_lock:
+                stats[key] += 1
+
+    with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as pool:
+        for future in [pool.submit(worker) for _ in range(INGEST_WORKERS)]:
+            future.result()
+
+    # Незаконченные задачи продолжит следующий вызов, не дожидаясь таймера
+    if stats['yielded']:
+        kick_ingestion()
+
+    print(f"[ingestion] processed {stats['done']}, yielded {stats['yielded']}, "
+          f"failed {stats['failed']}, cancelled {stats['cancelled']}")
+    return stats
@@ -0,0 +1,335 @@
+"""
+Извлечение текста PDF по страницам.
+Бэкенды (EXTRACTORS): pymupdf (быстрый, на C), pdfminer (чистый Python, аккуратнее с раскладкой)
+и PyPDF2 (прежний, есть всегда). select_extractor пробует доступные бэкенды на нескольких
+страницах документа и выбирает самый быстрый, не теряющий текст; для документов с таблицами —
+бэкенд, который сохраняет строки таблиц (ячейки одной строки через COLUMN_SEPARATOR).
+Диапазоны страниц разбираются параллельно в пуле процессов (разбор PDF упирается в CPU и GIL),
+а текст отдаётся генератором постранично в исходном порядке — чанкер начинает работу,
+не дожидаясь конца документа, и весь текст документа одной строкой не собирается.
+Небольшие документы и окружения без multiprocessing разбираются в текущем процессе.
+"""
+import os
+import re
+import time
+import tempfile
+import threading
+import multiprocessing
+from io import BytesIO, StringIO
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import PyPDF2
+
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+try:
+    from pdfminer.converter import PDFPageAggregator, TextConverter
+    from pdfminer.layout import LAParams, LTTextBox, LTTextLine
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+except ImportError:
+    PDFPage = None
+
+PDF_EXTRACT_WORKERS = int(os.environ.get('PDF_EXTRACT_WORKERS', str(os.cpu_count() or 1)))
+# Меньше этого страниц — без пула: запуск процессов дороже разбора
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', '16'))
+# Каждая задача заново разбирает структуру PDF, поэтому диапазон не меньше этого и примерно
+# два диапазона на процесс
+PDF_MIN_PAGES_PER_TASK = int(os.environ.get('PDF_MIN_PAGES_PER_TASK', '8'))
+
+# auto | pymupdf | pdfminer | pypdf2; тенант может переопределить в chunking_settings.extractor
+PDF_EXTRACTOR = os.environ.get('PDF_EXTRACTOR', 'auto')
+PDF_PROBE_PAGES = int(os.environ.get('PDF_PROBE_PAGES', '3'))
+# Бэкенд годится, если извлёк не меньше этой доли символов лучшего бэкенда на пробе
+PDF_EXTRACTOR_MIN_QUALITY = float(os.environ.get('PDF_EXTRACTOR_MIN_QUALITY', '0.9'))
+# Доля строк-таблиц на пробе, с которой документ считается табличным
+PDF_TABLE_MIN_SCORE = float(os.environ.get('PDF_TABLE_MIN_SCORE', '0.2'))
+# Символов на страницу, ниже — скан без текстового слоя, качество бэкенда не важно
+PDF_MIN_TEXT_DENSITY = int(os.environ.get('PDF_MIN_TEXT_DENSITY', '100'))
+
+COLUMN_SEPARATOR = '  '
+
+# Ячейка таблицы: дата, сумма, число с единицей
+_NUMERIC_CELL_RE = re.compile(r'\d{1,2}[./]\d{1,2}(?:[./]\d{2,4})?|\d[\d\s]*(?:[.,]\d+)?\s?(?:₽|руб|RUB|EUR|€|\$|USD)|\b\d+\b')
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _layout_text(items: List[tuple]) -> str:
+    """Фрагменты (x0, top, x1, bottom, text) в координатах сверху вниз → строки страницы.
+    Фрагменты на одной высоте собираются в одну строку, широкий зазор между ними — граница колонки"""
+    rows: List[list] = []
+    for item in sorted(items, key=lambda it: ((it[1] + it[3]) / 2, it[0])):
+        middle, height = (item[1] + item[3]) / 2, item[3] - item[1]
+        if rows and abs(middle - rows[-1][0]) <= height / 2:
+            rows[-1][2].append(item)
+        else:
+            rows.append([middle, height, [item]])
+
+    lines = []
+    prev_bottom = None
+    for _, height, row in rows:
+        row.sort(key=lambda it: it[0])
+        top = min(it[1] for it in row)
+        if prev_bottom is not None and top - prev_bottom > height / 2:
+            lines.append('')  # вертикальный отступ — граница абзаца для чанкера
+        prev_bottom = max(it[3] for it in row)
+
+        parts = [row[0][4]]
+        for prev, item in zip(row, row[1:]):
+            parts.append(COLUMN_SEPARATOR if item[0] - prev[2] > (item[3] - item[1]) * 0.8 else ' ')
+            parts.append(item[4])
+        lines.append(''.join(parts))
+    return '\n'.join(lines)
+
+
+class PyPDF2Extractor:
+    name = 'pypdf2'
+    layout = False
+
+    def count_pages(self, pdf_data: bytes) -> int:
+        return len(PyPDF2.PdfReader(BytesIO(pdf_data)).pages)
+
+    def iter_pages(self, pdf_data: bytes, page_indexes: Sequence[int], layout: bool = False) -> Iterator[str]:
+        reader = PyPDF2.PdfReader(BytesIO(pdf_data))
+        for idx in page_indexes:
+            yield reader.pages[idx].extract_text() or ''
+
+
+class PyMuPDFExtractor:
+    name = 'pymupdf'
+    layout = True
+
+    def count_pages(self, pdf_data: bytes) -> int:
+        with pymupdf.open(stream=pdf_data, filetype='pdf') as doc:
+            return doc.page_count
+
+    def iter_pages(self, pdf_data: bytes, page_indexes: Sequence[int], layout: bool = False) -> Iterator[str]:
+        with pymupdf.open(stream=pdf_data, filetype='pdf') as doc:
+            for idx in page_indexes:
+                page = doc[idx]
+                if layout:
+                    yield _layout_text([word[:5] for word in page.get_text('words')])
+                else:
+                    yield page.get_text('text', sort=True)
+
+
+class PdfMinerExtractor:
+    name = 'pdfminer'
+    layout = True
+
+    def count_pages(self, pdf_data: bytes) -> int:
+        return sum(1 for _ in PDFPage.get_pages(BytesIO(pdf_data)))
+
+    def iter_pages(self, pdf_data: bytes, page_indexes: Sequence[int], layout: bool = False) -> Iterator[str]:
+        resources = PDFResourceManager()
+        if layout:
+            device = PDFPageAggregator(resources, laparams=LAParams())
+        else:
+            output = StringIO()
+            device = TextConverter(resources, output, laparams=LAParams())
+        interpreter = PDFPageInterpreter(resources, device)
+
+        # get_pages отдаёт страницы по возрастанию номера — page_indexes здесь всегда отсортированы
+        for page in PDFPage.get_pages(BytesIO(pdf_data), pagenos=set(page_indexes)):
+            if layout:
+                interpreter.process_page(page)
+                result = device.get_result()
+                yield _layout_text([
+                    (line.x0, result.height - line.y1, line.x1, result.height - line.y0, line.get_text().strip())
+                    for box in result if isinstance(box, LTTextBox)
+                    for line in box if isinstance(line, LTTextLine) and line.get_text().strip()
+                ])
+            else:
+                output.seek(0)
+                output.truncate()
+                interpreter.process_page(page)
+                yield output.getvalue().rstrip('\f')
+
+
+# В порядке предпочтения при равных условиях; недоступные библиотеки просто не регистрируются
+EXTRACTORS: Dict[str, object] = {'pypdf2': PyPDF2Extractor()}
+if pymupdf is not None:
+    EXTRACTORS = {'pymupdf': PyMuPDFExtractor(), **EXTRACTORS}
+if PDFPage is not None:
+    EXTRACTORS['pdfminer'] = PdfMinerExtractor()
+DEFAULT_EXTRACTOR = next(iter(EXTRACTORS))
+
+
+def resolve_extractor(name: Optional[str]) -> str:
+    """Бэкенд из настроек тенанта/окружения: имя доступного бэкенда или 'auto'"""
+    for candidate in (name, PDF_EXTRACTOR):
+        if candidate in EXTRACTORS or candidate == 'auto':
+            return candidate
+        if candidate:
+            print(f"⚠️ PDF extractor '{candidate}' unavailable, using auto")
+    return 'auto'
+
+
+def _text_chars(texts: List[str]) -> int:
+    """Непробельные символы: разделители колонок не должны влиять на сравнение бэкендов"""
+    return sum(len(''.join(text.split())) for text in texts)
+
+
+def table_score(texts: List[str]) -> float:
+    """Доля непустых строк, похожих на строку таблицы: несколько числовых ячеек, разнесённых по колонкам"""
+    lines = [line.strip() for text in texts for line in text.split('\n') if line.strip()]
+    if not lines:
+        return 0.0
+    rows = sum(
+        1 for line in lines
+        if COLUMN_SEPARATOR in line and len(_NUMERIC_CELL_RE.findall(line)) >= 2
+    )
+    return rows / len(lines)
+
+
+def select_extractor(pdf_data: bytes, pages_count: int, preferred: str = 'auto') -> dict:
+    """Проба бэкендов на нескольких страницах, разнесённых по документу.
+    Возвращает выбор и замеры: {'backend', 'layout', 'reason', 'table_score', 'text_density', 'probe'}"""
+    probe_count = max(1, min(PDF_PROBE_PAGES, pages_count))
+    page_indexes = sorted({(pages_count * i) // probe_count for i in range(probe_count)})
+    candidates = [preferred] if preferred in EXTRACTORS else list(EXTRACTORS)
+
+    probe: Dict[str, dict] = {}
+    tables = 0.0
+    for name in candidates:
+        extractor = EXTRACTORS[name]
+        started = time.perf_counter()
+        try:
+            texts = list(extractor.iter_pages(pdf_data, page_indexes, layout=extractor.layout))
+        except Exception as e:
+            print(f"⚠️ PDF extractor {name} failed on probe: {e}")
+            continue
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        probe[name] = {
+            'pages_per_sec': round(len(page_indexes) / elapsed, 1),
+            'chars': _text_chars(texts)
+        }
+        if extractor.layout:
+            tables = max(tables, table_score(texts))
+
+    if not probe:
+        return {'backend': 'pypdf2', 'layout': False, 'reason': 'probe_failed',
+                'table_score': 0.0, 'text_density': 0, 'probe': {}}
+
+    best_chars = max(result['chars'] for result in probe.values())
+    density = best_chars // len(page_indexes)
+    good = [name for name, result in probe.items() if result['chars'] >= best_chars * PDF_EXTRACTOR_MIN_QUALITY]
+    is_table = tables >= PDF_TABLE_MIN_SCORE
+
+    if preferred in probe:
+        reason = 'forced'
+    elif density < PDF_MIN_TEXT_DENSITY:
+        reason, good = 'low_text_density', list(probe)
+    elif is_table and any(EXTRACTORS[name].layout for name in good):
+        reason, good = 'tables', [name for name in good if EXTRACTORS[name].layout]
+    else:
+        reason = 'fastest'
+    backend = max(good, key=lambda name: probe[name]['pages_per_sec'])
+
+    return {
+        'backend': backend,
+        'layout': is_table and EXTRACTORS[backend].layout,
+        'reason': reason,
+        'table_score': round(tables, 3),
+        'text_density': density,
+        'probe': probe
+    }
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    """Пул на модуль: процессы переживают тёплые вызовы и общие для параллельных задач индексации"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            try:
+                # Не fork: пул создаётся из потоков ingestion_worker.drain, а fork многопоточного процесса
+                # может унаследовать чужую захваченную блокировку. Процессы порождает однопоточный
+                # forkserver с заранее импортированным pdf_extract, без него — spawn
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    mp_context = multiprocessing.get_context('forkserver')
+                    mp_context.set_forkserver_preload([__name__])
+                else:
+                    mp_context = multiprocessing.get_context('spawn')
+                _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=mp_context)
+            except (OSError, ValueError, NotImplementedError) as e:
+                print(f"⚠️ PDF process pool unavailable, extracting in-process: {e}")
+                return None
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _extract_range(pdf_path: str, start: int, end: int, backend: str, layout: bool) -> List[str]:
+    """Текст страниц [start, end) — выполняется в дочернем процессе"""
+    with open(pdf_path, 'rb') as f:
+        pdf_data = f.read()
+    return list(EXTRACTORS[backend].iter_pages(pdf_data, range(start, end), layout=layout))
+
+
+def count_pages(pdf_data: bytes, backend: Optional[str] = None) -> int:
+    return EXTRACTORS[backend or DEFAULT_EXTRACTOR].count_pages(pdf_data)
+
+
+def iter_page_texts(pdf_data: bytes, pages_count: Optional[int] = None, workers: Optional[int] = None,
+                    backend: Optional[str] = None, layout: bool = False, first_page: int = 0) -> Iterator[str]:
+    """Текст каждой страницы по порядку, начиная с first_page (продолжение прерванного извлечения)"""
+    backend = backend or DEFAULT_EXTRACTOR
+    extractor = EXTRACTORS[backend]
+    if pages_count is None:
+        pages_count = extractor.count_pages(pdf_data)
+    workers = PDF_EXTRACT_WORKERS if workers is None else workers
+
+    pool = _get_pool() if workers > 1 and pages_count - first_page >= PDF_PARALLEL_MIN_PAGES else None
+    if pool is None:
+        yield from extractor.iter_pages(pdf_data, range(first_page, pages_count), layout=layout)
+        return
+
+    # Файл вместо байтов в каждой задаче: иначе PDF сериализуется в пул столько раз, сколько диапазонов
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+        f.write(pdf_data)
+        pdf_path = f.name
+
+    per_task = max(PDF_MIN_PAGES_PER_TASK, -(-(pages_count - first_page) // (workers * 2)))
+    ranges = [(start, min(start + per_task, pages_count)) for start in range(first_page, pages_count, per_task)]
+    futures = []
+    emitted = first_page
+    try:
+        try:
+            futures = [pool.submit(_extract_range, pdf_path, start, end, backend, layout) for start, end in ranges]
+        except (BrokenProcessPool, RuntimeError) as e:
+            print(f"⚠️ PDF process pool broken, extracting in-process: {e}")
+            _reset_pool()
+
+        for idx, (start, end) in enumerate(ranges):
+            texts = None
+            if futures:
+                try:
+                    texts = futures[idx].result()
+                except BrokenProcessPool as e:
+                    # Процесс пула убит (OOM) — остаток документа разбираем здесь
+                    print(f"⚠️ PDF process pool broken at page {start + 1}, continuing in-process: {e}")
+                    _reset_pool()
+                    futures = []
+            if texts is None:
+                texts = _extract_range(pdf_path, start, end, backend, layout)
+            for text in texts:
+                emitted += 1
+                yield text
+    finally:
+        if emitted < pages_count:
+            for future in futures:
+                future.cancel()
+        os.unlink(pdf_path)
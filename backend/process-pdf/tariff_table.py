@@ -0,0 +1,239 @@
+"""
+Строки тарифов из таблиц прайс-листа: категория номера, период, цена.
+Разбирает текст страниц после pdf_extract: ячейки строки таблицы разделены COLUMN_SEPARATOR
+(для бэкендов без раскладки строка режется по датам и суммам). Поддерживаются две раскладки:
+- строка = категория | период | цена [| условия];
+- шапка с периодами по колонкам, строки = категория | цена | цена ...
+Категорией строки без своей категории становится ближайший короткий заголовок над таблицей.
+Даты без года получают год документа (самый частый 20xx в тексте), иначе текущий.
+"""
+import re
+import calendar
+from collections import Counter
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TARIFF_MAX_ROWS = 5000
+# Сумма без валюты считается ценой только от этого значения (отсекает «2 гостя», «3 ночи»)
+TARIFF_MIN_BARE_PRICE = 100
+
+_MONTHS = {
+    'янв': 1, 'фев': 2, 'мар': 3, 'апр': 4, 'май': 5, 'мая': 5, 'июн': 6,
+    'июл': 7, 'авг': 8, 'сен': 9, 'окт': 10, 'ноя': 11, 'дек': 12
+}
+_MONTH_WORD = r'(?:январ|феврал|март|апрел|ма[йя]|июн|июл|август|сентябр|октябр|ноябр|декабр)[а-я]*'
+
+_DATE = rf'(?:\d{{1,2}}[./]\d{{1,2}}(?:[./]\d{{2,4}})?|\d{{1,2}}\s+{_MONTH_WORD}(?:\s+\d{{4}})?)'
+_DASH = r'\s*(?:-|–|—|по|до)\s*'
+_PERIOD_RE = re.compile(rf'(?:с\s+)?({_DATE}){_DASH}({_DATE})', re.IGNORECASE)
+# «июнь», «июль–август» — весь месяц
+_MONTH_PERIOD_RE = re.compile(rf'^({_MONTH_WORD})(?:{_DASH}({_MONTH_WORD}))?(?:\s+(\d{{4}}))?$', re.IGNORECASE)
+_NUMERIC_DATE_RE = re.compile(r'(\d{1,2})[./](\d{1,2})(?:[./](\d{2,4}))?')
+_WORD_DATE_RE = re.compile(rf'(\d{{1,2}})\s+({_MONTH_WORD})(?:\s+(\d{{4}}))?', re.IGNORECASE)
+_PRICE_RE = re.compile(
+    r'(?:от\s+)?(\d{1,3}(?:[\s ]\d{3})+|\d+)(?:[.,](\d{1,2}))?\s*(₽|руб\.?|р\.|rub|eur|€|\$|usd)?',
+    re.IGNORECASE
+)
+_CURRENCIES = {'₽': 'RUB', 'руб': 'RUB', 'руб.': 'RUB', 'р.': 'RUB', 'rub': 'RUB', 'eur': 'EUR', '€': 'EUR', '$': 'USD', 'usd': 'USD'}
+_CELL_SPLIT_RE = re.compile(r'\s{2,}|\t')
+_YEAR_RE = re.compile(r'\b(20\d{2})\b')
+# Подписи колонок, которые не несут условий тарифа: «Период  Цена», «Даты  Стоимость, руб.»
+_GENERIC_LABEL_RE = re.compile(
+    r'^(?:цен[аы]?|стоимость|тариф[ы]?|период[ы]?|даты?|категори[яи]|номер[а]?|тип номера|'
+    r'price|cost|rate|period|dates?|room(?: type)?)(?:[\s,(]+(?:₽|руб\.?|р\.|rub|eur|€|\$|usd|за сутки|за ночь)\)?)*$',
+    re.IGNORECASE
+)
+
+
+def _month_number(word: str) -> Optional[int]:
+    return _MONTHS.get(word.lower()[:3])
+
+
+def _parse_date(text: str, year: int) -> Optional[Tuple[date, bool]]:
+    """Дата и признак «год указан явно»"""
+    match = _NUMERIC_DATE_RE.fullmatch(text.strip())
+    if match:
+        day, month, year_text = int(match.group(1)), int(match.group(2)), match.group(3)
+    else:
+        match = _WORD_DATE_RE.fullmatch(text.strip())
+        if not match:
+            return None
+        day, month, year_text = int(match.group(1)), _month_number(match.group(2)), match.group(3)
+    if year_text:
+        year = int(year_text) + (2000 if len(year_text) == 2 else 0)
+    try:
+        if month == 2 and day == 29:
+            day = calendar.monthrange(year, 2)[1]  # 29.02 в невисокосном году — 28.02, как в _with_year
+        return date(year, month, day), bool(year_text)
+    except (TypeError, ValueError):
+        return None
+
+
+def _with_year(value: date, year: int) -> date:
+    """Та же дата в другом году; 29 февраля в невисокосном году — 28 февраля"""
+    return value.replace(year=year, day=min(value.day, calendar.monthrange(year, value.month)[1]))
+
+
+def parse_period(cell: str, year: int) -> Optional[Tuple[date, date]]:
+    """Период из ячейки: «01.06–30.06.2026», «с 1 июня по 31 августа», «июль–август»"""
+    match = _PERIOD_RE.search(cell)
+    if match:
+        start, end = _parse_date(match.group(1), year), _parse_date(match.group(2), year)
+        if not start or not end:
+            return None
+        (date_from, start_explicit), (date_to, end_explicit) = start, end
+        # «01.06 – 30.06.2027»: год начала берём у конца
+        if end_explicit and not start_explicit:
+            date_from = _with_year(date_from, date_to.year)
+        if date_to < date_from:
+            if end_explicit and not start_explicit:
+                date_from = _with_year(date_from, date_to.year - 1)
+            elif not end_explicit:
+                date_to = _with_year(date_to, date_to.year + 1)  # 20.12 – 10.01: через Новый год
+            else:
+                return None
+        return date_from, date_to
+
+    match = _MONTH_PERIOD_RE.match(cell.strip())
+    if match:
+        first, last = _month_number(match.group(1)), _month_number(match.group(2) or match.group(1))
+        year = int(match.group(3)) if match.group(3) else year
+        end_year = year + 1 if last < first else year
+        return date(year, first, 1), date(end_year, last, calendar.monthrange(end_year, last)[1])
+    return None
+
+
+def parse_price(cell: str) -> Optional[Tuple[float, Optional[str]]]:
+    """Цена, если ячейка целиком сумма: «5 000 ₽», «94 EUR», «от 4500»"""
+    match = _PRICE_RE.fullmatch(cell.strip())
+    if not match:
+        return None
+    value = float(re.sub(r'\s', '', match.group(1)) + (f".{match.group(2)}" if match.group(2) else ''))
+    currency = _CURRENCIES.get((match.group(3) or '').lower())
+    if currency is None and value < TARIFF_MIN_BARE_PRICE:
+        return None
+    return value, currency
+
+
+def _split_cells(line: str) -> List[str]:
+    """Ячейки строки; без разделителя колонок строка режется по периодам и суммам с валютой"""
+    if _CELL_SPLIT_RE.search(line):
+        return [cell.strip() for cell in _CELL_SPLIT_RE.split(line) if cell.strip()]
+
+    spans = [m.span() for m in _PERIOD_RE.finditer(line)]
+    for m in _PRICE_RE.finditer(line):
+        if m.group(3) and not any(s <= m.start() < e for s, e in spans):
+            spans.append(m.span())
+    cells, pos = [], 0
+    for start, end in sorted(spans):
+        cells.append(line[pos:start])
+        cells.append(line[start:end])
+        pos = end
+    cells.append(line[pos:])
+    return [cell.strip(' :;|') for cell in cells if cell.strip(' :;|')]
+
+
+def _is_heading(line: str) -> bool:
+    """Короткая строка без цифр — заголовок над таблицей, обычно категория номера"""
+    return 2 < len(line) <= 60 and not any(c.isdigit() for c in line) and any(c.isalpha() for c in line)
+
+
+def _is_numeric_only(text: str) -> bool:
+    return not any(c.isalpha() for c in re.sub(r'(?i)guests?|гост[а-я]*|чел\.?|взр\.?', '', text))
+
+
+def document_year(page_texts: Iterable[str], default: Optional[int] = None) -> int:
+    years = Counter(int(y) for text in page_texts for y in _YEAR_RE.findall(text or ''))
+    return years.most_common(1)[0][0] if years else (default or date.today().year)
+
+
+def extract_tariff_rows(page_texts: List[str], year: Optional[int] = None) -> List[Dict]:
+    """
+    Строки тарифов документа: [{'room_category', 'date_from', 'date_to', 'price', 'currency',
+    'conditions', 'page', 'source_text'}], даты в ISO. Строки без периода не сохраняются:
+    такая цена без контекста только запутает ответ.
+    """
+    year = year or document_year(page_texts)
+    rows: List[Dict] = []
+    seen = set()
+
+    for page_no, page_text in enumerate(page_texts, start=1):
+        header: List[Optional[Tuple[date, date]]] = []
+        header_labels: List[str] = []
+        current_category = None
+        current_period = None
+
+        for line in (page_text or '').split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            cells = _split_cells(line)
+            periods = [parse_period(cell, year) for cell in cells]
+            prices = [parse_price(cell) if not periods[i] else None for i, cell in enumerate(cells)]
+            texts = [cell for i, cell in enumerate(cells)
+                     if not periods[i] and not prices[i] and any(c.isalpha() for c in cell)]
+
+            if not any(prices):
+                found = [period for period in periods if period]
+                if len(found) == 1:
+                    current_period = found[0]  # «Период: 01.06–31.08» над таблицей
+                if found and len(cells) > 1:
+                    header, header_labels = periods, cells  # шапка: периоды по колонкам
+                elif len(cells) == 1 and _is_heading(line):
+                    # Новая таблица под своим заголовком: шапка и период предыдущей не действуют
+                    current_category, current_period = line.rstrip(':'), None
+                    header, header_labels = [], []
+                elif not found and len(cells) > 1:
+                    header, header_labels = [None] * len(cells), cells  # шапка с подписями колонок
+                continue
+
+            # Категория — первая ячейка строки; строка из периода и цены относится к заголовку над ней
+            category = cells[0] if cells[0] in texts and not _is_numeric_only(cells[0]) else current_category
+            if not category:
+                continue
+            row_period = next((p for p in periods if p), None)
+            extra = [text for text in texts if text != category]
+
+            for idx, price in enumerate(prices):
+                if not price:
+                    continue
+                period = row_period
+                label = None
+                # Колонка шапки: при равном числе ячеек — по индексу
+                if len(header) == len(cells):
+                    period = period or header[idx]
+                    label = header_labels[idx] if not header[idx] else None
+                    if label and _GENERIC_LABEL_RE.match(label):
+                        label = None
+                period = period or current_period
+                if not period:
+                    continue
+
+                conditions = '; '.join(filter(None, [label] + extra)) or None
+                key = (category, period, price, conditions)
+                if key in seen:
+                    continue
+                seen.add(key)
+                rows.append({
+                    'room_category': category[:200],
+                    'date_from': period[0].isoformat(),
+                    'date_to': period[1].isoformat(),
+                    'price': price[0],
+                    'currency': price[1],
+                    'conditions': conditions[:500] if conditions else None,
+                    'page': page_no,
+                    'source_text': line[:500]
+                })
+                if len(rows) >= TARIFF_MAX_ROWS:
+                    return _fill_currency(rows)
+    return _fill_currency(rows)
+
+
+def _fill_currency(rows: List[Dict]) -> List[Dict]:
+    """Суммы без валюты («9 000» в колонке) получают основную валюту документа"""
+    currencies = Counter(row['currency'] for row in rows if row['currency'])
+    if currencies:
+        main_currency = currencies.most_common(1)[0][0]
+        for row in rows:
+            row['currency'] = row['currency'] or main_currency
+    return rows
@@ -0,0 +1,114 @@
+"""
+Буферизованная запись token_usage.
+log_token_usage только кладёт запись в память; буфер сбрасывается одним multi-row INSERT
+при TOKEN_LOG_BATCH_SIZE записях или через TOKEN_LOG_FLUSH_SEC (в фоновом потоке)
+и обязательно в конце handler (декоратор flushes_token_usage) и при выходе процесса.
+Если БД недоступна, записи дописываются в spill-файл и уходят со следующим сбросом.
+"""
+import os
+import json
+import time
+import atexit
+import functools
+import threading
+from typing import List
+
+from psycopg2.extras import execute_values
+
+from db_pool import connection
+
+TOKEN_LOG_BATCH_SIZE = int(os.environ.get('TOKEN_LOG_BATCH_SIZE', '50'))
+TOKEN_LOG_FLUSH_SEC = float(os.environ.get('TOKEN_LOG_FLUSH_SEC', '5'))
+TOKEN_LOG_SPILL_PATH = os.environ.get('TOKEN_LOG_SPILL_PATH', '/tmp/token_usage_spill.jsonl')
+
+# (tenant_id, operation_type, model, tokens_used, cost_rubles, request_id, metadata_json)
+_buffer: List[list] = []
+_oldest_at = None
+_buffer_lock = threading.Lock()
+_flush_lock = threading.Lock()
+
+
+def enqueue(record: list):
+    """Добавляет запись в буфер; при достижении порогов запускает фоновый сброс"""
+    global _oldest_at
+    with _buffer_lock:
+        _buffer.append(record)
+        if _oldest_at is None:
+            _oldest_at = time.monotonic()
+        due = len(_buffer) >= TOKEN_LOG_BATCH_SIZE or time.monotonic() - _oldest_at >= TOKEN_LOG_FLUSH_SEC
+
+    if due:
+        threading.Thread(target=flush, daemon=True).start()
+
+
+def _drain() -> List[list]:
+    global _oldest_at
+    with _buffer_lock:
+        records = list(_buffer)
+        _buffer.clear()
+        _oldest_at = None
+    return records
+
+
+def _read_spill() -> List[list]:
+    if not os.path.exists(TOKEN_LOG_SPILL_PATH):
+        return []
+    records = []
+    try:
+        with open(TOKEN_LOG_SPILL_PATH, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        os.remove(TOKEN_LOG_SPILL_PATH)
+    except OSError as e:
+        print(f"⚠️ [token_usage] Cannot read spill file: {e}")
+    return records
+
+
+def _spill(records: List[list]):
+    try:
+        with open(TOKEN_LOG_SPILL_PATH, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        print(f"💾 [token_usage] Spilled {len(records)} records to {TOKEN_LOG_SPILL_PATH}")
+    except OSError as e:
+        print(f"❌ [token_usage] Lost {len(records)} records, spill failed: {e}")
+
+
+def flush() -> int:
+    """Синхронно пишет буфер (и ранее сброшенный spill) в token_usage. Возвращает число записей"""
+    with _flush_lock:
+        records = _read_spill() + _drain()
+        if not records:
+            return 0
+        try:
+            with connection() as conn:
+                cur = conn.cursor()
+                execute_values(cur, """
+                    INSERT INTO t_p56134400_telegram_ai_bot_pdf.token_usage
+                    (tenant_id, operation_type, model, tokens_used, cost_rubles, request_id, metadata)
+                    VALUES %s
+                """, [tuple(record) for record in records], page_size=TOKEN_LOG_BATCH_SIZE)
+                conn.commit()
+                cur.close()
+            return len(records)
+        except Exception as e:
+            print(f"Error logging token usage: {e}")
+            _spill(records)
+            return 0
+
+
+def flushes_token_usage(handler):
+    """Декоратор handler: сбрасывает буфер token_usage в finally, даже при исключении"""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        try:
+            return handler(event, context)
+        finally:
+            flush()
+    return wrapper
+
+
+atexit.register(flush)
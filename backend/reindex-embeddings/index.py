@@ -1,10 +1,12 @@
 import json
 import os
+import uuid
 import psycopg2
 import sys
 sys.path.append('/function/code')
 from api_keys_helper import get_tenant_api_key
 from auth_middleware import get_tenant_id_from_request
+from ingestion_jobs import enqueue_job, kick_ingestion
 
 def handler(event: dict, context) -> dict:
     """Переиндексация эмбеддингов после смены модели"""
@@ -61,6 +63,35 @@ def handler(event: dict, context) -> dict:
                 'error': row[4] or ''
             }
 
+            # Живое состояние последнего пакета переиндексации из очереди индексации
+            cur.execute("""
+                SELECT
+                    COUNT(*),
+                    COUNT(*) FILTER (WHERE status = 'done'),
+                    COUNT(*) FILTER (WHERE status IN ('failed', 'cancelled')),
+                    COUNT(*) FILTER (WHERE status IN ('pending', 'processing')),
+                    COALESCE(SUM(stage_done) FILTER (WHERE status = 'processing' AND stage = 'embed'), 0),
+                    COALESCE(SUM(stage_total) FILTER (WHERE status = 'processing' AND stage = 'embed'), 0),
+                    MAX(last_error) FILTER (WHERE status = 'failed')
+                FROM t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+                WHERE tenant_id = %s AND kind = 'reindex' AND batch_id = (
+                    SELECT batch_id FROM t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+                    WHERE tenant_id = %s AND kind = 'reindex'
+                    ORDER BY id DESC LIMIT 1
+                )
+            """, (tenant_id, tenant_id))
+            jobs_row = cur.fetchone()
+            if jobs_row and jobs_row[0]:
+                result.update({
+                    'status': 'in_progress' if jobs_row[3] else 'completed',
+                    'progress': jobs_row[1],
+                    'total': jobs_row[0],
+                    'failed': jobs_row[2],
+                    'chunksDone': jobs_row[4],
+                    'chunksTotal': jobs_row[5],
+                    'error': jobs_row[6] or result['error']
+                })
+
             cur.close()
             conn.close()
 
@@ -112,17 +143,7 @@ def handler(event: dict, context) -> dict:
                         'isBase64Encoded': False
                     }
 
-                cur.execute("""
-                    UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
-                    SET 
-                        revectorization_status = 'in_progress',
-                        revectorization_progress = 0,
-                        revectorization_total = %s,
-                        revectorization_model = %s,
-                        revectorization_error = NULL
-                    WHERE tenant_id = %s
-                """, (total_docs, f"{embedding_provider}:{embedding_doc_model}", tenant_id))
-
+                batch_id = uuid.uuid4().hex
                 cur.execute("""
                     SELECT id FROM t_p56134400_telegram_ai_bot_pdf.tenant_documents
                     WHERE tenant_id = %s AND status = 'ready'
@@ -130,63 +151,46 @@ def handler(event: dict, context) -> dict:
                 """, (tenant_id,))
                 document_ids = [row[0] for row in cur.fetchall()]
 
-                conn.commit()
-                cur.close()
-                conn.close()
-
-                import requests
-                process_pdf_url = 'https://functions.poehali.dev/44b9c312-5377-4fa7-8b4c-522f4bbbf201'
-                
-                success_count = 0
+                # Документы индексирует process-pdf в фоне, параллельно по документам;
+                # process-pdf досчитывает только новые/изменённые чанки, остальные берёт по content_hash
                 for doc_id in document_ids:
-                    try:
-                        response = requests.post(
-                            process_pdf_url,
-                            headers={
-                                'X-Authorization': event.get('headers', {}).get('X-Authorization', ''),
-                                'Content-Type': 'application/json'
-                            },
-                            json={'documentId': doc_id},
-                            timeout=300
-                        )
-                        
-                        if response.ok:
-                            success_count += 1
-                        
-                        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-                        cur = conn.cursor()
-                        cur.execute("""
-                            UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
-                            SET revectorization_progress = %s
-                            WHERE tenant_id = %s
-                        """, (success_count, tenant_id))
-                        conn.commit()
-                        cur.close()
-                        conn.close()
-                        
-                    except Exception as e:
-                        print(f"Error reindexing document {doc_id}: {e}")
-                        continue
-
-                conn = psycopg2.connect(os.environ['DATABASE_URL'])
-                cur = conn.cursor()
+                    enqueue_job(cur, tenant_id, doc_id, 'reindex', batch_id)
+
+                # Документ с активной задачей (например, ещё идёт upload) в пакет не попадает:
+                # считаем только созданные задачи, иначе пакет никогда не завершится
+                cur.execute("""
+                    SELECT COUNT(*) FROM t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+                    WHERE tenant_id = %s AND kind = 'reindex' AND batch_id = %s
+                """, (tenant_id, batch_id))
+                queued = cur.fetchone()[0]
+
                 cur.execute("""
                     UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
                     SET 
-                        revectorization_status = 'completed',
-                        revectorization_progress = %s
+                        revectorization_status = %s,
+                        revectorization_progress = 0,
+                        revectorization_total = %s,
+                        revectorization_model = %s,
+                        revectorization_error = NULL
                     WHERE tenant_id = %s
-                """, (success_count, tenant_id))
+                """, ('in_progress' if queued else 'completed', queued,
+                      f"{embedding_provider}:{embedding_doc_model}", tenant_id))
+
                 conn.commit()
                 cur.close()
                 conn.close()
 
+                if queued:
+                    kick_ingestion()
+                print(f"📥 Reindex batch {batch_id}: queued {queued}/{total_docs} documents for tenant={tenant_id}")
+
                 return {
-                    'statusCode': 200,
+                    'statusCode': 202,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'body': json.dumps({
                         'success': True,
-                        'reindexed': success_count,
+                        'batchId': batch_id,
+                        'queued': queued,
                         'total': total_docs
                     }),
                     'isBase64Encoded': False
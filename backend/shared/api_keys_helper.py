@@ -0,0 +1,140 @@
+"""Утилита для работы с API ключами клиентов"""
+import os
+import json
+from db_pool import connection
+
+def get_tenant_api_key(tenant_id: int, provider: str, key_name: str) -> tuple[str | None, dict | None]:
+    """
+    Получить API ключ клиента из tenant_api_keys или секретов проекта.
+    
+    Args:
+        tenant_id: ID клиента
+        provider: Провайдер (yandexgpt, openai, deepseek, telegram, proxyapi, max, vk)
+        key_name: Название ключа (api_key, folder_id, bot_token, access_token, group_token, secret_key)
+    
+    Returns:
+        (key_value, error_response) - либо значение ключа, либо HTTP ошибка
+    """
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+        
+            print(f"🔑 DEBUG get_tenant_api_key: tenant_id={tenant_id}, provider={provider}, key_name={key_name}")
+        
+            cur.execute("""
+                SELECT key_value
+                FROM t_p56134400_telegram_ai_bot_pdf.tenant_api_keys
+                WHERE tenant_id = %s 
+                  AND provider = %s 
+                  AND key_name = %s 
+                  AND is_active = true
+            """, (tenant_id, provider, key_name))
+        
+            row = cur.fetchone()
+        
+            if row:
+                print(f"🔑 DEBUG: Found key starting with {row[0][:10]}...")
+            else:
+                print(f"❌ DEBUG: No key found for tenant_id={tenant_id}, provider={provider}, key_name={key_name}")
+        
+            cur.close()
+        
+        return resolve_api_key(row[0] if row else None, provider, key_name)
+        
+    except Exception as e:
+        return None, {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'Ошибка чтения API ключей: {str(e)}'}),
+            'isBase64Encoded': False
+        }
+
+
+def resolve_api_key(key_value: str | None, provider: str, key_name: str) -> tuple[str | None, dict | None]:
+    """Значение ключа из tenant_api_keys (или None) → (ключ, ошибка) с fallback на секреты проекта"""
+    if not key_value:
+        # Fallback на секреты проекта для ProxyAPI
+        if provider == 'proxyapi' and key_name == 'api_key':
+            project_key = os.environ.get('PROXYAPI_API_KEY')
+            if project_key:
+                return project_key, None
+        
+        error_msg = f"API ключ не настроен: {provider}.{key_name}. Добавьте ключи в админ-панели."
+        return None, {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': error_msg}),
+            'isBase64Encoded': False
+        }
+    
+    # Если в БД placeholder — используем секрет проекта
+    if key_value == 'sk-proxy-placeholder' and provider == 'proxyapi':
+        project_key = os.environ.get('PROXYAPI_API_KEY')
+        if project_key:
+            return project_key, None
+    
+    return key_value, None
+
+
+def get_tenant_id_by_bot_token(bot_token: str, provider: str = 'telegram') -> int | None:
+    """
+    Определяет tenant_id по bot_token мессенджера.
+    
+    Args:
+        bot_token: Telegram — чистый токен или путь /bot<TOKEN>; MAX — значение Authorization (с 'Bearer ' или без)
+        provider: 'telegram' или 'max'
+    
+    Returns:
+        tenant_id или None если не найдено
+    """
+    try:
+        if not bot_token:
+            return None
+        
+        # Если токен в формате /bot<TOKEN>, извлекаем его
+        if bot_token.startswith('/bot'):
+            bot_token = bot_token[4:]
+        # Убираем префикс 'Bearer ' если есть
+        token = bot_token.replace('Bearer ', '').replace('bearer ', '').strip()
+        
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT tenant_id
+                FROM t_p56134400_telegram_ai_bot_pdf.tenant_api_keys
+                WHERE provider = %s 
+                  AND key_name = 'bot_token' 
+                  AND key_value = %s
+                  AND is_active = true
+            """, (provider, token))
+            row = cur.fetchone()
+            cur.close()
+        
+        return row[0] if row else None
+        
+    except Exception as e:
+        print(f'Error determining tenant_id: {e}')
+        return None
+
+
+def get_tenant_id_by_secret(secret: str) -> int | None:
+    """Определяет tenant_id по VK secret_key."""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT tenant_id
+                FROM t_p56134400_telegram_ai_bot_pdf.tenant_api_keys
+                WHERE provider = 'vk' 
+                  AND key_name = 'secret_key' 
+                  AND key_value = %s
+                  AND is_active = true
+            """, (secret,))
+            row = cur.fetchone()
+            cur.close()
+        
+        return row[0] if row else None
+        
+    except Exception as e:
+        print(f'Error determining tenant_id: {e}')
+        return None
@@ -0,0 +1,131 @@
+"""
+Общий пул соединений с Postgres для функций.
+Пул живёт на уровне модуля и переживает тёплые вызовы функции, поэтому handler и хелперы
+(api_keys_helper, token_logger, formatting_helper) больше не открывают по своему соединению.
+Перед выдачей соединение, простоявшее дольше DB_POOL_HEALTHCHECK_IDLE_SEC, проверяется SELECT 1.
+"""
+import os
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2 import extensions
+
+DB_POOL_MAX_CONN = int(os.environ.get('DB_POOL_MAX_CONN', '4'))
+DB_POOL_HEALTHCHECK_IDLE_SEC = float(os.environ.get('DB_POOL_HEALTHCHECK_IDLE_SEC', '30'))
+
+_pool = None
+_pool_lock = threading.Lock()
+_last_used = {}  # id(conn) -> time.monotonic() последнего возврата в пул
+_borrowed = []   # соединения, выданные в текущем запросе
+_request_stats = {'opened': 0, 'reused': 0, 'discarded': 0}
+
+
+class _CountingPool(pg_pool.ThreadedConnectionPool):
+    """ThreadedConnectionPool, который считает реально открытые соединения"""
+
+    def _connect(self, key=None):
+        _request_stats['opened'] += 1
+        return super()._connect(key)
+
+
+def _get_pool() -> _CountingPool:
+    global _pool
+    if _pool is None or _pool.closed:
+        with _pool_lock:
+            if _pool is None or _pool.closed:
+                _pool = _CountingPool(0, DB_POOL_MAX_CONN, os.environ['DATABASE_URL'])
+    return _pool
+
+
+def _is_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    idle = time.monotonic() - _last_used.get(id(conn), 0)
+    if idle < DB_POOL_HEALTHCHECK_IDLE_SEC:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+def get_connection():
+    """Соединение из пула (autocommit выключен). Вернуть через release_connection"""
+    db_pool = _get_pool()
+    for _ in range(DB_POOL_MAX_CONN + 1):
+        conn = db_pool.getconn()
+        if _is_alive(conn):
+            break
+        # Соединение порвал сервер или балансировщик, пока функция спала
+        _request_stats['discarded'] += 1
+        _last_used.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+    else:
+        raise psycopg2.OperationalError('No healthy connections in pool')
+
+    if id(conn) in _last_used:
+        _request_stats['reused'] += 1
+    _borrowed.append(conn)
+    return conn
+
+
+def release_connection(conn):
+    """Возвращает соединение в пул, откатывая незавершённую транзакцию"""
+    if conn in _borrowed:
+        _borrowed.remove(conn)
+    db_pool = _get_pool()
+    broken = conn.closed
+    if not broken:
+        try:
+            if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+
+    if broken:
+        _last_used.pop(id(conn), None)
+    else:
+        _last_used[id(conn)] = time.monotonic()
+    db_pool.putconn(conn, close=broken)
+
+
+@contextmanager
+def connection():
+    """with connection() as conn: ... — соединение из пула на время блока"""
+    conn = get_connection()
+    try:
+        yield conn
+    finally:
+        release_connection(conn)
+
+
+def request_stats() -> dict:
+    """Сколько соединений открыто / взято из пула / выброшено в текущем запросе"""
+    return dict(_request_stats)
+
+
+def pooled_request(handler):
+    """
+    Декоратор handler: обнуляет счётчики запроса и в конце возвращает в пул
+    соединения, которые не были освобождены (ранние return, исключения).
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        for key in _request_stats:
+            _request_stats[key] = 0
+        try:
+            return handler(event, context)
+        finally:
+            for conn in list(_borrowed):
+                release_connection(conn)
+            print(f"🔌 DB connections: opened={_request_stats['opened']}, "
+                  f"reused={_request_stats['reused']}, discarded={_request_stats['discarded']}")
+    return wrapper
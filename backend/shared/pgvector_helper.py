@@ -0,0 +1,32 @@
+"""
+Поддержка колонки tenant_chunks.embedding_vec (расширение pgvector).
+Колонка создаётся миграцией только там, где pgvector доступен, поэтому перед
+использованием проверяем её наличие (результат кэшируется на тёплый инстанс).
+"""
+
+PGVECTOR_DIM = 256  # Yandex text-search-doc / text-search-query
+
+_pgvector_column_cache = {'available': None}
+
+
+def has_pgvector_column(cur) -> bool:
+    """Есть ли в tenant_chunks колонка embedding_vec (т.е. установлен pgvector и прошла миграция)"""
+    if _pgvector_column_cache['available'] is None:
+        cur.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = 't_p56134400_telegram_ai_bot_pdf'
+                  AND table_name = 'tenant_chunks'
+                  AND column_name = 'embedding_vec'
+            )
+        """)
+        _pgvector_column_cache['available'] = bool(cur.fetchone()[0])
+        print(f"[pgvector] embedding_vec column available: {_pgvector_column_cache['available']}")
+    return _pgvector_column_cache['available']
+
+
+def to_pgvector_literal(vector) -> str | None:
+    """Текстовый литерал '[x,y,...]' для ::vector или None, если размерность не совпадает с колонкой"""
+    if vector is None or len(vector) != PGVECTOR_DIM:
+        return None
+    return '[' + ','.join(repr(float(x)) for x in vector) + ']'
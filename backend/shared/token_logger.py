@@ -1,7 +1,8 @@
-import psycopg2
 import os
 from typing import Optional
 
+from usage_buffer import enqueue, flush as flush_token_usage, flushes_token_usage
+
 # Тарифы Yandex Cloud (руб за 1000 токенов)
 YANDEX_PRICING = {
     'text-search-doc': 0.08,  # Создание эмбеддингов документов
@@ -19,7 +20,7 @@ def log_token_usage(
     metadata: Optional[dict] = None
 ):
     """
-    Логирует использование токенов в БД
+    Логирует использование токенов в БД (через буфер usage_buffer, без ожидания INSERT)
     
     Args:
         tenant_id: ID тенанта
@@ -34,21 +35,11 @@ def log_token_usage(
         price_per_1k = YANDEX_PRICING.get(model, 0)
         cost_rubles = (tokens_used / 1000.0) * price_per_1k
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cur = conn.cursor()
-        
         import json
         metadata_json = json.dumps(metadata) if metadata else None
         
-        cur.execute("""
-            INSERT INTO t_p56134400_telegram_ai_bot_pdf.token_usage 
-            (tenant_id, operation_type, model, tokens_used, cost_rubles, request_id, metadata)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (tenant_id, operation_type, model, tokens_used, cost_rubles, request_id, metadata_json))
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Запись уходит в БД пачкой: по порогам буфера или в конце handler
+        enqueue([tenant_id, operation_type, model, tokens_used, cost_rubles, request_id, metadata_json])
         
     except Exception as e:
         print(f"Error logging token usage: {e}")
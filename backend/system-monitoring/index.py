@@ -1,12 +1,13 @@
 import json
 import os
-import psycopg2
 from datetime import datetime
 import sys
 sys.path.append('/function/code')
 from timezone_helper import moscow_naive
 from auth_middleware import require_auth
+from db_pool import get_connection, release_connection, pooled_request, DB_POOL_MAX_CONN
 
+@pooled_request
 def handler(event: dict, context) -> dict:
     '''Мониторинг нагрузки системы: активные тенанты, статистика БД, активность пользователей'''
     method = event.get('httpMethod', 'GET')
@@ -46,7 +47,7 @@ def handler(event: dict, context) -> dict:
         }
     
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
         schema = 't_p56134400_telegram_ai_bot_pdf'
     except Exception as e:
@@ -128,10 +129,33 @@ def handler(event: dict, context) -> dict:
             })
         stats['tariff_distribution'] = tariff_distribution
         
-        # 6. Статистика БД
+        # 6. Статистика БД: лимит и текущие соединения берём у самого Postgres
+        cur.execute("SHOW max_connections")
+        max_connections = int(cur.fetchone()[0])
+        cur.execute("""
+            SELECT
+                COUNT(*) as total,
+                SUM(CASE WHEN state = 'active' THEN 1 ELSE 0 END) as active,
+                SUM(CASE WHEN state = 'idle' THEN 1 ELSE 0 END) as idle
+            FROM pg_stat_activity
+            WHERE datname = current_database()
+        """)
+        row = cur.fetchone()
+        cur.execute("""
+            SELECT COUNT(*) FROM information_schema.tables
+            WHERE table_schema = %s
+        """, (schema,))
+        tables_count = cur.fetchone()[0]
         stats['database'] = {
-            'max_connections': 50,
-            'tables': 26
+            'max_connections': max_connections,
+            'connections': {
+                'total': row[0] if row[0] else 0,
+                'active': row[1] if row[1] else 0,
+                'idle': row[2] if row[2] else 0
+            },
+            'connections_usage_percent': round(((row[0] or 0) / max_connections) * 100, 1) if max_connections else 0,
+            'pool_max_per_instance': DB_POOL_MAX_CONN,
+            'tables': tables_count
         }
         
         # 7. Рекомендуемые лимиты
@@ -141,7 +165,7 @@ def handler(event: dict, context) -> dict:
         }
         
         cur.close()
-        conn.close()
+        release_connection(conn)
         
         return {
             'statusCode': 200,
@@ -163,7 +187,7 @@ def handler(event: dict, context) -> dict:
         print(f'Error getting system stats: {error_details}')
         try:
             cur.close()
-            conn.close()
+            release_connection(conn)
         except:
             pass
         return {
@@ -1,47 +1,14 @@
 """Утилита для загрузки настроек форматирования из БД"""
 import os
 import json
-import psycopg2
 import re
 
-def get_formatting_settings(tenant_id: int, messenger: str) -> dict:
-    """Получить настройки форматирования для тенанта и мессенджера"""
-    try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT use_emoji, use_markdown, use_lists_formatting,
-                   custom_emoji_map, list_bullet_char, numbered_list_char
-            FROM t_p56134400_telegram_ai_bot_pdf.messenger_formatting_settings
-            WHERE tenant_id = %s AND messenger = %s
-        """, (tenant_id, messenger))
-        
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
-        
-        if not row:
-            # Дефолтные настройки
-            return {
-                'use_emoji': True,
-                'use_markdown': messenger == 'telegram',
-                'use_lists_formatting': True,
-                'custom_emoji_map': {},
-                'list_bullet_char': '•',
-                'numbered_list_char': '▫️'
-            }
-        
-        return {
-            'use_emoji': row[0],
-            'use_markdown': row[1],
-            'use_lists_formatting': row[2],
-            'custom_emoji_map': row[3] if row[3] else {},
-            'list_bullet_char': row[4],
-            'numbered_list_char': row[5]
-        }
-    except Exception as e:
-        print(f'Error loading formatting settings: {e}')
+from db_pool import connection
+
+def formatting_settings_from_row(row, messenger: str) -> dict:
+    """Настройки из строки messenger_formatting_settings (кортеж или dict), без строки — дефолтные"""
+    if not row:
+        # Дефолтные настройки
         return {
             'use_emoji': True,
             'use_markdown': messenger == 'telegram',
@@ -50,17 +17,53 @@ def get_formatting_settings(tenant_id: int, messenger: str) -> dict:
             'list_bullet_char': '•',
             'numbered_list_char': '▫️'
         }
+    
+    if isinstance(row, dict):
+        row = (row['use_emoji'], row['use_markdown'], row['use_lists_formatting'],
+               row['custom_emoji_map'], row['list_bullet_char'], row['numbered_list_char'])
+    
+    return {
+        'use_emoji': row[0],
+        'use_markdown': row[1],
+        'use_lists_formatting': row[2],
+        'custom_emoji_map': row[3] if row[3] else {},
+        'list_bullet_char': row[4],
+        'numbered_list_char': row[5]
+    }
+
+def get_formatting_settings(tenant_id: int, messenger: str) -> dict:
+    """Получить настройки форматирования для тенанта и мессенджера"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT use_emoji, use_markdown, use_lists_formatting,
+                       custom_emoji_map, list_bullet_char, numbered_list_char
+                FROM t_p56134400_telegram_ai_bot_pdf.messenger_formatting_settings
+                WHERE tenant_id = %s AND messenger = %s
+            """, (tenant_id, messenger))
+            row = cur.fetchone()
+            cur.close()
+        
+        return formatting_settings_from_row(row, messenger)
+    except Exception as e:
+        print(f'Error loading formatting settings: {e}')
+        return formatting_settings_from_row(None, messenger)
 
 def format_with_settings(text: str, settings: dict, messenger: str) -> str:
     """Форматирование текста согласно настройкам"""
     
-    # Убираем HTML-теги и конвертируем в Markdown для Telegram
+    # Форматирование под конкретный канал
     if messenger == 'telegram':
+        # Markdown для Telegram: HTML → Markdown
         text = re.sub(r'<b>(.+?)</b>', r'**\1**', text, flags=re.IGNORECASE | re.DOTALL)
         text = re.sub(r'<i>(.+?)</i>', r'*\1*', text, flags=re.IGNORECASE | re.DOTALL)
         text = re.sub(r'<[^>]+>', '', text)
+    elif messenger == 'widget':
+        # HTML для виджета: оставляем HTML теги, они работают в браузере
+        pass  # HTML теги поддерживаются в виджете нативно
     elif messenger in ['max', 'vk']:
-        # Просто удаляем HTML-теги
+        # Удаляем HTML-теги для MAX и VK
         text = re.sub(r'<b>(.+?)</b>', r'\1', text, flags=re.IGNORECASE | re.DOTALL)
         text = re.sub(r'<i>(.+?)</i>', r'\1', text, flags=re.IGNORECASE | re.DOTALL)
         text = re.sub(r'<[^>]+>', '', text)
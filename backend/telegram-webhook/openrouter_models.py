@@ -0,0 +1,89 @@
+"""
+Выбор бесплатной модели OpenRouter по данным фоновой проверки.
+Каталог и пробные запросы делает функция openrouter-model-health по таймеру и пишет
+результат в openrouter_model_health; здесь только читается эта таблица (с кэшем в памяти),
+поэтому запрос пользователя не ждёт каталог OpenRouter.
+"""
+import os
+import time
+from typing import Dict, List, Optional
+
+from db_pool import connection
+
+MODEL_HEALTH_CACHE_SEC = float(os.environ.get('MODEL_HEALTH_CACHE_SEC', '60'))
+# Замер старше этого считается устаревшим — модель не выбираем, пока проверка не повторится
+MODEL_HEALTH_MAX_AGE_MIN = int(os.environ.get('MODEL_HEALTH_MAX_AGE_MIN', '120'))
+MODEL_HEALTH_MAX_ERROR_RATE = float(os.environ.get('MODEL_HEALTH_MAX_ERROR_RATE', '0.5'))
+
+# model_id -> {'friendly_name', 'healthy', 'latency_ms'}
+_health_cache = {
+    'models': {},
+    'loaded_at': None
+}
+
+
+def _load_model_health() -> Dict[str, dict]:
+    if _health_cache['loaded_at'] and time.monotonic() - _health_cache['loaded_at'] < MODEL_HEALTH_CACHE_SEC:
+        return _health_cache['models']
+
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT model_id, friendly_name, ewma_latency_ms,
+                       is_listed
+                       AND error_rate < %s
+                       AND ewma_latency_ms IS NOT NULL
+                       AND last_probe_at > NOW() - INTERVAL '{MODEL_HEALTH_MAX_AGE_MIN} minutes'
+                FROM t_p56134400_telegram_ai_bot_pdf.openrouter_model_health
+            """, (MODEL_HEALTH_MAX_ERROR_RATE,))
+            rows = cur.fetchall()
+            cur.close()
+        _health_cache['models'] = {
+            row[0]: {'friendly_name': row[1], 'latency_ms': row[2], 'healthy': bool(row[3])}
+            for row in rows
+        }
+    except Exception as e:
+        # Остаёмся на прошлых данных; повторим не раньше чем через MODEL_HEALTH_CACHE_SEC
+        print(f"⚠️ Ошибка чтения здоровья моделей OpenRouter: {e}")
+
+    _health_cache['loaded_at'] = time.monotonic()
+    return _health_cache['models']
+
+
+def get_healthy_models(friendly_name: str) -> List[str]:
+    """Здоровые модели группы, самые быстрые первыми"""
+    models = _load_model_health()
+    group = [
+        (info['latency_ms'], model_id) for model_id, info in models.items()
+        if info['friendly_name'] == friendly_name and info['healthy']
+    ]
+    return [model_id for _, model_id in sorted(group)]
+
+
+def get_working_free_model(requested_model: str) -> str:
+    """
+    Получить рабочую бесплатную модель на основе запрошенной
+
+    Args:
+        requested_model: Запрошенная модель (friendly name или полный ID)
+
+    Returns:
+        Самую быструю здоровую модель той же группы; запрошенную модель, если о ней
+        ещё нет данных проверки
+    """
+    models = _load_model_health()
+    known = models.get(requested_model)
+    friendly_name: Optional[str] = known['friendly_name'] if known else requested_model
+
+    healthy = get_healthy_models(friendly_name)
+    if healthy:
+        if healthy[0] != requested_model:
+            print(f"🔁 OpenRouter: {requested_model} → {healthy[0]} (самая быстрая здоровая модель группы {friendly_name})")
+        return healthy[0]
+
+    if known or any(info['friendly_name'] == friendly_name for info in models.values()):
+        # Группа проверялась, и ни одна модель не отвечает — пусть сработает failover
+        raise ValueError(f"Модель {requested_model} недоступна и нет бесплатных альтернатив")
+
+    return requested_model
@@ -0,0 +1,163 @@
+"""
+Реестр HTTP-клиентов LLM-провайдеров.
+Клиенты (httpx.Client и OpenAI поверх него) живут на уровне модуля, ключ — (провайдер,
+хэш API ключа, прокси), поэтому тёплый инстанс переиспользует keep-alive соединения и не
+делает TLS handshake на каждый вызов. Таймауты задаются на провайдера, а по trace-событиям
+httpcore собираются тайминги connect / TLS / TTFB каждого запроса.
+"""
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+import httpx
+
+PROVIDER_BASE_URLS = {
+    'openrouter': 'https://openrouter.ai/api/v1',
+    'deepseek': 'https://api.deepseek.com',
+    'proxyapi': 'https://api.proxyapi.ru/openai/v1',
+}
+
+# Таймаут чтения ответа (сек) по провайдерам; соединение — PROVIDER_CONNECT_TIMEOUT
+PROVIDER_READ_TIMEOUTS = {
+    'yandex': float(os.environ.get('YANDEX_TIMEOUT', '60')),
+    'openrouter': float(os.environ.get('OPENROUTER_TIMEOUT', '60')),
+    'deepseek': float(os.environ.get('DEEPSEEK_TIMEOUT', '90')),
+    'proxyapi': float(os.environ.get('PROXYAPI_TIMEOUT', '60')),
+}
+PROVIDER_CONNECT_TIMEOUT = float(os.environ.get('PROVIDER_CONNECT_TIMEOUT', '5'))
+PROVIDER_MAX_RETRIES = int(os.environ.get('PROVIDER_MAX_RETRIES', '1'))
+PROVIDER_CLIENT_CACHE_SIZE = int(os.environ.get('PROVIDER_CLIENT_CACHE_SIZE', '32'))
+
+# (kind, provider, key_hash, proxy_url) -> клиент
+_clients: 'OrderedDict[tuple, object]' = OrderedDict()
+_clients_lock = threading.Lock()
+# trace-события HTTP-запросов текущего запроса чата. ContextVar, а не глобальный список: drain
+# вебхуков ведёт несколько запросов в параллельных потоках. Потоки шагов llm_router стартуют
+# в копии контекста запроса и пишут в тот же список
+_request_traces: ContextVar[Optional[List[dict]]] = ContextVar('provider_request_traces', default=None)
+
+
+def _key_hash(api_key: Optional[str]) -> str:
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:16]
+
+
+def _proxy_url(proxy: Optional[dict]) -> Optional[str]:
+    """proxy в формате tenant_context.parse_proxy ({'http://': url, 'https://': url})"""
+    if not proxy:
+        return None
+    return proxy.get('https://') or proxy.get('http://')
+
+
+def _timeout(provider: str, read_timeout: Optional[float] = None) -> httpx.Timeout:
+    read = read_timeout or PROVIDER_READ_TIMEOUTS.get(provider, 60.0)
+    return httpx.Timeout(read, connect=min(PROVIDER_CONNECT_TIMEOUT, read))
+
+
+def _trace_hook(provider: str):
+    """event hook httpx: вешает trace-колбэк httpcore на каждый запрос"""
+    def on_request(request: httpx.Request):
+        record = {'provider': provider, 'host': request.url.host, 'started': time.perf_counter(), 'events': {}}
+        traces = _request_traces.get()
+        if traces is not None:
+            traces.append(record)
+
+        def trace(event_name: str, info: dict):
+            record['events'][event_name] = time.perf_counter()
+
+        request.extensions['trace'] = trace
+    return on_request
+
+
+def _make_http_client(provider: str, proxy_url: Optional[str]) -> httpx.Client:
+    kwargs = dict(
+        timeout=_timeout(provider),
+        limits=httpx.Limits(max_keepalive_connections=10, keepalive_expiry=60),
+        event_hooks={'request': [_trace_hook(provider)]},
+    )
+    if not proxy_url:
+        return httpx.Client(**kwargs)
+    try:
+        return httpx.Client(proxy=proxy_url, **kwargs)
+    except TypeError:
+        # httpx < 0.26 принимает только proxies=
+        return httpx.Client(proxies=proxy_url, **kwargs)
+
+
+def _get_or_create(key: tuple, factory):
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+        client = factory()
+        _clients[key] = client
+        # Вытесненный клиент не закрываем: его httpx.Client может ещё использовать
+        # закэшированный OpenAI-клиент; соединения закроются вместе с последней ссылкой
+        while len(_clients) > PROVIDER_CLIENT_CACHE_SIZE:
+            _clients.popitem(last=False)
+        return client
+
+
+def get_http_client(provider: str, proxy: Optional[dict] = None) -> httpx.Client:
+    """Общий keep-alive httpx.Client провайдера (для Yandex completion и textEmbedding)"""
+    proxy_url = _proxy_url(proxy)
+    return _get_or_create(('http', provider, '', proxy_url), lambda: _make_http_client(provider, proxy_url))
+
+
+def get_openai_client(provider: str, api_key: str, proxy: Optional[dict] = None):
+    """OpenAI-совместимый клиент OpenRouter/DeepSeek/ProxyAPI поверх общего httpx.Client"""
+    from openai import OpenAI
+
+    proxy_url = _proxy_url(proxy)
+    http_client = get_http_client(provider, proxy)
+    return _get_or_create(
+        ('openai', provider, _key_hash(api_key), proxy_url),
+        lambda: OpenAI(
+            api_key=api_key,
+            base_url=PROVIDER_BASE_URLS[provider],
+            http_client=http_client,
+            timeout=_timeout(provider),
+            max_retries=PROVIDER_MAX_RETRIES
+        )
+    )
+
+
+def reset_provider_timings():
+    """Начало запроса чата: дальше тайминги копятся в отдельный список этого контекста"""
+    _request_traces.set([])
+
+
+def _span_ms(events: Dict[str, float], prefix: str) -> Optional[float]:
+    started, complete = events.get(f'{prefix}.started'), events.get(f'{prefix}.complete')
+    if started is None or complete is None:
+        return None
+    return round((complete - started) * 1000, 1)
+
+
+def provider_timings() -> List[dict]:
+    """
+    Тайминги HTTP-запросов к провайдерам за текущий вызов:
+    connect_ms / tls_ms — None, если соединение взято из keep-alive пула; ttfb_ms — от начала
+    отправки запроса до получения заголовков ответа.
+    """
+    timings = []
+    for record in _request_traces.get() or []:
+        events = record['events']
+        connect_ms = _span_ms(events, 'connection.connect_tcp')
+        tls_ms = _span_ms(events, 'connection.start_tls')
+        sent = events.get('http11.send_request_headers.started') or events.get('http2.send_request_headers.started')
+        headers_done = (events.get('http11.receive_response_headers.complete')
+                        or events.get('http2.receive_response_headers.complete'))
+        timings.append({
+            'provider': record['provider'],
+            'host': record['host'],
+            'reused_connection': connect_ms is None,
+            'connect_ms': connect_ms,
+            'tls_ms': tls_ms,
+            'ttfb_ms': round((headers_done - sent) * 1000, 1) if sent and headers_done else None
+        })
+    return timings
@@ -0,0 +1,9 @@
+"""
+Минимальная заглушка для системного промпта.
+Используется ТОЛЬКО если дефолтный промпт не найден в БД (таблица default_settings).
+В нормальной ситуации промпт читается из базы данных.
+"""
+
+DEFAULT_SYSTEM_PROMPT = '''Ты — дружелюбный AI-помощник. Отвечай кратко и по делу.
+
+{rag_context_placeholder}'''
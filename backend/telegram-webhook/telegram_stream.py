@@ -0,0 +1,99 @@
+"""
+Потоковый ответ в Telegram: сразу отправляем заглушку, затем правим её через editMessageText
+по мере того, как пайплайн чата отдаёт накопленный ответ (on_partial), и в конце ставим итоговый
+текст с Markdown. Правки троттлятся под лимиты Telegram (около одной в секунду на личный чат,
+20 в минуту на группу) и учитывают retry_after из ответа 429.
+"""
+import os
+import re
+import time
+from typing import Optional
+
+import requests
+
+TELEGRAM_STREAM_REPLIES = os.environ.get('TELEGRAM_STREAM_REPLIES', 'true').lower() == 'true'
+TELEGRAM_EDIT_INTERVAL_SEC = float(os.environ.get('TELEGRAM_EDIT_INTERVAL_SEC', '1.2'))
+TELEGRAM_GROUP_EDIT_INTERVAL_SEC = float(os.environ.get('TELEGRAM_GROUP_EDIT_INTERVAL_SEC', '3.0'))
+TELEGRAM_MAX_MESSAGE_LEN = 4096
+TELEGRAM_PLACEHOLDER = '✍️ Печатаю ответ…'
+
+
+def strip_markdown(text: str) -> str:
+    """Промежуточные правки идут без parse_mode: незакрытая разметка сломала бы editMessageText"""
+    return re.sub(r'[*_`\[\]]', '', text)
+
+
+class TelegramMessageEditor:
+    """Одно сообщение бота, которое дописывается правками"""
+
+    def __init__(self, bot_token: str, chat_id):
+        self.api_url = f'https://api.telegram.org/bot{bot_token}'
+        self.chat_id = chat_id
+        self.message_id = None
+        self.last_text = None
+        self.last_edit_at = 0.0
+        self.blocked_until = 0.0
+        # Отрицательный chat_id — группа или канал, там лимит строже
+        is_group = isinstance(chat_id, int) and chat_id < 0
+        self.interval = TELEGRAM_GROUP_EDIT_INTERVAL_SEC if is_group else TELEGRAM_EDIT_INTERVAL_SEC
+
+    def send_placeholder(self) -> bool:
+        response = requests.post(
+            f'{self.api_url}/sendMessage',
+            json={'chat_id': self.chat_id, 'text': TELEGRAM_PLACEHOLDER},
+            timeout=10
+        )
+        if not response.ok:
+            print(f'[telegram-stream] Placeholder failed: {response.status_code} {response.text[:200]}')
+            return False
+        self.message_id = response.json()['result']['message_id']
+        self.last_edit_at = time.monotonic()
+        return True
+
+    def _edit(self, text: str, parse_mode: Optional[str] = None) -> requests.Response:
+        payload = {
+            'chat_id': self.chat_id,
+            'message_id': self.message_id,
+            'text': text[:TELEGRAM_MAX_MESSAGE_LEN],
+            'disable_web_page_preview': False
+        }
+        if parse_mode:
+            payload['parse_mode'] = parse_mode
+
+        response = requests.post(f'{self.api_url}/editMessageText', json=payload, timeout=10)
+        self.last_edit_at = time.monotonic()
+        if response.status_code == 429:
+            retry_after = response.json().get('parameters', {}).get('retry_after', 1)
+            self.blocked_until = time.monotonic() + float(retry_after)
+            print(f'[telegram-stream] Rate limited, retry after {retry_after}s')
+        elif response.ok or 'message is not modified' in response.text:
+            self.last_text = text
+        return response
+
+    def maybe_edit(self, text: str):
+        """Промежуточная правка, если прошёл интервал и текст изменился"""
+        now = time.monotonic()
+        if not text or text == self.last_text or now < self.blocked_until or now - self.last_edit_at < self.interval:
+            return
+        self._edit(text)
+
+    def finish(self, text: str) -> bool:
+        """Итоговая правка с Markdown (без него — если Telegram не разобрал разметку)"""
+        wait = max(self.blocked_until, self.last_edit_at + self.interval) - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+        response = self._edit(text, parse_mode='Markdown')
+        if response.ok or 'message is not modified' in response.text:
+            return True
+        if response.status_code == 429:
+            time.sleep(max(0.0, self.blocked_until - time.monotonic()))
+            response = self._edit(text, parse_mode='Markdown')
+            if response.ok:
+                return True
+        if response.status_code == 400 and 'parse entities' in response.text:
+            print(f'[telegram-stream] Final edit: retrying without markdown')
+            return self._edit(strip_markdown(text)).ok
+
+        print(f'[telegram-stream] Final edit failed: {response.status_code} {response.text[:200]}')
+        return False
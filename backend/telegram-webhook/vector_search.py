@@ -0,0 +1,154 @@
+"""
+Векторный поиск по чанкам тенанта на NumPy.
+Эмбеддинги собираются в непрерывную float32-матрицу с заранее посчитанными L2-нормами,
+запрос скорится одним матрично-векторным произведением + argpartition для top-k.
+Опционально (RAG_RETRIEVAL_MODE=pgvector) top-k считается в Postgres по HNSW-индексу.
+"""
+import os
+import json
+from typing import List, Optional, Tuple, Sequence
+
+import numpy as np
+
+from embedding_codec import EMBEDDING_DTYPE
+from pgvector_helper import has_pgvector_column, to_pgvector_literal
+
+RETRIEVAL_MODES = ('python', 'pgvector')
+RAG_RETRIEVAL_MODE = os.environ.get('RAG_RETRIEVAL_MODE', 'python').lower()
+PGVECTOR_EF_SEARCH_MIN = int(os.environ.get('PGVECTOR_EF_SEARCH_MIN', '40'))
+
+
+class ChunkIndex:
+    """Матрица эмбеддингов чанков одного тенанта"""
+
+    def __init__(self, texts: List[str], matrix: np.ndarray):
+        self.texts = texts
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.norms = np.linalg.norm(self.matrix, axis=1).astype(np.float32) if len(texts) else np.zeros(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    @property
+    def nbytes(self) -> int:
+        """Примерный объём памяти индекса (матрица + нормы + тексты)"""
+        return int(self.matrix.nbytes + self.norms.nbytes + sum(len(t) for t in self.texts))
+
+    def scores(self, query_embedding: Sequence[float]) -> np.ndarray:
+        """Косинусная близость запроса ко всем чанкам (нулевые векторы дают 0)"""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if query.shape[0] != self.dim:
+            raise ValueError(f"Embedding dim mismatch: query={query.shape[0]}, index={self.dim}")
+
+        query_norm = float(np.linalg.norm(query))
+        if query_norm == 0 or len(self) == 0:
+            return np.zeros(len(self), dtype=np.float32)
+
+        dots = self.matrix @ query
+        denom = self.norms * query_norm
+        return np.divide(dots, denom, out=np.zeros_like(dots), where=denom > 0)
+
+    def search(self, query_embedding: Sequence[float], top_k: int) -> List[Tuple[str, float]]:
+        """Top-k чанков по косинусной близости, отсортированные по убыванию"""
+        if len(self) == 0 or top_k <= 0:
+            return []
+
+        sims = self.scores(query_embedding)
+        k = min(top_k, len(sims))
+        if k < len(sims):
+            top_idx = np.argpartition(-sims, k - 1)[:k]
+        else:
+            top_idx = np.arange(len(sims))
+        top_idx = top_idx[np.argsort(-sims[top_idx], kind='stable')]
+
+        return [(self.texts[i], float(sims[i])) for i in top_idx]
+
+
+def decode_row_embedding(embedding_bin, embedding_text):
+    """Вектор из embedding_bin (float32 BE), для ещё не мигрированных строк — из JSON"""
+    if embedding_bin is not None:
+        return np.frombuffer(embedding_bin, dtype=EMBEDDING_DTYPE)
+    return np.asarray(json.loads(embedding_text), dtype=np.float32)
+
+
+def build_index(rows: List[Tuple[str, Optional[bytes], Optional[str]]]) -> ChunkIndex:
+    """
+    Собирает ChunkIndex из строк (chunk_text, embedding_bin, embedding_text).
+    Векторы другой размерности (остатки после смены модели) и битые данные пропускаются.
+    """
+    texts: List[str] = []
+    vectors: List[np.ndarray] = []
+    dim = None
+    skipped = 0
+
+    for chunk_text, embedding_bin, embedding_text in rows:
+        try:
+            vector = decode_row_embedding(embedding_bin, embedding_text)
+        except (TypeError, ValueError):
+            skipped += 1
+            continue
+
+        if dim is None:
+            dim = vector.shape[0]
+        if vector.ndim != 1 or vector.shape[0] != dim:
+            skipped += 1
+            continue
+
+        texts.append(chunk_text)
+        vectors.append(vector)
+
+    if skipped:
+        print(f"⚠️ [vector_search] Skipped {skipped} chunks with invalid or mismatched embeddings")
+
+    matrix = np.vstack(vectors).astype(np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+    return ChunkIndex(texts, matrix)
+
+
+
+def load_tenant_index(cur, tenant_id: int) -> ChunkIndex:
+    """Выгружает все чанки тенанта с эмбеддингами и собирает ChunkIndex"""
+    # JSON тянем только для строк, которые ещё не переведены в embedding_bin
+    cur.execute("""
+        SELECT chunk_text, embedding_bin,
+               CASE WHEN embedding_bin IS NULL THEN embedding_text END
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks 
+        WHERE tenant_id = %s AND (embedding_bin IS NOT NULL OR embedding_text IS NOT NULL)
+    """, (tenant_id,))
+    return build_index(cur.fetchall())
+
+def get_retrieval_mode(tenant_overrides: dict = None) -> str:
+    """Режим поиска: ai_settings.retrieval_mode тенанта или RAG_RETRIEVAL_MODE"""
+    mode = (tenant_overrides or {}).get('retrieval_mode') or RAG_RETRIEVAL_MODE
+    mode = str(mode).lower()
+    return mode if mode in RETRIEVAL_MODES else 'python'
+
+
+def search_pgvector(cur, tenant_id: int, query_embedding: Sequence[float], top_k: int) -> Optional[List[Tuple[str, float]]]:
+    """
+    Top-k чанков через ORDER BY embedding_vec <=> query в Postgres.
+    Возвращает None, если pgvector недоступен или размерность запроса не подходит под колонку —
+    тогда вызывающий код уходит на Python-скан.
+    """
+    if not has_pgvector_column(cur):
+        return None
+
+    query_literal = to_pgvector_literal(query_embedding)
+    if query_literal is None:
+        print(f"⚠️ [vector_search] Query dim {len(query_embedding)} does not fit embedding_vec, using python scan")
+        return None
+
+    # HNSW отдаёт ef_search кандидатов до фильтра по тенанту, поэтому держим запас
+    cur.execute("SET LOCAL hnsw.ef_search = %s", (max(PGVECTOR_EF_SEARCH_MIN, top_k * 4),))
+    cur.execute("""
+        SELECT chunk_text, 1 - (embedding_vec <=> %s::vector) AS similarity
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+        WHERE tenant_id = %s AND embedding_vec IS NOT NULL
+        ORDER BY embedding_vec <=> %s::vector
+        LIMIT %s
+    """, (query_literal, tenant_id, query_literal, top_k))
+
+    return [(row[0], float(row[1])) for row in cur.fetchall()]
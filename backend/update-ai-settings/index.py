@@ -5,6 +5,7 @@ from datetime import datetime
 import sys
 sys.path.insert(0, '/function/code/shared')
 from auth_middleware import get_tenant_id_from_request
+from settings_version import bump_settings_version
 
 def handler(event: dict, context) -> dict:
     """Обновление настроек AI провайдеров"""
@@ -86,8 +87,14 @@ def handler(event: dict, context) -> dict:
         for key, value in settings.items():
             if key in ['temperature', 'top_p', 'frequency_penalty', 'presence_penalty']:
                 ai_settings[key] = str(value)
-            elif key in ['provider', 'chat_provider', 'chat_model', 'embedding_provider', 'embedding_model', 'system_prompt', 'max_tokens', 'system_priority', 'creative_mode', 'model', 'enable_pure_prompt_mode', 'rag_topk_default', 'rag_topk_fallback']:
+            elif key in ['provider', 'chat_provider', 'chat_model', 'embedding_provider', 'embedding_model', 'system_prompt', 'max_tokens', 'system_priority', 'creative_mode', 'model', 'enable_pure_prompt_mode', 'rag_topk_default', 'rag_topk_fallback', 'retrieval_mode', 'answer_cache_enabled', 'hedge_enabled', 'provider_timeout']:
                 ai_settings[key] = value
+            elif key == 'failover':
+                # Упорядоченный список запасных провайдеров: [{"provider", "model", "timeout"}]
+                ai_settings[key] = [
+                    {'provider': item.get('provider'), 'model': item.get('model'), 'timeout': item.get('timeout')}
+                    for item in (value or []) if isinstance(item, dict) and item.get('provider') and item.get('model')
+                ]
         
         # Синхронизация новой и старой схемы (обратная совместимость)
         # Если пришли provider + model из frontend, обновляем chat_provider + chat_model
@@ -108,6 +115,15 @@ def handler(event: dict, context) -> dict:
                 updated_at = CURRENT_TIMESTAMP
         """, (tenant_id, ai_settings_json))
 
+        # Смена промпта или модели делает закэшированные ответы неактуальными
+        if any(key in settings for key in ('system_prompt', 'model', 'provider', 'chat_model', 'chat_provider')):
+            cur.execute("""
+                DELETE FROM t_p56134400_telegram_ai_bot_pdf.answer_cache
+                WHERE tenant_id = %s
+            """, (tenant_id,))
+
+        bump_settings_version(cur, tenant_id)
+
         conn.commit()
         cur.close()
         conn.close()
@@ -2,6 +2,7 @@ import json
 import os
 import psycopg2
 from auth_middleware import get_tenant_id_from_request
+from settings_version import bump_settings_version
 
 def handler(event: dict, context) -> dict:
     """Обновление настроек Quality Gate для тенанта"""
@@ -79,6 +80,8 @@ def handler(event: dict, context) -> dict:
             WHERE tenant_id = %s
         """, (json.dumps(settings_with_rules), tenant_id))
 
+        bump_settings_version(cur, tenant_id)
+
         conn.commit()
         cur.close()
         conn.close()
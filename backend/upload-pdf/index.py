@@ -2,6 +2,7 @@ import json
 import os
 import base64
 import boto3
+from botocore.config import Config
 import psycopg2
 from datetime import datetime
 import sys
@@ -9,9 +10,175 @@ sys.path.insert(0, '/function/code/shared')
 from auth_middleware import get_tenant_id_from_request
 sys.path.append('/function/code')
 from timezone_helper import moscow_naive
+from ingestion_jobs import enqueue_job, kick_ingestion
+
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+# Лимит прямой загрузки в бакет; base64 через тело функции по-прежнему ограничен 10 МБ
+UPLOAD_MAX_SIZE_MB = int(os.environ.get('UPLOAD_MAX_SIZE_MB', '100'))
+UPLOAD_URL_EXPIRES_SEC = int(os.environ.get('UPLOAD_URL_EXPIRES_SEC', '900'))
+PDF_HEADER_RANGE = 'bytes=0-1023'
+
+
+def get_s3_client():
+    return boto3.client('s3',
+        endpoint_url=S3_ENDPOINT_URL,
+        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+        config=Config(signature_version='s3v4')
+    )
+
+
+def make_file_key(tenant_id: int, file_name: str) -> str:
+    """Ключ в бакете; префикс тенанта не даёт зарегистрировать чужой загруженный файл"""
+    return f'documents/{tenant_id}/{moscow_naive().strftime("%Y%m%d_%H%M%S")}_{file_name}'
+
+
+def register_document(tenant_id: int, file_name: str, file_key: str, file_size: int, category: str) -> dict:
+    """Создаёт строку tenant_documents, ставит документ в очередь индексации и возвращает ответ загрузки"""
+    cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{file_key}"
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    
+    cur.execute("""
+        INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_documents (tenant_id, file_name, file_key, file_size_bytes, category, status)
+        VALUES (%s, %s, %s, %s, %s, 'processing')
+        RETURNING id
+    """, (tenant_id, file_name, file_key, file_size, category))
+    
+    doc_id = cur.fetchone()[0]
+    print(f"📄 CREATED DOCUMENT: doc_id={doc_id}, tenant_id={tenant_id}, file_name={file_name}")
+    # Индексацию документа выполняет process-pdf в фоне, клиент следит за ней через get-documents
+    job_id = enqueue_job(cur, tenant_id, doc_id, 'upload')
+    conn.commit()
+    print(f"✅ COMMITTED to DB: doc_id={doc_id}, ingestion job_id={job_id}")
+    cur.close()
+    conn.close()
+
+    kick_ingestion()
+
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'documentId': doc_id,
+            'jobId': job_id,
+            'fileName': file_name,
+            'fileKey': file_key,
+            'cdnUrl': cdn_url,
+            'status': 'processing'
+        }),
+        'isBase64Encoded': False
+    }
+
+
+def init_upload(tenant_id: int, body: dict) -> dict:
+    """Шаг 1 прямой загрузки: выдаёт presigned PUT URL, браузер кладёт файл сразу в бакет"""
+    file_name = body.get('fileName')
+    file_size = body.get('fileSize')
+
+    if not file_name or not isinstance(file_size, int):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'fileName and fileSize required'}),
+            'isBase64Encoded': False
+        }
+
+    if not file_name.lower().endswith('.pdf'):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Только PDF файлы разрешены'}),
+            'isBase64Encoded': False
+        }
+
+    if file_size <= 0 or file_size > UPLOAD_MAX_SIZE_MB * 1024 * 1024:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'Файл слишком большой. Максимальный размер: {UPLOAD_MAX_SIZE_MB} МБ'}),
+            'isBase64Encoded': False
+        }
+
+    file_key = make_file_key(tenant_id, file_name)
+    upload_url = get_s3_client().generate_presigned_url(
+        'put_object',
+        Params={'Bucket': S3_BUCKET, 'Key': file_key, 'ContentType': 'application/pdf'},
+        ExpiresIn=UPLOAD_URL_EXPIRES_SEC
+    )
+    print(f"🔗 PRESIGNED UPLOAD: tenant_id={tenant_id}, file_key={file_key}, size={file_size}")
+
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'uploadUrl': upload_url,
+            'method': 'PUT',
+            'headers': {'Content-Type': 'application/pdf'},
+            'fileKey': file_key,
+            'expiresIn': UPLOAD_URL_EXPIRES_SEC
+        }),
+        'isBase64Encoded': False
+    }
+
+
+def complete_upload(tenant_id: int, body: dict) -> dict:
+    """Шаг 2 прямой загрузки: проверяет загруженный объект (размер и заголовок %PDF
+    ranged GET, без скачивания файла целиком) и регистрирует документ"""
+    file_key = body.get('fileKey') or ''
+    category = body.get('category', 'Общая')
+
+    if not file_key.startswith(f'documents/{tenant_id}/'):
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'fileKey не принадлежит тенанту'}),
+            'isBase64Encoded': False
+        }
+
+    s3 = get_s3_client()
+    try:
+        head = s3.head_object(Bucket=S3_BUCKET, Key=file_key)
+    except s3.exceptions.ClientError as e:
+        print(f"❌ Uploaded object not found: {file_key}: {e}")
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Файл не загружен в хранилище'}),
+            'isBase64Encoded': False
+        }
+
+    file_size = head['ContentLength']
+    error = None
+    if file_size > UPLOAD_MAX_SIZE_MB * 1024 * 1024:
+        error = f'Файл слишком большой. Максимальный размер: {UPLOAD_MAX_SIZE_MB} МБ'
+    else:
+        header = s3.get_object(Bucket=S3_BUCKET, Key=file_key, Range=PDF_HEADER_RANGE)['Body'].read()
+        if not header.startswith(b'%PDF'):
+            error = 'Файл не является PDF документом'
+
+    if error:
+        s3.delete_object(Bucket=S3_BUCKET, Key=file_key)
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': error}),
+            'isBase64Encoded': False
+        }
+
+    file_name = body.get('fileName') or file_key.rsplit('/', 1)[-1].split('_', 2)[-1]
+    return register_document(tenant_id, file_name, file_key, file_size, category)
+
 
 def handler(event: dict, context) -> dict:
-    """Загрузка PDF файла в S3 и сохранение метаданных в БД"""
+    """Загрузка PDF файла в S3 и сохранение метаданных в БД
+
+    Прямая загрузка: {"action": "init", "fileName", "fileSize"} → presigned PUT URL,
+    браузер кладёт файл в бакет, затем {"action": "complete", "fileKey", "fileName", "category"}.
+    Без action — прежний режим с файлом в base64 в теле запроса (до 10 МБ).
+    """
     method = event.get('httpMethod', 'POST')
 
     if method == 'OPTIONS':
@@ -64,6 +231,12 @@ def handler(event: dict, context) -> dict:
             }
         
         body = json.loads(event.get('body', '{}'))
+        action = body.get('action')
+        if action == 'init':
+            return init_upload(tenant_id, body)
+        if action == 'complete':
+            return complete_upload(tenant_id, body)
+
         file_name = body.get('fileName')
         file_base64 = body.get('fileData')
         category = body.get('category', 'Общая')
@@ -103,51 +276,16 @@ def handler(event: dict, context) -> dict:
                 'body': json.dumps({'error': 'Файл не является PDF документом'}),
                 'isBase64Encoded': False
             }
-        file_key = f'documents/{moscow_naive().strftime("%Y%m%d_%H%M%S")}_{file_name}'
+        file_key = make_file_key(tenant_id, file_name)
 
-        s3 = boto3.client('s3',
-            endpoint_url='https://bucket.poehali.dev',
-            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
-        )
-        
-        s3.put_object(
-            Bucket='files',
+        get_s3_client().put_object(
+            Bucket=S3_BUCKET,
             Key=file_key,
             Body=file_data,
             ContentType='application/pdf'
         )
 
-        cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{file_key}"
-
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cur = conn.cursor()
-        
-        cur.execute("""
-            INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_documents (tenant_id, file_name, file_key, file_size_bytes, category, status)
-            VALUES (%s, %s, %s, %s, %s, 'processing')
-            RETURNING id
-        """, (tenant_id, file_name, file_key, file_size, category))
-        
-        doc_id = cur.fetchone()[0]
-        print(f"📄 CREATED DOCUMENT: doc_id={doc_id}, tenant_id={tenant_id}, file_name={file_name}")
-        conn.commit()
-        print(f"✅ COMMITTED to DB: doc_id={doc_id}")
-        cur.close()
-        conn.close()
-
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'documentId': doc_id,
-                'fileName': file_name,
-                'fileKey': file_key,
-                'cdnUrl': cdn_url,
-                'status': 'processing'
-            }),
-            'isBase64Encoded': False
-        }
+        return register_document(tenant_id, file_name, file_key, file_size, category)
 
     except Exception as e:
         print(f"ERROR in upload-pdf: {str(e)}")
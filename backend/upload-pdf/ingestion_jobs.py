@@ -0,0 +1,51 @@
+"""
+Постановка документов в фоновую индексацию (таблица ingestion_jobs).
+upload-pdf и reindex-embeddings только создают задачу и будят process-pdf; стадии
+fetch → extract → chunk → embed → write выполняет process-pdf (ingestion_worker.drain).
+"""
+import os
+from typing import Optional
+
+import requests
+
+PROCESS_PDF_URL = 'https://functions.poehali.dev/44b9c312-5377-4fa7-8b4c-522f4bbbf201'
+
+INGESTION_STAGES = ('fetch', 'extract', 'chunk', 'embed', 'write')
+
+
+def enqueue_job(cur, tenant_id: int, document_id: int, kind: str = 'upload',
+                batch_id: Optional[str] = None) -> Optional[int]:
+    """
+    Создаёт задачу индексации документа в транзакции вызывающего (commit — на нём).
+    Если у документа уже есть активная задача, новая не создаётся; возвращает id активной.
+    """
+    cur.execute("""
+        INSERT INTO t_p56134400_telegram_ai_bot_pdf.ingestion_jobs (tenant_id, document_id, kind, batch_id)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (document_id) WHERE status IN ('pending', 'processing') DO NOTHING
+        RETURNING id
+    """, (tenant_id, document_id, kind, batch_id))
+    row = cur.fetchone()
+    if row:
+        return row[0]
+
+    cur.execute("""
+        SELECT id FROM t_p56134400_telegram_ai_bot_pdf.ingestion_jobs
+        WHERE document_id = %s AND status IN ('pending', 'processing')
+    """, (document_id,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def kick_ingestion():
+    """Асинхронно будит process-pdf: не ждём ответа, задачи подберёт и таймер"""
+    headers = {'Content-Type': 'application/json'}
+    token = os.environ.get('CRON_SECRET_TOKEN')
+    if token:
+        headers['X-Auth-Token'] = token
+    try:
+        requests.post(f'{PROCESS_PDF_URL}?drain=1', json={}, headers=headers, timeout=(3, 0.5))
+    except requests.exceptions.ReadTimeout:
+        pass
+    except requests.exceptions.RequestException as e:
+        print(f'[ingestion] Worker kick failed: {e}')
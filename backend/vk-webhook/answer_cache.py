@@ -0,0 +1,116 @@
+"""
+Семантический кэш ответов для повторяющихся вопросов (quick_questions виджета и т.п.).
+Ключ: tenant_id + хэш итогового system prompt (шаблон + контекст RAG + модель) + chunks_version
++ gate_reason; внутри ключа ищем вопрос с близким эмбеддингом (косинус >= порога) и теми же числами.
+Новый промпт или новые документы дают другой ключ, поэтому старые ответы просто перестают находиться.
+"""
+import os
+import re
+import hashlib
+from datetime import timedelta
+from typing import List, Optional
+
+import numpy as np
+
+from embedding_codec import EMBEDDING_DTYPE, encode_embedding
+from query_embedding_cache import normalize_query
+from timezone_helper import moscow_naive
+
+ANSWER_CACHE_ENABLED = os.environ.get('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+ANSWER_CACHE_MIN_SIM = float(os.environ.get('ANSWER_CACHE_MIN_SIM', '0.97'))
+ANSWER_CACHE_TTL_HOURS = int(os.environ.get('ANSWER_CACHE_TTL_HOURS', '24'))
+ANSWER_CACHE_MAX_CANDIDATES = 50
+
+
+def is_answer_cache_enabled(tenant_overrides: dict = None) -> bool:
+    value = (tenant_overrides or {}).get('answer_cache_enabled')
+    if value is None:
+        return ANSWER_CACHE_ENABLED
+    return str(value).lower() in ('true', '1')
+
+
+def make_prompt_hash(system_prompt: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\n{system_prompt}".encode()).hexdigest()
+
+
+def _numbers(text: str) -> List[str]:
+    # "22 мая" и "23 мая" почти совпадают по эмбеддингу, но ответы у них разные
+    return re.findall(r'\d+', text)
+
+
+def _bump_stats(cur, tenant_id: int, hit: bool):
+    cur.execute("""
+        INSERT INTO t_p56134400_telegram_ai_bot_pdf.answer_cache_stats (tenant_id, hits, misses, updated_at)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (tenant_id) DO UPDATE SET
+            hits = answer_cache_stats.hits + EXCLUDED.hits,
+            misses = answer_cache_stats.misses + EXCLUDED.misses,
+            updated_at = EXCLUDED.updated_at
+    """, (tenant_id, 1 if hit else 0, 0 if hit else 1, moscow_naive()))
+
+
+def find_cached_answer(cur, tenant_id: int, prompt_hash: str, chunks_version: int, gate_reason: str,
+                       query_text: str, query_embedding) -> Optional[str]:
+    """Ранее сгенерированный ответ на семантически тот же вопрос или None"""
+    try:
+        cur.execute("""
+            SELECT id, query_text, query_embedding_bin, assistant_message
+            FROM t_p56134400_telegram_ai_bot_pdf.answer_cache
+            WHERE tenant_id = %s AND prompt_hash = %s AND chunks_version = %s
+              AND gate_reason = %s AND created_at > %s
+            ORDER BY created_at DESC
+            LIMIT %s
+        """, (tenant_id, prompt_hash, chunks_version, gate_reason,
+              moscow_naive() - timedelta(hours=ANSWER_CACHE_TTL_HOURS), ANSWER_CACHE_MAX_CANDIDATES))
+        candidates = cur.fetchall()
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = float(np.linalg.norm(query))
+        query_numbers = _numbers(normalize_query(query_text))
+
+        best_id, best_sim, best_message = None, 0.0, None
+        for cache_id, cached_text, cached_bin, cached_message in candidates:
+            if _numbers(cached_text) != query_numbers:
+                continue
+            cached = np.frombuffer(cached_bin, dtype=EMBEDDING_DTYPE)
+            if cached.shape != query.shape or query_norm == 0:
+                continue
+            cached_norm = float(np.linalg.norm(cached))
+            if cached_norm == 0:
+                continue
+            sim = float(np.dot(cached, query) / (cached_norm * query_norm))
+            if sim > best_sim:
+                best_id, best_sim, best_message = cache_id, sim, cached_message
+
+        hit = best_id is not None and best_sim >= ANSWER_CACHE_MIN_SIM
+        if hit:
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.answer_cache SET hits = hits + 1 WHERE id = %s
+            """, (best_id,))
+        _bump_stats(cur, tenant_id, hit)
+
+        print(f"[answer_cache] {'HIT' if hit else 'MISS'} tenant={tenant_id} candidates={len(candidates)} best_sim={best_sim:.4f}")
+        return best_message if hit else None
+    except Exception as e:
+        print(f"⚠️ [answer_cache] lookup failed: {e}")
+        cur.connection.rollback()
+        return None
+
+
+def store_answer(cur, tenant_id: int, prompt_hash: str, chunks_version: int, gate_reason: str,
+                 query_text: str, query_embedding, assistant_message: str):
+    try:
+        # Просроченные ответы уже не находятся: удаляем их, как StreamWriter чистит chat_streams
+        cur.execute("""
+            DELETE FROM t_p56134400_telegram_ai_bot_pdf.answer_cache
+            WHERE created_at < %s
+        """, (moscow_naive() - timedelta(hours=ANSWER_CACHE_TTL_HOURS),))
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.answer_cache
+            (tenant_id, prompt_hash, chunks_version, gate_reason, query_text, query_embedding_bin, assistant_message, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, (tenant_id, prompt_hash, chunks_version, gate_reason, normalize_query(query_text),
+              encode_embedding(list(query_embedding)), assistant_message, moscow_naive()))
+    except Exception as e:
+        print(f"⚠️ [answer_cache] store failed: {e}")
+        cur.connection.rollback()
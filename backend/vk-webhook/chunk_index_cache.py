@@ -0,0 +1,65 @@
+"""
+Тёплый кэш векторных индексов тенантов между вызовами функции.
+Ключ — tenant_id, валидность проверяется по tenants.chunks_version (один дешёвый SELECT
+вместо выгрузки всех чанков). Вытеснение LRU по суммарному объёму в байтах.
+"""
+import os
+from collections import OrderedDict
+
+from vector_search import ChunkIndex, load_tenant_index
+
+CHUNK_INDEX_CACHE_MAX_BYTES = int(os.environ.get('CHUNK_INDEX_CACHE_MB', '64')) * 1024 * 1024
+
+# tenant_id -> (chunks_version, ChunkIndex)
+_index_cache: "OrderedDict[int, tuple]" = OrderedDict()
+_cache_stats = {'bytes': 0, 'hits': 0, 'misses': 0}
+
+
+def _evict(tenant_id: int):
+    _, index = _index_cache.pop(tenant_id)
+    _cache_stats['bytes'] -= index.nbytes
+
+
+def _put(tenant_id: int, version: int, index: ChunkIndex):
+    if tenant_id in _index_cache:
+        _evict(tenant_id)
+    if index.nbytes > CHUNK_INDEX_CACHE_MAX_BYTES:
+        print(f"⚠️ [index_cache] Index for tenant {tenant_id} ({index.nbytes} bytes) exceeds cache budget, not cached")
+        return
+
+    _index_cache[tenant_id] = (version, index)
+    _cache_stats['bytes'] += index.nbytes
+
+    while _cache_stats['bytes'] > CHUNK_INDEX_CACHE_MAX_BYTES:
+        oldest_tenant_id = next(iter(_index_cache))
+        _evict(oldest_tenant_id)
+        print(f"[index_cache] Evicted tenant {oldest_tenant_id}")
+
+
+def get_chunks_version(cur, tenant_id: int) -> int:
+    cur.execute("""
+        SELECT chunks_version FROM t_p56134400_telegram_ai_bot_pdf.tenants
+        WHERE id = %s
+    """, (tenant_id,))
+    row = cur.fetchone()
+    return int(row[0]) if row and row[0] is not None else 0
+
+
+def get_tenant_index(cur, tenant_id: int) -> ChunkIndex:
+    """ChunkIndex тенанта из кэша, если chunks_version не менялась, иначе загружает заново"""
+    version = get_chunks_version(cur, tenant_id)
+
+    cached = _index_cache.get(tenant_id)
+    if cached and cached[0] == version:
+        _index_cache.move_to_end(tenant_id)
+        _cache_stats['hits'] += 1
+        print(f"[index_cache] HIT tenant={tenant_id} version={version} chunks={len(cached[1])}")
+        return cached[1]
+
+    _cache_stats['misses'] += 1
+    index = load_tenant_index(cur, tenant_id)
+    _put(tenant_id, version, index)
+    print(f"[index_cache] MISS tenant={tenant_id} version={version} chunks={len(index)}, "
+          f"cache={len(_index_cache)} tenants / {_cache_stats['bytes']} bytes")
+    return index
+
@@ -8,10 +8,118 @@ import re
 
 sys.path.append('/function/code')
 from api_keys_helper import get_tenant_api_key, get_tenant_id_by_secret
-from formatting_helper import get_formatting_settings, format_with_settings
+from db_pool import pooled_request
+from token_logger import flushes_token_usage
+from chat_pipeline import run_chat, ChatPipelineError
+from webhook_queue import enqueue, update_key, kick_drain, drain, is_drain_authorized, is_timer_event
 
+VK_WEBHOOK_URL = 'https://functions.poehali.dev/b008537a-2081-4b03-aaff-b39e8408818a'
+
+
+def drain_queue(event: dict) -> dict:
+    """Фоновый разбор очереди: асинхронный вызов из handler (?drain=1) или Timer Trigger
+    (cron expression */5 * * * ? * — подбирает задачи, если вызов потерялся, и повторы)"""
+    if not is_drain_authorized(event):
+        return {
+            'statusCode': 403,
+            'body': json.dumps({'success': False, 'error': 'Unauthorized: invalid cron token'})
+        }
+    stats = drain('vk', lambda job: process_update(job['tenant_id'], job['payload']['body'], job_id=job['id']))
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({'success': True, **stats}),
+        'isBase64Encoded': False
+    }
+
+
+def process_update(tenant_id: int, body: dict, job_id: int):
+    """Событие message_new из очереди: распознавание речи, ответ chat и отправка в VK.
+    Исключение — задача повторится позже."""
+    obj = body.get('object', {})
+    message = obj.get('message', {})
+    user_id = message.get('from_id')
+    user_message = message.get('text', '')
+    
+    has_audio = 'attachments' in message and any(att.get('type') in ['audio_message', 'video'] for att in message.get('attachments', []))
+
+    if not user_message and not has_audio:
+        return
+    
+    if has_audio and not user_message:
+        speech_url = 'https://functions.poehali.dev/66ab8736-2781-4c63-9c2e-09f2061f7c7a'
+        
+        try:
+            check_response = requests.get(
+                speech_url,
+                headers={'X-Tenant-Id': str(tenant_id)},
+                timeout=5
+            )
+            check_data = check_response.json()
+            
+            if not check_data.get('enabled', False):
+                access_token, error = get_tenant_api_key(tenant_id, 'vk', 'access_token')
+                if not error:
+                    vk_api_url = 'https://api.vk.com/method/messages.send'
+                    requests.post(
+                        vk_api_url,
+                        data={
+                            'user_id': user_id,
+                            'message': 'Извините, я понимаю только текстовые сообщения.',
+                            'access_token': access_token,
+                            'v': '5.131',
+                            'random_id': 0
+                        },
+                        timeout=10
+                    )
+                
+                return
+        except Exception as e:
+            print(f'[vk-webhook] Speech check error: {e}')
+            return
+
+    session_id = f"vk-{user_id}"
+    try:
+        chat_data = run_chat(tenant_id, session_id, user_message, 'vk', request_id=f'vk-job-{job_id}')
+        ai_message = chat_data.get('message') or 'Извините, не могу ответить'
+        # Форматирование под channel='vk' уже применено в пайплайне чата
+    except ChatPipelineError as e:
+        print(f'[vk-webhook] Chat pipeline error: {e}')
+        ai_message = 'Извините, сервис временно недоступен. Попробуйте позже.'
+    except Exception as e:
+        print(f'[vk-webhook] Chat pipeline failure: {e}')
+        ai_message = 'Извините, произошла ошибка. Попробуйте позже.'
+
+    group_token, error = get_tenant_api_key(tenant_id, 'vk', 'group_token')
+    if error:
+        print(f'[vk-webhook] Group token not configured for tenant={tenant_id}, dropping update')
+        return
+
+    vk_api_url = 'https://api.vk.com/method/messages.send'
+    vk_response = requests.post(
+        vk_api_url,
+        data={
+            'user_id': user_id,
+            'message': ai_message,
+            'random_id': 0,
+            'access_token': group_token,
+            'v': '5.131'
+        },
+        timeout=10
+    )
+
+    vk_data = vk_response.json()
+    if 'error' in vk_data:
+        raise Exception(f'VK API error: {vk_data["error"]["error_msg"]}')
+
+
+@pooled_request
+@flushes_token_usage
 def handler(event: dict, context) -> dict:
     """Webhook для VK-бота: принимает сообщения и отвечает через AI-консьержа"""
+    if is_timer_event(event):
+        return drain_queue(event)
+
     method = event.get('httpMethod', 'POST')
 
     if method == 'OPTIONS':
@@ -34,12 +142,15 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
 
+    query_params = event.get('queryStringParameters', {}) or {}
+    if query_params.get('drain'):
+        return drain_queue(event)
+
     try:
         body = json.loads(event.get('body', '{}'))
         
         # Определяем tenant_id по secret из VK или query параметра
         received_secret = body.get('secret', '')
-        query_params = event.get('queryStringParameters', {}) or {}
         tenant_id_param = query_params.get('tenant_id', '')
         
         if received_secret:
@@ -78,111 +189,19 @@ def handler(event: dict, context) -> dict:
             }
 
         if event_type == 'message_new':
-            obj = body.get('object', {})
-            message = obj.get('message', {})
-            user_id = message.get('from_id')
-            user_message = message.get('text', '')
-            
-            has_audio = 'attachments' in message and any(att.get('type') in ['audio_message', 'video'] for att in message.get('attachments', []))
-
-            if not user_message and not has_audio:
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'text/plain', 'Access-Control-Allow-Origin': '*'},
-                    'body': 'ok',
-                    'isBase64Encoded': False
-                }
-            
-            if has_audio and not user_message:
-                speech_url = 'https://functions.poehali.dev/66ab8736-2781-4c63-9c2e-09f2061f7c7a'
-                
-                try:
-                    check_response = requests.get(
-                        speech_url,
-                        headers={'X-Tenant-Id': str(tenant_id)},
-                        timeout=5
-                    )
-                    check_data = check_response.json()
-                    
-                    if not check_data.get('enabled', False):
-                        access_token, error = get_tenant_api_key(tenant_id, 'vk', 'access_token')
-                        if not error:
-                            vk_api_url = 'https://api.vk.com/method/messages.send'
-                            requests.post(
-                                vk_api_url,
-                                data={
-                                    'user_id': user_id,
-                                    'message': 'Извините, я понимаю только текстовые сообщения.',
-                                    'access_token': access_token,
-                                    'v': '5.131',
-                                    'random_id': 0
-                                },
-                                timeout=10
-                            )
-                        
-                        return {
-                            'statusCode': 200,
-                            'headers': {'Content-Type': 'text/plain', 'Access-Control-Allow-Origin': '*'},
-                            'body': 'ok',
-                            'isBase64Encoded': False
-                        }
-                except Exception as e:
-                    print(f'[vk-webhook] Speech check error: {e}')
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'text/plain', 'Access-Control-Allow-Origin': '*'},
-                        'body': 'ok',
-                        'isBase64Encoded': False
-                    }
-
-            session_id = f"vk-{user_id}"
-            chat_function_url = 'https://functions.poehali.dev/7b58f4fb-5db0-4f85-bb3b-55bafa4cbf73'
-
-            try:
-                chat_response = requests.post(
-                    chat_function_url,
-                    json={
-                        'message': user_message,
-                        'sessionId': session_id,
-                        'tenantId': tenant_id,
-                        'channel': 'vk'
-                    },
-                    headers={'Content-Type': 'application/json'},
-                    timeout=60
-                )
-                chat_response.raise_for_status()
-                chat_data = chat_response.json()
-                ai_message = chat_data.get('message', 'Извините, не могу ответить')
-                
-                # Форматирование уже применено в /chat через channel='vk'
-                # Дополнительное форматирование не нужно
-                
-            except requests.exceptions.Timeout:
-                ai_message = 'Извините, сервис временно недоступен. Попробуйте позже.'
-            except requests.exceptions.RequestException as e:
-                print(f'Chat function error: {e}')
-                ai_message = 'Извините, произошла ошибка. Попробуйте позже.'
-
-            group_token, error = get_tenant_api_key(tenant_id, 'vk', 'group_token')
-            if error:
-                return error
-
-            vk_api_url = 'https://api.vk.com/method/messages.send'
-            vk_response = requests.post(
-                vk_api_url,
-                data={
-                    'user_id': user_id,
-                    'message': ai_message,
-                    'random_id': 0,
-                    'access_token': group_token,
-                    'v': '5.131'
-                },
-                timeout=10
+            # Апдейт уходит в очередь, VK получает ok сразу и не переотправляет событие
+            message = body.get('object', {}).get('message', {})
+            created = enqueue(
+                'vk', tenant_id, message.get('from_id'),
+                update_key(body.get('event_id')) if body.get('event_id')
+                else update_key(message.get('peer_id'), message.get('conversation_message_id'), message.get('id')),
+                # secret группы в очередь не сохраняем
+                {'body': {key: value for key, value in body.items() if key != 'secret'}}
             )
-
-            vk_data = vk_response.json()
-            if 'error' in vk_data:
-                raise Exception(f'VK API error: {vk_data["error"]["error_msg"]}')
+            if created:
+                kick_drain(VK_WEBHOOK_URL)
+            else:
+                print(f'[vk-webhook] Duplicate event {body.get("event_id")}, skipped')
 
             return {
                 'statusCode': 200,
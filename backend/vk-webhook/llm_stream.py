@@ -0,0 +1,166 @@
+"""
+Потоковая генерация ответа для виджета и Telegram.
+Функция отвечает одним JSON, поэтому токены от провайдера не уходят клиенту напрямую:
+они накапливаются в chat_streams (запись не чаще STREAM_FLUSH_INTERVAL_SEC), а виджет
+параллельно с основным POST опрашивает action=stream_poll и рисует ответ по мере генерации
+(telegram-webhook читает chat_streams сам и правит сообщение через editMessageText).
+"""
+import os
+import json
+import time
+from typing import Callable, Optional, Tuple
+
+import httpx
+
+from provider_clients import get_http_client, PROVIDER_CONNECT_TIMEOUT
+
+YANDEX_COMPLETION_URL = 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion'
+
+STREAM_FLUSH_INTERVAL_SEC = float(os.environ.get('STREAM_FLUSH_INTERVAL_SEC', '0.3'))
+STREAM_TTL_MINUTES = int(os.environ.get('STREAM_TTL_MINUTES', '60'))
+STREAM_CHANNELS = ('widget', 'telegram')
+
+OnDelta = Optional[Callable[[str], None]]
+
+
+class YandexCompletionError(Exception):
+    pass
+
+
+def complete_openai_compatible(client, on_delta: OnDelta = None, **create_kwargs) -> Tuple[str, Optional[int]]:
+    """
+    chat.completions.create для OpenRouter/DeepSeek/ProxyAPI.
+    С on_delta запрос идёт со stream=True, и on_delta получает весь накопленный текст.
+    Возвращает (текст ответа, total_tokens или None).
+    """
+    if on_delta is None:
+        response = client.chat.completions.create(**create_kwargs)
+        usage = getattr(response, 'usage', None)
+        return response.choices[0].message.content, (usage.total_tokens if usage else None)
+
+    stream = client.chat.completions.create(
+        stream=True,
+        stream_options={'include_usage': True},
+        **create_kwargs
+    )
+    parts = []
+    total_tokens = None
+    for chunk in stream:
+        if getattr(chunk, 'usage', None):
+            total_tokens = chunk.usage.total_tokens
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            on_delta(''.join(parts))
+    return ''.join(parts), total_tokens
+
+
+def complete_yandex(api_key: str, payload: dict, on_delta: OnDelta = None,
+                    timeout: Optional[float] = None) -> Tuple[str, int]:
+    """
+    Yandex foundationModels completion. В потоковом режиме API присылает построчно JSON
+    с полным текстом на текущий момент, последний фрагмент содержит usage.
+    timeout — таймаут чтения (сек), по умолчанию таймаут провайдера из provider_clients.
+    Возвращает (текст ответа, totalTokens).
+    """
+    headers = {
+        'Authorization': f'Api-Key {api_key}',
+        'Content-Type': 'application/json'
+    }
+
+    client = get_http_client('yandex')
+    request_timeout = httpx.Timeout(timeout, connect=min(PROVIDER_CONNECT_TIMEOUT, timeout)) if timeout else client.timeout
+    if on_delta is None:
+        try:
+            response = client.post(YANDEX_COMPLETION_URL, headers=headers, json=payload, timeout=request_timeout)
+        except httpx.TimeoutException as e:
+            raise YandexCompletionError(f'timeout: {e}')
+        if response.status_code != 200:
+            raise YandexCompletionError(response.text)
+        result = response.json().get('result', {})
+        return result['alternatives'][0]['message']['text'], int(result.get('usage', {}).get('totalTokens', 0))
+
+    payload = dict(payload, completionOptions=dict(payload.get('completionOptions', {}), stream=True))
+    text = ''
+    total_tokens = 0
+    with client.stream('POST', YANDEX_COMPLETION_URL, headers=headers, json=payload, timeout=request_timeout) as response:
+        if response.status_code != 200:
+            response.read()
+            raise YandexCompletionError(response.text)
+        for line in response.iter_lines():
+            if not line:
+                continue
+            result = json.loads(line).get('result', {})
+            alternatives = result.get('alternatives') or []
+            if alternatives and alternatives[0].get('message', {}).get('text') is not None:
+                text = alternatives[0]['message']['text']
+                on_delta(text)
+            if result.get('usage'):
+                total_tokens = int(result['usage'].get('totalTokens', 0))
+    return text, total_tokens
+
+
+class StreamWriter:
+    """Пишет накопленный текст ответа в chat_streams с троттлингом по времени"""
+
+    def __init__(self, conn, stream_id: str, tenant_id: int, session_id: str,
+                 format_partial: Optional[Callable[[str], str]] = None):
+        self.conn = conn
+        self.stream_id = stream_id
+        self.format_partial = format_partial
+        self.last_flush = 0.0
+        self.text = ''
+
+        cur = conn.cursor()
+        cur.execute(f"""
+            DELETE FROM t_p56134400_telegram_ai_bot_pdf.chat_streams
+            WHERE created_at < NOW() - INTERVAL '{STREAM_TTL_MINUTES} minutes'
+        """)
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.chat_streams (stream_id, tenant_id, session_id, content, status)
+            VALUES (%s, %s, %s, '', 'streaming')
+            ON CONFLICT (stream_id) DO UPDATE SET content = '', status = 'streaming', updated_at = NOW()
+        """, (stream_id, tenant_id, session_id))
+        conn.commit()
+        cur.close()
+
+    def _write(self, content: str, status: str):
+        cur = self.conn.cursor()
+        cur.execute("""
+            UPDATE t_p56134400_telegram_ai_bot_pdf.chat_streams
+            SET content = %s, status = %s, updated_at = NOW()
+            WHERE stream_id = %s
+        """, (content, status, self.stream_id))
+        self.conn.commit()
+        cur.close()
+        self.last_flush = time.monotonic()
+
+    def update(self, text: str):
+        """on_delta для complete_*: сбрасывает в БД не чаще STREAM_FLUSH_INTERVAL_SEC"""
+        self.text = text
+        if time.monotonic() - self.last_flush >= STREAM_FLUSH_INTERVAL_SEC:
+            self._write(self.format_partial(text) if self.format_partial else text, 'streaming')
+
+    def finish(self, final_text: str):
+        self._write(final_text, 'done')
+
+    def fail(self):
+        try:
+            self.conn.rollback()
+            self._write(self.text, 'error')
+        except Exception as e:
+            print(f"⚠️ [llm_stream] Cannot mark stream {self.stream_id} as failed: {e}")
+
+
+def poll_stream(cur, stream_id: str) -> Optional[dict]:
+    """Текущее состояние потока для action=stream_poll"""
+    cur.execute("""
+        SELECT content, status FROM t_p56134400_telegram_ai_bot_pdf.chat_streams
+        WHERE stream_id = %s
+    """, (stream_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return {'content': row[0], 'status': row[1]}
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк извлечения текста PDF в process-pdf: прежний последовательный цикл PyPDF2 со
+склейкой текста через += против pdf_extract.iter_page_texts на каждом доступном бэкенде
+(pymupdf, pdfminer, PyPDF2) и пула процессов по диапазонам страниц с бэкендом, выбранным
+select_extractor, на синтетическом прайс-листе.
+
+Запуск: python3 benchmark_pdf_extract.py [--pages 300] [--workers 4] [--repeat 3]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'process-pdf'))
+import PyPDF2
+from io import BytesIO
+from pdf_extract import EXTRACTORS, iter_page_texts, select_extractor
+from chunker import build_chunks, get_chunking_settings
+
+ROOM_TYPES = ['Standard', 'Superior', 'Deluxe', 'Junior Suite', 'Suite', 'Family Room', 'Studio']
+TABLE_COLUMNS_X = (40, 130, 260, 320)
+
+
+def _escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def make_price_list_pdf(pages: int, seed: int = 42) -> bytes:
+    """PDF из pages страниц: заголовок, абзац правил и таблица тарифов (Helvetica, без внешних библиотек)"""
+    rng = random.Random(seed)
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # Pages — после того, как известны номера страниц
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    page_ids = []
+    for page_no in range(1, pages + 1):
+        # Абзацы — строками, таблица — отдельными ячейками по колонкам, как в выгрузках из Excel/Word
+        lines = [[f'PRICE LIST SECTION {page_no}'], []]
+        lines += [
+            [f'Check-in from 14:00, check-out until 12:00. Rule {page_no}.{i}: '
+             f'children under {rng.randint(3, 7)} stay free, extra bed {rng.randint(10, 40)} EUR per night.']
+            for i in range(4)
+        ]
+        lines.append([])
+        for _ in range(28):
+            month = rng.randint(1, 12)
+            lines.append([rng.choice(ROOM_TYPES), f'01.{month:02d}.2026 - 28.{month:02d}.2026',
+                          f'{rng.randint(50, 400)} EUR', f'{rng.randint(1, 4)} guests'])
+
+        content = []
+        for line_no, cells in enumerate(lines):
+            for x, cell in zip(TABLE_COLUMNS_X, cells):
+                content.append(f'BT /F1 9 Tf {x} {800 - 11 * line_no} Td ({_escape(cell)}) Tj ET')
+        stream = '\n'.join(content).encode('latin-1')
+
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        content_id = len(objects)
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+            b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % content_id
+        )
+        page_ids.append(len(objects))
+
+    kids = ' '.join(f'{page_id} 0 R' for page_id in page_ids).encode('ascii')
+    objects[1] = b'<< /Type /Pages /Kids [' + kids + b'] /Count %d >>' % pages
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for obj_no, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % obj_no + body + b'\nendobj\n'
+    xref_at = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref_at)
+    return bytes(out)
+
+
+def legacy_extract(pdf_data: bytes) -> str:
+    """Прежняя реализация process-pdf: весь документ в BytesIO, склейка через +="""
+    pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_data))
+    text = ''
+    for page in pdf_reader.pages:
+        text += page.extract_text() + '\n\n'
+    return text
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    pdf_data = make_price_list_pdf(args.pages)
+    settings = get_chunking_settings(None)
+    print(f"pages={args.pages}, pdf={len(pdf_data) / 1024:.0f} KB, workers={args.workers}, cpu={os.cpu_count()}")
+
+    choice = select_extractor(pdf_data, args.pages)
+    print(f"auto: {choice['backend']} (layout={choice['layout']}, reason={choice['reason']}, "
+          f"table_score={choice['table_score']})")
+
+    legacy_time, legacy_text = timed(lambda: legacy_extract(pdf_data), args.repeat)
+    rows = [('legacy (PyPDF2 loop, text +=)', legacy_time, '-')]
+    for name, extractor in EXTRACTORS.items():
+        layout = extractor.layout
+        elapsed, chunks = timed(
+            lambda: build_chunks(iter_page_texts(pdf_data, workers=1, backend=name, layout=layout), settings),
+            args.repeat
+        )
+        rows.append((f'{name}{" layout" if layout else ""}, 1 process + chunk', elapsed, len(chunks)))
+
+    backend, layout = choice['backend'], choice['layout']
+    seq_chunks = build_chunks(iter_page_texts(pdf_data, workers=1, backend=backend, layout=layout), settings)
+    # Первый проход поднимает пул процессов, в замер не идёт
+    build_chunks(iter_page_texts(pdf_data, workers=args.workers, backend=backend, layout=layout), settings)
+    par_time, par_chunks = timed(
+        lambda: build_chunks(iter_page_texts(pdf_data, workers=args.workers, backend=backend, layout=layout), settings),
+        args.repeat
+    )
+    rows.append((f'{backend}, {args.workers} processes + chunk', par_time, len(par_chunks)))
+    assert [c['text'] for c in seq_chunks] == [c['text'] for c in par_chunks], 'chunks mismatch'
+
+    print(f"{'variant':<40} | {'time, s':>8} | {'pages/s':>8} | {'x':>5} | {'chunks':>6}")
+    print('-' * 79)
+    for name, elapsed, chunks_count in rows:
+        print(f"{name:<40} | {elapsed:>8.2f} | {args.pages / elapsed:>8.0f} | "
+              f"{legacy_time / elapsed:>4.1f}x | {chunks_count:>6}")
+
+    print("\nпроба бэкендов (непробельные символы на пробных страницах):")
+    for name, result in choice['probe'].items():
+        print(f"  {name:<10} {result['pages_per_sec']:>8} pages/s  {result['chars']:>7} chars")
+    print(f"legacy chars: {len(''.join(legacy_text.split()))}; legacy = только извлечение, без нарезки")
+
+
+if __name__ == '__main__':
+    main()
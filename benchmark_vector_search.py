@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк векторного поиска чата: старый pure-Python cosine_similarity
+против NumPy-индекса из backend/chat/vector_search.py на 1k / 10k / 100k чанков.
+
+Запуск: python3 benchmark_vector_search.py [--dim 256] [--sizes 1000,10000,100000]
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'chat'))
+from vector_search import build_index
+from embedding_codec import encode_embedding
+
+
+def cosine_similarity(vec1, vec2):
+    """Копия прежней реализации из chat/index.py"""
+    dot_product = sum(a * b for a, b in zip(vec1, vec2))
+    magnitude1 = math.sqrt(sum(a * a for a in vec1))
+    magnitude2 = math.sqrt(sum(b * b for b in vec2))
+    if magnitude1 == 0 or magnitude2 == 0:
+        return 0
+    return dot_product / (magnitude1 * magnitude2)
+
+
+def legacy_search(rows, query_embedding, top_k):
+    scored_chunks = []
+    for chunk_text, embedding_text in rows:
+        chunk_embedding = json.loads(embedding_text)
+        scored_chunks.append((chunk_text, cosine_similarity(query_embedding, chunk_embedding)))
+    scored_chunks.sort(key=lambda x: x[1], reverse=True)
+    return scored_chunks[:top_k]
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--top-k', type=int, default=15)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    query = [rng.uniform(-1, 1) for _ in range(args.dim)]
+
+    print(f"dim={args.dim}, top_k={args.top_k}")
+    print(f"{'chunks':>8} | {'legacy, ms':>11} | {'build json':>10} | {'build bin':>10} | {'search, ms':>10} | {'search x':>8} | {'bin+search x':>12}")
+    print('-' * 89)
+
+    for size in [int(s) for s in args.sizes.split(',')]:
+        vectors = [[rng.uniform(-1, 1) for _ in range(args.dim)] for _ in range(size)]
+        legacy_rows = [(f"chunk {i}", json.dumps(v)) for i, v in enumerate(vectors)]
+        json_rows = [(text, None, emb) for text, emb in legacy_rows]
+        bin_rows = [(f"chunk {i}", encode_embedding(v), None) for i, v in enumerate(vectors)]
+
+        legacy_time, legacy_top = timed(lambda: legacy_search(legacy_rows, query, args.top_k), 1 if size >= 100000 else 3)
+        build_json_time, _ = timed(lambda: build_index(json_rows), 1)
+        build_bin_time, index = timed(lambda: build_index(bin_rows), 3)
+        search_time, numpy_top = timed(lambda: index.search(query, args.top_k), 20)
+
+        assert [t for t, _ in legacy_top] == [t for t, _ in numpy_top], 'top-k mismatch'
+
+        print(f"{size:>8} | {legacy_time * 1000:>11.1f} | {build_json_time * 1000:>10.1f} | "
+              f"{build_bin_time * 1000:>10.1f} | {search_time * 1000:>10.2f} | "
+              f"{legacy_time / search_time:>7.0f}x | {legacy_time / (build_bin_time + search_time):>11.1f}x")
+
+    print("\nlegacy = json.loads + pure-Python cosine + sort по всем чанкам")
+    print("build json = json.loads + сборка float32-матрицы и норм (строки без embedding_bin)")
+    print("build bin  = np.frombuffer из embedding_bin + сборка матрицы и норм")
+    print("search     = matvec + argpartition top-k")
+    print("bin+search — стоимость запроса, пока индекс собирается заново на каждый запрос")
+
+
+if __name__ == '__main__':
+    main()
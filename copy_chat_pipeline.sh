@@ -0,0 +1,59 @@
+#!/bin/bash
+
+# Пайплайн чата (chat_pipeline.run_chat и его модули) вызывается webhook мессенджеров
+# напрямую, поэтому модули chat копируются в каждую такую функцию.
+# Источник истины — backend/chat (и backend/shared для общих хелперов).
+
+functions=(
+  "telegram-webhook"
+  "vk-webhook"
+  "max-webhook"
+)
+
+chat_modules=(
+  "chat_pipeline.py"
+  "answer_cache.py"
+  "chunk_index_cache.py"
+  "embedding_codec.py"
+  "llm_router.py"
+  "llm_stream.py"
+  "openrouter_models.py"
+  "pgvector_helper.py"
+  "provider_clients.py"
+  "quality_gate.py"
+  "query_embedding_cache.py"
+  "system_prompt.py"
+  "tariff_search.py"
+  "tenant_context.py"
+  "timezone_helper.py"
+  "token_logger.py"
+  "vector_search.py"
+)
+
+shared_modules=(
+  "api_keys_helper.py"
+  "db_pool.py"
+  "formatting_helper.py"
+  "usage_buffer.py"
+)
+
+# Общие хелперы сначала обновляем в самом chat
+for module in "${shared_modules[@]}"; do
+  cp "backend/shared/$module" "backend/chat/$module"
+done
+
+for func in "${functions[@]}"; do
+  if [ -d "backend/$func" ]; then
+    echo "Copying chat pipeline to backend/$func/"
+    for module in "${chat_modules[@]}"; do
+      cp "backend/chat/$module" "backend/$func/$module"
+    done
+    for module in "${shared_modules[@]}"; do
+      cp "backend/shared/$module" "backend/$func/$module"
+    done
+  else
+    echo "WARNING: backend/$func/ not found"
+  fi
+done
+
+echo "Done! Chat pipeline copied to ${#functions[@]} functions"
@@ -0,0 +1,23 @@
+#!/bin/bash
+
+# Список функций, которые меняют настройки, закэшированные в chat
+functions=(
+  "manage-api-keys"
+  "manage-embeddings"
+  "manage-formatting-settings"
+  "manage-proxy-settings"
+  "update-ai-settings"
+  "update-quality-gate-settings"
+)
+
+# Копируем settings_version.py во все функции
+for func in "${functions[@]}"; do
+  if [ -d "backend/$func" ]; then
+    echo "Copying to backend/$func/"
+    cp backend/shared/settings_version.py "backend/$func/settings_version.py"
+  else
+    echo "WARNING: backend/$func/ not found"
+  fi
+done
+
+echo "Done! Updated settings_version.py in ${#functions[@]} functions"
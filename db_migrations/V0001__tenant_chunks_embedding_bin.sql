@@ -0,0 +1,17 @@
+-- Бинарное хранение эмбеддингов чанков: float32 big-endian (float4send) вместо JSON-текста.
+-- Для 256-мерных векторов Yandex это ~1 КБ против ~4-5 КБ JSON на строку.
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+    ADD COLUMN IF NOT EXISTS embedding_bin BYTEA;
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_chunks.embedding_bin
+    IS 'Эмбеддинг чанка: float32 big-endian подряд (формат float4send), читается через np.frombuffer(..., ''>f4'')';
+
+-- Backfill из существующего JSON
+UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_chunks c
+SET embedding_bin = (
+    SELECT string_agg(float4send(e.value::real), ''::bytea ORDER BY e.ord)
+    FROM jsonb_array_elements_text(c.embedding_text::jsonb) WITH ORDINALITY AS e(value, ord)
+)
+WHERE c.embedding_bin IS NULL
+  AND c.embedding_text IS NOT NULL;
@@ -0,0 +1,29 @@
+-- Опциональный ANN-поиск по чанкам через pgvector (HNSW, косинусное расстояние).
+-- Если расширение на сервере недоступно, миграция ничего не делает и чат остаётся на Python-скане.
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'vector') THEN
+        CREATE EXTENSION IF NOT EXISTS vector;
+
+        EXECUTE 'ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+                 ADD COLUMN IF NOT EXISTS embedding_vec vector(256)';
+
+        -- Backfill из JSON (формат [x, y, ...] pgvector принимает как есть)
+        EXECUTE 'UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+                 SET embedding_vec = embedding_text::vector
+                 WHERE embedding_vec IS NULL
+                   AND embedding_text IS NOT NULL
+                   AND jsonb_array_length(embedding_text::jsonb) = 256';
+
+        EXECUTE 'CREATE INDEX IF NOT EXISTS tenant_chunks_embedding_vec_hnsw_idx
+                 ON t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+                 USING hnsw (embedding_vec vector_cosine_ops)';
+    ELSE
+        RAISE NOTICE 'pgvector is not available, skipping embedding_vec column';
+    END IF;
+END $$;
+
+-- Фильтр по тенанту нужен и Python-скану, и ANN-запросу
+CREATE INDEX IF NOT EXISTS tenant_chunks_tenant_id_idx
+    ON t_p56134400_telegram_ai_bot_pdf.tenant_chunks (tenant_id);
@@ -0,0 +1,8 @@
+-- Версия набора чанков тенанта. Увеличивается при любом изменении tenant_chunks
+-- (process-pdf, delete-pdf, cleanup-embeddings) и инвалидирует тёплый кэш индекса в chat.
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenants
+    ADD COLUMN IF NOT EXISTS chunks_version BIGINT NOT NULL DEFAULT 0;
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenants.chunks_version
+    IS 'Версия tenant_chunks тенанта, инкрементируется при индексации/удалении документов';
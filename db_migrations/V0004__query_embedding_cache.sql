@@ -0,0 +1,14 @@
+-- Персистентный кэш эмбеддингов пользовательских запросов (второй уровень после in-process LRU в chat).
+-- Ключ: sha256(modelUri + нормализованный enriched_query), вектор в формате embedding_bin (float32 BE).
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.query_embedding_cache (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    model_uri VARCHAR(255) NOT NULL,
+    query_text TEXT NOT NULL,
+    embedding_bin BYTEA NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS query_embedding_cache_created_at_idx
+    ON t_p56134400_telegram_ai_bot_pdf.query_embedding_cache (created_at);
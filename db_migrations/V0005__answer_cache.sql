@@ -0,0 +1,26 @@
+-- Семантический кэш ответов чата по тенанту.
+-- Ответ переиспользуется, если совпадают хэш итогового system prompt (шаблон + контекст RAG + модель),
+-- версия корпуса (tenants.chunks_version), результат quality gate, а эмбеддинг вопроса близок по косинусу.
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.answer_cache (
+    id SERIAL PRIMARY KEY,
+    tenant_id INTEGER NOT NULL,
+    prompt_hash VARCHAR(64) NOT NULL,
+    chunks_version BIGINT NOT NULL DEFAULT 0,
+    gate_reason VARCHAR(100),
+    query_text TEXT NOT NULL,
+    query_embedding_bin BYTEA NOT NULL,
+    assistant_message TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS answer_cache_lookup_idx
+    ON t_p56134400_telegram_ai_bot_pdf.answer_cache (tenant_id, prompt_hash, chunks_version);
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.answer_cache_stats (
+    tenant_id INTEGER PRIMARY KEY,
+    hits BIGINT NOT NULL DEFAULT 0,
+    misses BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,9 @@
+-- Нарезка документов по структуре (страницы/абзацы/предложения) с перекрытием.
+-- Настройки на тенанта: {"strategy": "structured"|"fixed", "target_size": 1000, "overlap": 150}
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_settings
+    ADD COLUMN IF NOT EXISTS chunking_settings JSONB;
+
+-- Метаданные чанка: {"page_start": 1, "page_end": 2, "heading": "Правила проживания"}
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+    ADD COLUMN IF NOT EXISTS chunk_metadata JSONB;
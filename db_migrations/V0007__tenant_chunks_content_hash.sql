@@ -0,0 +1,10 @@
+-- Хэш содержимого чанка: sha256(провайдер:модель эмбеддинга + текст).
+-- process-pdf по нему переиспользует уже посчитанные векторы и ходит в API
+-- только за новыми или изменившимися чанками.
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+    ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+
+CREATE INDEX IF NOT EXISTS tenant_chunks_tenant_hash_idx
+    ON t_p56134400_telegram_ai_bot_pdf.tenant_chunks (tenant_id, content_hash)
+    WHERE content_hash IS NOT NULL;
@@ -0,0 +1,5 @@
+-- Версия настроек тенанта: chat держит в памяти контекст тенанта (настройки ИИ, прокси,
+-- API ключи, форматирование) и перечитывает его, когда update-*-settings поднимают версию.
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenants
+    ADD COLUMN IF NOT EXISTS settings_version BIGINT NOT NULL DEFAULT 0;
@@ -0,0 +1,15 @@
+-- Потоковые ответы виджета: chat пишет сюда накопленный текст ответа по мере генерации,
+-- виджет опрашивает его через action=stream_poll. Строки старше часа удаляет сам chat.
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.chat_streams (
+    stream_id VARCHAR(64) PRIMARY KEY,
+    tenant_id INTEGER NOT NULL,
+    session_id VARCHAR(255),
+    content TEXT NOT NULL DEFAULT '',
+    status VARCHAR(20) NOT NULL DEFAULT 'streaming',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS chat_streams_created_at_idx
+    ON t_p56134400_telegram_ai_bot_pdf.chat_streams (created_at);
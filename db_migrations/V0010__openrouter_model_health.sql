@@ -0,0 +1,20 @@
+-- Здоровье бесплатных моделей OpenRouter: openrouter-model-health по таймеру опрашивает
+-- кандидатов каждой группы (friendly_name) коротким запросом, chat выбирает самую быструю
+-- здоровую модель группы из этой таблицы и не ходит за каталогом в запросе пользователя.
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.openrouter_model_health (
+    model_id VARCHAR(255) PRIMARY KEY,
+    friendly_name VARCHAR(100) NOT NULL,
+    is_listed BOOLEAN NOT NULL DEFAULT TRUE,
+    probes INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    ewma_latency_ms REAL,
+    error_rate REAL NOT NULL DEFAULT 0,
+    last_status INTEGER,
+    last_error TEXT,
+    last_probe_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS openrouter_model_health_friendly_idx
+    ON t_p56134400_telegram_ai_bot_pdf.openrouter_model_health (friendly_name);
@@ -0,0 +1,34 @@
+-- Очередь входящих апдейтов telegram/vk/max: webhook только кладёт апдейт сюда и отвечает 200,
+-- обработку (распознавание речи, chat, отправка ответа) делает drain в фоне.
+-- Уникальный (channel, tenant_id, update_id) отсекает повторные доставки одного апдейта.
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.webhook_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    channel VARCHAR(20) NOT NULL,
+    tenant_id INTEGER NOT NULL,
+    chat_key VARCHAR(64) NOT NULL,
+    update_id VARCHAR(64) NOT NULL,
+    payload JSONB NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_at TIMESTAMP,
+    locked_by VARCHAR(64),
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    UNIQUE (channel, tenant_id, update_id)
+);
+
+-- Выбор следующей задачи канала и проверка очереди чата
+CREATE INDEX IF NOT EXISTS webhook_jobs_pending_idx
+    ON t_p56134400_telegram_ai_bot_pdf.webhook_jobs (channel, id)
+    WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS webhook_jobs_chat_idx
+    ON t_p56134400_telegram_ai_bot_pdf.webhook_jobs (channel, tenant_id, chat_key, id)
+    WHERE status IN ('pending', 'processing');
+
+CREATE INDEX IF NOT EXISTS webhook_jobs_tenant_processing_idx
+    ON t_p56134400_telegram_ai_bot_pdf.webhook_jobs (tenant_id)
+    WHERE status = 'processing';
@@ -0,0 +1,47 @@
+-- Фоновая индексация документов: upload-pdf и reindex-embeddings ставят задачу, process-pdf
+-- проводит её по стадиям fetch → extract → chunk → embed → write.
+-- checkpoint хранит результат пройденных стадий (тексты страниц, чанки, посчитанные векторы),
+-- поэтому после падения или нехватки времени задача продолжается с последней стадии.
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.ingestion_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    tenant_id INTEGER NOT NULL,
+    document_id INTEGER NOT NULL,
+    kind VARCHAR(20) NOT NULL DEFAULT 'upload',
+    batch_id VARCHAR(64),
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    stage VARCHAR(20) NOT NULL DEFAULT 'fetch',
+    stage_done INTEGER NOT NULL DEFAULT 0,
+    stage_total INTEGER NOT NULL DEFAULT 0,
+    checkpoint JSONB,
+    metrics JSONB NOT NULL DEFAULT '{}'::jsonb,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_at TIMESTAMP,
+    locked_by VARCHAR(64),
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Не больше одной активной задачи на документ
+CREATE UNIQUE INDEX IF NOT EXISTS ingestion_jobs_active_document_idx
+    ON t_p56134400_telegram_ai_bot_pdf.ingestion_jobs (document_id)
+    WHERE status IN ('pending', 'processing');
+
+CREATE INDEX IF NOT EXISTS ingestion_jobs_pending_idx
+    ON t_p56134400_telegram_ai_bot_pdf.ingestion_jobs (id)
+    WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS ingestion_jobs_tenant_processing_idx
+    ON t_p56134400_telegram_ai_bot_pdf.ingestion_jobs (tenant_id)
+    WHERE status = 'processing';
+
+-- Последняя задача документа (get-documents) и прогресс пакета переиндексации
+CREATE INDEX IF NOT EXISTS ingestion_jobs_document_idx
+    ON t_p56134400_telegram_ai_bot_pdf.ingestion_jobs (document_id, id DESC);
+
+CREATE INDEX IF NOT EXISTS ingestion_jobs_batch_idx
+    ON t_p56134400_telegram_ai_bot_pdf.ingestion_jobs (tenant_id, kind, batch_id);
@@ -0,0 +1,43 @@
+-- Строки тарифов из таблиц прайс-листов (категория номера, период, цена).
+-- process-pdf заменяет строки документа в одной транзакции с его чанками, chat отвечает на
+-- вопросы о ценах выборкой строк, чей период пересекается с датами из вопроса.
+-- Пустая граница периода — без ограничения (daterange с NULL-границей бесконечен).
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.tenant_tariff_rows (
+    id BIGSERIAL PRIMARY KEY,
+    tenant_id INTEGER NOT NULL,
+    document_id INTEGER NOT NULL,
+    room_category VARCHAR(200) NOT NULL,
+    date_from DATE,
+    date_to DATE,
+    price NUMERIC(12, 2) NOT NULL,
+    currency VARCHAR(8),
+    conditions VARCHAR(500),
+    page_number INTEGER,
+    source_text VARCHAR(500),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS tenant_tariff_rows_document_idx
+    ON t_p56134400_telegram_ai_bot_pdf.tenant_tariff_rows (document_id);
+
+-- Поиск по пересечению периодов: GiST по (tenant_id, daterange) через btree_gist,
+-- без расширения — GiST по daterange плюс btree по тенанту (планировщик объединяет их через BitmapAnd)
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'btree_gist') THEN
+        CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+        EXECUTE 'CREATE INDEX IF NOT EXISTS tenant_tariff_rows_period_gist_idx
+                 ON t_p56134400_telegram_ai_bot_pdf.tenant_tariff_rows
+                 USING gist (tenant_id, daterange(date_from, date_to, ''[]''))';
+    ELSE
+        RAISE NOTICE 'btree_gist is not available, using separate period and tenant indexes';
+
+        EXECUTE 'CREATE INDEX IF NOT EXISTS tenant_tariff_rows_period_idx
+                 ON t_p56134400_telegram_ai_bot_pdf.tenant_tariff_rows
+                 USING gist (daterange(date_from, date_to, ''[]''))';
+        EXECUTE 'CREATE INDEX IF NOT EXISTS tenant_tariff_rows_tenant_idx
+                 ON t_p56134400_telegram_ai_bot_pdf.tenant_tariff_rows (tenant_id)';
+    END IF;
+END $$;
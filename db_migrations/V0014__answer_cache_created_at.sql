@@ -0,0 +1,5 @@
+-- chat удаляет просроченные ответы (старше ANSWER_CACHE_TTL_HOURS) при каждой записи в кэш,
+-- индекс по created_at держит эту очистку дешёвой.
+
+CREATE INDEX IF NOT EXISTS answer_cache_created_at_idx
+    ON t_p56134400_telegram_ai_bot_pdf.answer_cache (created_at);
@@ -15,6 +15,23 @@ import Icon from '@/components/ui/icon';
 import { Document } from './types';
 import { useToast } from '@/hooks/use-toast';
 
+const INGESTION_STAGE_LABELS: Record<string, string> = {
+  fetch: 'Загрузка',
+  extract: 'Извлечение текста',
+  chunk: 'Разбиение',
+  embed: 'Векторизация',
+  write: 'Сохранение'
+};
+
+const ingestionLabel = (doc: Document) => {
+  const job = doc.ingestion;
+  if (!job || doc.status === 'ready') return null;
+  if (job.status === 'failed') return job.error || 'Ошибка обработки';
+  if (job.status === 'pending' && job.stage === 'fetch') return 'В очереди';
+  const label = INGESTION_STAGE_LABELS[job.stage] || job.stage;
+  return job.total > 0 ? `${label} ${job.done}/${job.total}` : label;
+};
+
 interface DocumentGridProps {
   documents: Document[];
   onDeleteDocument: (documentId: number) => Promise<any>;
@@ -73,11 +90,11 @@ const DocumentGrid = ({ documents, onDeleteDocument }: DocumentGridProps) => {
           >
             <div className="flex items-center gap-3">
               <div className={`w-9 h-9 rounded-lg flex items-center justify-center flex-shrink-0 ${
-                doc.status === 'ready' ? 'bg-blue-100' : 'bg-orange-100'
+                doc.status === 'ready' ? 'bg-blue-100' : doc.status === 'error' ? 'bg-red-100' : 'bg-orange-100'
               }`}>
-                <Icon name={doc.status === 'ready' ? 'FileCheck' : 'Loader2'} 
+                <Icon name={doc.status === 'ready' ? 'FileCheck' : doc.status === 'error' ? 'FileX' : 'Loader2'} 
                   size={16} 
-                  className={`${doc.status === 'ready' ? 'text-primary' : 'text-orange-600 animate-spin'}`} 
+                  className={`${doc.status === 'ready' ? 'text-primary' : doc.status === 'error' ? 'text-red-600' : 'text-orange-600 animate-spin'}`} 
                 />
               </div>
               <div className="flex-1 min-w-0">
@@ -85,6 +102,11 @@ const DocumentGrid = ({ documents, onDeleteDocument }: DocumentGridProps) => {
                 <div className="flex items-center gap-2 text-xs text-slate-600">
                   {doc.pages > 0 && <span>{doc.pages} стр.</span>}
                   <span>{doc.size}</span>
+                  {ingestionLabel(doc) && (
+                    <span className={doc.status === 'error' ? 'text-red-600 truncate' : 'text-orange-600 truncate'}>
+                      {ingestionLabel(doc)}
+                    </span>
+                  )}
                 </div>
               </div>
               <div className="flex items-center gap-1 flex-shrink-0">
@@ -97,7 +97,7 @@ export const DocumentsPanel = ({
         const data = await response.json();
         toast({
           title: '✓ Переиндексация запущена',
-          description: `Обработано документов: ${data.reindexed} из ${data.total}. Качество поиска улучшено.`,
+          description: `Документов в очереди: ${data.queued} из ${data.total}. Прогресс виден в списке документов.`,
           duration: 7000
         });
       } else {
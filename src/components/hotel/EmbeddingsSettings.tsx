@@ -122,7 +122,7 @@ const EmbeddingsSettings = ({ currentTenantId, tenantName, fz152Enabled = false
         const data = await response.json();
         toast({
           title: '✓ Переиндексация запущена',
-          description: `Обработано документов: ${data.reindexed} из ${data.total}`,
+          description: `Документов в очереди: ${data.queued} из ${data.total}. Прогресс виден в списке документов.`,
           duration: 7000
         });
       } else {
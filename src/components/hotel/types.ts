@@ -14,6 +14,15 @@ export interface Document {
   status: string;
   uploadedAt: string;
   fileUrl?: string;
+  ingestion?: DocumentIngestion;
+}
+
+export interface DocumentIngestion {
+  status: 'pending' | 'processing' | 'done' | 'failed' | 'cancelled';
+  stage: 'fetch' | 'extract' | 'chunk' | 'embed' | 'write' | 'done';
+  done: number;
+  total: number;
+  error?: string | null;
 }
 
 export interface QuickQuestion {
@@ -27,6 +27,12 @@ interface SystemStats {
   }>;
   database: {
     max_connections: number;
+    connections?: {
+      total: number;
+      active: number;
+      idle: number;
+    };
+    connections_usage_percent?: number;
     tables: number;
   };
   capacity: {
@@ -199,8 +205,10 @@ export const SystemMonitoringTab = () => {
 
           <div className="grid grid-cols-2 gap-4 pt-4 border-t">
             <div>
-              <p className="text-sm text-slate-600">Макс. подключений к БД</p>
-              <p className="text-2xl font-bold">{stats.database.max_connections}</p>
+              <p className="text-sm text-slate-600">Подключений к БД</p>
+              <p className="text-2xl font-bold">
+                {stats.database.connections ? `${stats.database.connections.total} / ` : ''}{stats.database.max_connections}
+              </p>
             </div>
             <div>
               <p className="text-sm text-slate-600">Таблиц в БД</p>
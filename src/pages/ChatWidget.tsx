@@ -38,12 +38,19 @@ interface QuickQuestion {
 
 const CHAT_API = import.meta.env.VITE_CHAT_API_URL || 'https://functions.poehali.dev/7b58f4fb-5db0-4f85-bb3b-55bafa4cbf73';
 const SETTINGS_API = import.meta.env.VITE_SETTINGS_API_URL || 'https://functions.poehali.dev/0534411b-d900-45d2-9082-a9485b33cf20';
+const STREAM_POLL_INTERVAL_MS = 400;
+
+const createStreamId = () =>
+  typeof crypto !== 'undefined' && 'randomUUID' in crypto
+    ? crypto.randomUUID()
+    : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
 
 const ChatWidget = () => {
   const { tenantSlug } = useParams();
   const [messages, setMessages] = useState<Message[]>([]);
   const [inputMessage, setInputMessage] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  const [streamingMessageId, setStreamingMessageId] = useState<string | null>(null);
   const [pageSettings, setPageSettings] = useState<PageSettings | null>(null);
   const [quickQuestions, setQuickQuestions] = useState<QuickQuestion[]>([]);
   const [isInitializing, setIsInitializing] = useState(true);
@@ -145,13 +152,67 @@ const ChatWidget = () => {
     setInputMessage('');
     setIsLoading(true);
 
+    const streamId = createStreamId();
+    const assistantId = (Date.now() + 1).toString();
+    let streamDone = false;
+
+    // Пока основной запрос генерирует ответ, опрашиваем накопленный текст и рисуем его по мере появления
+    const pollStream = async () => {
+      while (!streamDone) {
+        await new Promise(resolve => setTimeout(resolve, STREAM_POLL_INTERVAL_MS));
+        if (streamDone) break;
+        try {
+          const pollResponse = await fetch(CHAT_API, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ action: 'stream_poll', streamId })
+          });
+          if (!pollResponse.ok) continue;
+          const pollData = await pollResponse.json();
+          if (streamDone || !pollData.content) continue;
+          setStreamingMessageId(assistantId);
+          setMessages(prev => {
+            const partialMessage: Message = {
+              id: assistantId,
+              role: 'assistant',
+              content: pollData.content,
+              timestamp: new Date()
+            };
+            return prev.some(m => m.id === assistantId)
+              ? prev.map(m => (m.id === assistantId ? partialMessage : m))
+              : [...prev, partialMessage];
+          });
+          if (pollData.status !== 'streaming') break;
+        } catch (pollError) {
+          console.error('Ошибка получения потока:', pollError);
+        }
+      }
+    };
+
+    const upsertAssistantMessage = (content: string) => {
+      const assistantMessage: Message = {
+        id: assistantId,
+        role: 'assistant',
+        content,
+        timestamp: new Date()
+      };
+      setMessages(prev =>
+        prev.some(m => m.id === assistantId)
+          ? prev.map(m => (m.id === assistantId ? assistantMessage : m))
+          : [...prev, assistantMessage]
+      );
+    };
+
     try {
+      pollStream();
       const response = await fetch(CHAT_API, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
           message: inputMessage,
           tenantSlug: tenantSlug,
+          stream: true,
+          streamId,
           conversationHistory: messages.map(m => ({
             role: m.role,
             content: m.content
@@ -162,25 +223,15 @@ const ChatWidget = () => {
       if (!response.ok) throw new Error('Failed to send message');
 
       const data = await response.json();
-      
-      const assistantMessage: Message = {
-        id: (Date.now() + 1).toString(),
-        role: 'assistant',
-        content: data.message || data.response || 'Извините, не удалось получить ответ.',
-        timestamp: new Date()
-      };
-
-      setMessages(prev => [...prev, assistantMessage]);
+      streamDone = true;
+      upsertAssistantMessage(data.message || data.response || 'Извините, не удалось получить ответ.');
     } catch (error) {
       console.error('Ошибка отправки сообщения:', error);
-      const errorMessage: Message = {
-        id: (Date.now() + 1).toString(),
-        role: 'assistant',
-        content: 'Произошла ошибка. Попробуйте позже.',
-        timestamp: new Date()
-      };
-      setMessages(prev => [...prev, errorMessage]);
+      streamDone = true;
+      upsertAssistantMessage('Произошла ошибка. Попробуйте позже.');
     } finally {
+      streamDone = true;
+      setStreamingMessageId(null);
       setIsLoading(false);
     }
   };
@@ -299,7 +350,7 @@ const ChatWidget = () => {
                   </div>
                 </div>
               ))}
-              {isLoading && (
+              {isLoading && !streamingMessageId && (
                 <div className="flex justify-start">
                   <div className="bg-gray-100 rounded-2xl px-4 py-3 flex items-center gap-2">
                     <span className="text-gray-600">печатает</span>
@@ -2,6 +2,68 @@ import { Message, BACKEND_URLS } from '@/components/hotel/types';
 import { authenticatedFetch, getTenantId, isSuperAdmin } from '@/lib/auth';
 import { UseIndexActionsParams, IndexActions, PublicContentResponse } from '../types/index.types';
 
+const LEGACY_UPLOAD_MAX_SIZE = 10 * 1024 * 1024;
+
+const readFileAsBase64 = (file: File) => new Promise<string>((resolve, reject) => {
+  const reader = new FileReader();
+  reader.onload = (e) => {
+    const base64 = e.target?.result as string;
+    resolve(base64.split(',')[1]);
+  };
+  reader.onerror = reject;
+  reader.readAsDataURL(file);
+});
+
+// Файл идёт напрямую в бакет по presigned URL, функция только регистрирует документ.
+// Если бакет недоступен из браузера (сеть, CORS), небольшие файлы уходят прежним способом в base64.
+const uploadPdfFile = async (uploadUrl: string, file: File): Promise<Response> => {
+  const initResponse = await authenticatedFetch(uploadUrl, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ action: 'init', fileName: file.name, fileSize: file.size })
+  });
+  if (!initResponse.ok) {
+    return initResponse;
+  }
+  const initData = await initResponse.json();
+
+  try {
+    const putResponse = await fetch(initData.uploadUrl, {
+      method: initData.method,
+      headers: initData.headers,
+      body: file
+    });
+    if (!putResponse.ok) {
+      throw new Error(`Storage upload failed: ${putResponse.status}`);
+    }
+  } catch (error) {
+    if (file.size > LEGACY_UPLOAD_MAX_SIZE) {
+      throw error;
+    }
+    console.warn('[PDF Upload] Direct upload failed, falling back to base64:', error);
+    return authenticatedFetch(uploadUrl, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        fileName: file.name,
+        fileData: await readFileAsBase64(file),
+        category: 'Общая'
+      })
+    });
+  }
+
+  return authenticatedFetch(uploadUrl, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      action: 'complete',
+      fileKey: initData.fileKey,
+      fileName: file.name,
+      category: 'Общая'
+    })
+  });
+};
+
 export const useIndexActions = (params: UseIndexActionsParams): IndexActions => {
   const {
     messages,
@@ -204,28 +266,9 @@ export const useIndexActions = (params: UseIndexActionsParams): IndexActions =>
 
     for (const file of pdfFiles) {
       try {
-        const base64Data = await new Promise<string>((resolve, reject) => {
-          const reader = new FileReader();
-          reader.onload = (e) => {
-            const base64 = e.target?.result as string;
-            resolve(base64.split(',')[1]);
-          };
-          reader.onerror = reject;
-          reader.readAsDataURL(file);
-        });
-
         const tenantId = currentTenantId || getTenantId();
         const uploadUrl = tenantId ? `${BACKEND_URLS.uploadPdf}?tenant_id=${tenantId}` : BACKEND_URLS.uploadPdf;
-        const uploadResponse = await authenticatedFetch(uploadUrl, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            fileName: file.name,
-            fileData: base64Data,
-            category: 'Общая'
-          })
-        });
-
+        const uploadResponse = await uploadPdfFile(uploadUrl, file);
         const uploadData = await uploadResponse.json();
 
         if (!uploadResponse.ok) {
@@ -238,39 +281,8 @@ export const useIndexActions = (params: UseIndexActionsParams): IndexActions =>
           throw new Error(errorMsg);
         }
 
-        const processUrl = tenantId ? `${BACKEND_URLS.processPdf}?tenant_id=${tenantId}` : BACKEND_URLS.processPdf;
-        const processResponse = await authenticatedFetch(processUrl, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ documentId: uploadData.documentId })
-        });
-
-        let processData;
-        try {
-          const responseText = await processResponse.text();
-          console.log('[PDF Process] Response text:', responseText);
-          processData = responseText ? JSON.parse(responseText) : {};
-        } catch (parseError) {
-          console.error('[PDF Process] JSON parse error:', parseError);
-          toast({
-            title: `Ошибка при обработке ${file.name}`,
-            description: 'Некорректный ответ сервера',
-            variant: 'destructive'
-          });
-          throw new Error('Invalid server response');
-        }
-
-        if (processResponse.ok) {
-          successCount++;
-        } else {
-          const errorMsg = processData.error || 'Ошибка обработки';
-          toast({
-            title: `Ошибка при обработке ${file.name}`,
-            description: errorMsg,
-            variant: 'destructive'
-          });
-          throw new Error(errorMsg);
-        }
+        // Документ уже в очереди индексации: прогресс приходит в get-documents
+        successCount++;
       } catch (error: any) {
         console.error(`Error uploading ${file.name}:`, error);
         errorCount++;